@@ -1,29 +1,112 @@
 """The scrobbler integration."""
 
 import asyncio
+from functools import partial
+from importlib import import_module
 import logging
+from time import perf_counter
+from types import ModuleType
 
 from homeassistant import config_entries, core
-from homeassistant.const import Platform
+from homeassistant.const import CONF_API_KEY, EVENT_HOMEASSISTANT_STOP, Platform
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.dispatcher import async_dispatcher_send
 
-from .const import DOMAIN
+from .api import ClientRegistry
+from .const import (
+    CONF_API_SECRET,
+    CONF_SESSION_KEY,
+    DATA_CLIENTS,
+    DATA_CORRECTIONS,
+    DATA_HISTORY,
+    DATA_HUB,
+    DATA_METRICS,
+    DATA_QUEUES,
+    DOMAIN,
+    SIGNAL_OPTIONS_UPDATED,
+)
+from .metrics import ScrobblerMetrics
 
 _LOGGER = logging.getLogger(__name__)
 
-PLATFORMS: list[Platform] = [Platform.MEDIA_PLAYER]
+# the scrobbler itself is a sensor showing the track it follows
+PLATFORMS: list[Platform] = [Platform.SENSOR]
+
+# options that can't be applied to the running entry
+RELOAD_KEYS = (CONF_API_KEY, CONF_API_SECRET)
+
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+
+async def _async_import(hass: core.HomeAssistant, module: str) -> ModuleType:
+    """Import a module of the integration once it is needed, off the event loop.
+
+    Loading the integration, e.g. to show the config flow, then doesn't import
+    the history database, the player hub or the services.
+    """
+    return await hass.async_add_import_executor_job(
+        import_module, f"{__name__}.{module}"
+    )
+
+
+async def async_setup(hass: core.HomeAssistant, config: dict) -> bool:
+    """Set up the local history and its services."""
+    history = (await _async_import(hass, "history")).ScrobbleHistory(hass)
+    hass.data.setdefault(DOMAIN, {})[DATA_HISTORY] = history
+
+    async def _async_close_history(_event: core.Event) -> None:
+        await history.async_close()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _async_close_history)
+    (await _async_import(hass, "services")).async_setup_services(hass)
+    return True
 
 
 async def async_setup_entry(
     hass: core.HomeAssistant, entry: config_entries.ConfigEntry
 ) -> bool:
     """Set up platform from a ConfigEntry."""
+    started = perf_counter()
     hass.data.setdefault(DOMAIN, {})
     hass.data[DOMAIN][entry.entry_id] = entry.data
     hass_data = dict(entry.data)
     hass.data[DOMAIN][entry.entry_id] = hass_data
+
+    if DATA_CLIENTS not in hass.data[DOMAIN]:
+        # the HTTP session is only needed by the first request to Last.fm
+        hass.data[DOMAIN][DATA_CLIENTS] = ClientRegistry(
+            partial(async_get_clientsession, hass)
+        )
+    if DATA_HUB not in hass.data[DOMAIN]:
+        hass.data[DOMAIN][DATA_HUB] = (await _async_import(hass, "hub")).PlayerHub(hass)
+    if DATA_CORRECTIONS not in hass.data[DOMAIN]:
+        corrections = (await _async_import(hass, "corrections")).CorrectionCache(hass)
+        await corrections.async_load()
+        hass.data[DOMAIN][DATA_CORRECTIONS] = corrections
+    client = hass.data[DOMAIN][DATA_CLIENTS].acquire(
+        hass_data[CONF_API_KEY], hass_data[CONF_API_SECRET]
+    )
+    metrics = ScrobblerMetrics()
+    hass.data[DOMAIN].setdefault(DATA_METRICS, {})[entry.entry_id] = metrics
+    queue = (await _async_import(hass, "scrobble_queue")).ScrobbleQueue(
+        hass,
+        entry.entry_id,
+        client,
+        hass_data[CONF_SESSION_KEY],
+        metrics,
+        hass.data[DOMAIN][DATA_HISTORY],
+    )
+    await queue.async_load()
+    hass.data[DOMAIN].setdefault(DATA_QUEUES, {})[entry.entry_id] = queue
+    # submit whatever could not be scrobbled before the last shutdown
+    queue.async_schedule_flush()
+
     entry.async_on_unload(entry.add_update_listener(options_update_listener))
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
+    metrics.setup_time = (perf_counter() - started) * 1000
+    _LOGGER.debug("Set up %s in %.1f ms", entry.title, metrics.setup_time)
     return True
 
 
@@ -32,7 +115,27 @@ async def options_update_listener(
 ):
     """Handle options update."""
     _LOGGER.debug("Handle options update")
-    await hass.config_entries.async_reload(config_entry.entry_id)
+    config = hass.data[DOMAIN][config_entry.entry_id]
+    new_config = dict(config_entry.data)
+    if new_config == config:
+        return
+
+    if any(new_config.get(key) != config.get(key) for key in RELOAD_KEYS):
+        # only new API credentials require a new Last.fm client
+        await hass.config_entries.async_reload(config_entry.entry_id)
+        return
+
+    _LOGGER.debug("Applying options of %s without reloading", config_entry.title)
+    hass.data[DOMAIN][config_entry.entry_id] = new_config
+    queue = hass.data[DOMAIN][DATA_QUEUES][config_entry.entry_id]
+    if (session_key := queue.session_key) != new_config[CONF_SESSION_KEY]:
+        queue.session_key = new_config[CONF_SESSION_KEY]
+        # e.g. after a reauth: submit what the old session key couldn't
+        queue.async_schedule_flush()
+        _async_forget_session(hass, new_config, session_key)
+    async_dispatcher_send(
+        hass, SIGNAL_OPTIONS_UPDATED.format(config_entry.entry_id), new_config
+    )
 
 
 async def async_unload_entry(
@@ -43,6 +146,37 @@ async def async_unload_entry(
 
     # Remove config entry from domain.
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        config = hass.data[DOMAIN].pop(entry.entry_id)
+        await hass.data[DOMAIN][DATA_QUEUES].pop(entry.entry_id).async_shutdown()
+        del hass.data[DOMAIN][DATA_METRICS][entry.entry_id]
+        _async_forget_session(hass, config, config[CONF_SESSION_KEY])
+        hass.data[DOMAIN][DATA_CLIENTS].release(
+            config[CONF_API_KEY], config[CONF_API_SECRET]
+        )
 
     return unload_ok
+
+
+@core.callback
+def _async_forget_session(
+    hass: core.HomeAssistant, config: dict, session_key: str
+) -> None:
+    """Drop the circuit of a session key unless another entry still uses it."""
+    if any(
+        queue.session_key == session_key
+        for queue in hass.data[DOMAIN][DATA_QUEUES].values()
+    ):
+        return
+    hass.data[DOMAIN][DATA_CLIENTS].get(
+        config[CONF_API_KEY], config[CONF_API_SECRET]
+    ).forget(session_key)
+
+
+async def async_remove_entry(
+    hass: core.HomeAssistant, entry: config_entries.ConfigEntry
+) -> None:
+    """Remove the stored scrobble queue and history of a deleted config entry."""
+    await (await _async_import(hass, "scrobble_queue")).async_remove_queue(
+        hass, entry.entry_id
+    )
+    await hass.data[DOMAIN][DATA_HISTORY].async_delete_entry(entry.entry_id)
@@ -0,0 +1,562 @@
+"""Async Last.fm API client for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Mapping, Sequence
+import hashlib
+import logging
+import time
+from typing import Any
+
+import aiohttp
+
+from .metrics import ApiMetrics
+
+_LOGGER = logging.getLogger(__name__)
+
+API_URL = "https://ws.audioscrobbler.com/2.0/"
+AUTH_URL = "https://www.last.fm/api/auth/"
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Last.fm allows 5 requests per second per originating IP, averaged over 5 minutes
+DEFAULT_RATE = 4
+DEFAULT_BURST = 10
+# how long every client backs off after an error 29 (rate limit exceeded)
+RATE_LIMIT_PAUSE = 30
+# identical now playing updates of one account within this window are sent once
+NOW_PLAYING_COALESCE_WINDOW = 60
+# scrobbles per page of user.getRecentTracks, the most Last.fm returns
+RECENT_TRACKS_LIMIT = 200
+ERROR_AUTHENTICATION_FAILED = 4
+ERROR_INVALID_PARAMETERS = 6
+ERROR_OPERATION_FAILED = 8
+ERROR_INVALID_SESSION_KEY = 9
+ERROR_INVALID_API_KEY = 10
+ERROR_SERVICE_OFFLINE = 11
+ERROR_INVALID_SIGNATURE = 13
+ERROR_UNAUTHORIZED_TOKEN = 14
+ERROR_TEMPORARILY_UNAVAILABLE = 16
+ERROR_SUSPENDED_API_KEY = 26
+ERROR_RATE_LIMIT_EXCEEDED = 29
+# errors caused by wrong credentials
+AUTH_ERRORS = (
+    ERROR_AUTHENTICATION_FAILED,
+    ERROR_INVALID_SESSION_KEY,
+    ERROR_INVALID_API_KEY,
+    ERROR_INVALID_SIGNATURE,
+    ERROR_SUSPENDED_API_KEY,
+)
+# errors after which the same request may succeed later
+RETRYABLE_ERRORS = (
+    ERROR_OPERATION_FAILED,
+    ERROR_SERVICE_OFFLINE,
+    ERROR_TEMPORARILY_UNAVAILABLE,
+    ERROR_RATE_LIMIT_EXCEEDED,
+)
+
+# consecutive failures of an account's requests after which its circuit opens
+BREAKER_THRESHOLD = 3
+# seconds an open circuit holds requests back, doubled by each failed probe
+BREAKER_MIN_BACKOFF = 30
+BREAKER_MAX_BACKOFF = 1800
+
+# parameters that are never part of the api_sig, see https://www.last.fm/api/authspec
+UNSIGNED_PARAMS = ("format", "callback")
+
+
+class LastFMError(Exception):
+    """Base class for errors talking to Last.fm."""
+
+    # whether the same request may succeed later
+    retryable = True
+    # whether Last.fm rejected the credentials
+    auth = False
+
+
+class LastFMConnectionError(LastFMError):
+    """Last.fm could not be reached or returned something unreadable."""
+
+
+class LastFMApiError(LastFMError):
+    """Last.fm answered with an error payload."""
+
+    def __init__(self, code: int, message: str) -> None:
+        """Initialize the error with the Last.fm error code."""
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+        self.retryable = code in RETRYABLE_ERRORS
+        self.auth = code in AUTH_ERRORS
+
+
+class LastFMCircuitOpenError(LastFMError):
+    """A request was held back as Last.fm kept failing the account's requests."""
+
+    def __init__(self, retry_in: float) -> None:
+        """Initialize the error with the seconds until Last.fm is probed again."""
+        super().__init__(f"Last.fm is failing, probing again in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def sign(params: dict[str, str], api_secret: str) -> str:
+    """Return the api_sig for a request, the same way pylast computes it."""
+    payload = "".join(
+        f"{key}{params[key]}" for key in sorted(params) if key not in UNSIGNED_PARAMS
+    )
+    return hashlib.md5((payload + api_secret).encode("utf-8")).hexdigest()
+
+
+class RateLimiter:
+    """Token bucket shared by every client talking to Last.fm."""
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST) -> None:
+        """Initialize the bucket, ``rate`` being in requests per second."""
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def async_acquire(self) -> None:
+        """Wait until a request may be sent."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self._burst, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all requests for ``seconds``."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """Stop calling Last.fm for an account while its requests keep failing.
+
+    After ``BREAKER_THRESHOLD`` consecutive retryable failures, or a single
+    authentication failure, requests fail right away without reaching
+    Last.fm. Once the backoff expired, a single request probes whether the
+    account works again: its success closes the circuit, its failure doubles
+    the backoff. Errors about one request, e.g. invalid parameters, prove
+    that Last.fm answers and count as a success.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the closed circuit."""
+        self.failures = 0
+        self.backoff = 0.0
+        self.probing = False
+        self._open_until: float | None = None
+        # the authentication error that opened the circuit, raised while open
+        self._auth_error: LastFMApiError | None = None
+
+    @property
+    def state(self) -> str:
+        """Return closed, open or half open (waiting for a probe)."""
+        if self._open_until is None:
+            return "closed"
+        if self.probing or time.monotonic() >= self._open_until:
+            return "half_open"
+        return "open"
+
+    def before_request(self) -> bool:
+        """Raise if a request must not be sent; return whether it is the probe."""
+        if self._open_until is None:
+            return False
+        if (retry_in := self._open_until - time.monotonic()) > 0 or self.probing:
+            if (error := self._auth_error) is not None:
+                # the credentials are still rejected, as far as we know
+                raise LastFMApiError(error.code, error.message)
+            raise LastFMCircuitOpenError(max(retry_in, 0))
+        self.probing = True
+        return True
+
+    def record_success(self) -> None:
+        """Close the circuit."""
+        if self._open_until is not None:
+            _LOGGER.info("Last.fm accepts requests again, closing the circuit")
+        self.failures = 0
+        self.backoff = 0.0
+        self._open_until = None
+        self._auth_error = None
+
+    def record_failure(self, error: LastFMError) -> None:
+        """Count a failed request, opening the circuit if the account is failing."""
+        if not error.retryable and not error.auth:
+            self.record_success()
+            return
+        if (
+            isinstance(error, LastFMApiError)
+            and error.code == ERROR_RATE_LIMIT_EXCEEDED
+        ):
+            # the rate limiter holds every request back already
+            return
+        self.failures += 1
+        if error.auth:
+            self._auth_error = error
+            self.backoff = BREAKER_MAX_BACKOFF
+            _LOGGER.error(
+                "Last.fm rejected the credentials, holding requests back for %ss: %s",
+                self.backoff,
+                error,
+            )
+        elif self._open_until is not None or self.failures >= BREAKER_THRESHOLD:
+            self._auth_error = None
+            self.backoff = min(
+                max(self.backoff * 2, BREAKER_MIN_BACKOFF), BREAKER_MAX_BACKOFF
+            )
+            _LOGGER.warning(
+                "%s Last.fm requests failed in a row, holding them back for %ss: %s",
+                self.failures,
+                self.backoff,
+                error,
+            )
+        else:
+            return
+        self._open_until = time.monotonic() + self.backoff
+
+    def diagnostics(self) -> dict[str, Any]:
+        """Return the state of the circuit for the diagnostics download."""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "backoff": self.backoff,
+            "auth_error": (None if self._auth_error is None else str(self._auth_error)),
+        }
+
+
+class LastFMClient:
+    """Minimal asyncio Last.fm client sharing an aiohttp session."""
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession | Callable[[], aiohttp.ClientSession],
+        api_key: str,
+        api_secret: str,
+        *,
+        api_url: str = API_URL,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        rate_limiter: RateLimiter | None = None,
+    ) -> None:
+        """Initialize the client.
+
+        ``session`` can be a function returning it, called on the first
+        request. ``api_url`` can point to a local stub server for testing.
+        """
+        self._session = session
+        self._api_key = api_key
+        self._api_secret = api_secret
+        self._api_url = api_url
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rate_limiter = rate_limiter or RateLimiter()
+        # session key -> (track, sent at, response) of the last now playing update
+        self._now_playing: dict[str, tuple[tuple, float, dict[str, Any]]] = {}
+        self._now_playing_pending: dict[tuple, asyncio.Task] = {}
+        # session key, or None for unauthenticated requests -> its circuit
+        self._breakers: dict[str | None, CircuitBreaker] = {}
+        self.metrics = ApiMetrics()
+
+    def breaker(self, session_key: str | None) -> CircuitBreaker:
+        """Return the circuit breaker of an account."""
+        if (breaker := self._breakers.get(session_key)) is None:
+            breaker = self._breakers[session_key] = CircuitBreaker()
+        return breaker
+
+    def forget(self, session_key: str) -> None:
+        """Drop the state of an account no config entry uses anymore."""
+        self._breakers.pop(session_key, None)
+        self._now_playing.pop(session_key, None)
+
+    async def async_request(
+        self,
+        method: str,
+        params: dict[str, Any] | None = None,
+        *,
+        session_key: str | None = None,
+        signed: bool = False,
+    ) -> dict[str, Any]:
+        """Call an API method and return the decoded JSON response.
+
+        Raise ``LastFMCircuitOpenError`` without calling Last.fm while the
+        circuit of the account is open.
+        """
+        data = {
+            key: str(value)
+            for key, value in (params or {}).items()
+            if value is not None
+        }
+        data["method"] = method
+        data["api_key"] = self._api_key
+        if session_key is not None:
+            data["sk"] = session_key
+        if signed or session_key is not None:
+            data["api_sig"] = sign(data, self._api_secret)
+        data["format"] = "json"
+
+        breaker = self.breaker(session_key)
+        try:
+            probe = breaker.before_request()
+        except LastFMError:
+            self.metrics.rejected += 1
+            raise
+        try:
+            payload = await self._async_post(method, data)
+        except LastFMError as ex:
+            breaker.record_failure(ex)
+            raise
+        else:
+            breaker.record_success()
+        finally:
+            if probe:
+                # a cancelled probe lets the next request probe
+                breaker.probing = False
+        return payload
+
+    async def _async_post(self, method: str, data: dict[str, str]) -> dict[str, Any]:
+        """Send a request once the rate limiter allows it; raise Last.fm errors."""
+        await self._rate_limiter.async_acquire()
+        metrics = self.metrics
+        metrics.requests += 1
+        if callable(self._session):
+            self._session = self._session()
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                async with self._session.post(
+                    self._api_url, data=data, timeout=self._timeout
+                ) as response:
+                    payload = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                metrics.errors["connection"] += 1
+                raise LastFMConnectionError(f"Error calling {method}: {ex!r}") from ex
+            except ValueError as ex:
+                metrics.errors["malformed"] += 1
+                raise LastFMConnectionError(
+                    f"Malformed response to {method}: {ex}"
+                ) from ex
+            metrics.latency.observe(time.monotonic() - started)
+
+        if not isinstance(payload, dict):
+            metrics.errors["malformed"] += 1
+            raise LastFMConnectionError(f"Malformed response to {method}: {payload!r}")
+        if "error" in payload:
+            code = int(payload["error"])
+            metrics.errors[str(code)] += 1
+            if code == ERROR_RATE_LIMIT_EXCEEDED:
+                _LOGGER.warning(
+                    "Last.fm rate limit exceeded, pausing requests for %ss",
+                    RATE_LIMIT_PAUSE,
+                )
+                self._rate_limiter.pause(RATE_LIMIT_PAUSE)
+            raise LastFMApiError(code, payload.get("message", ""))
+        return payload
+
+    async def async_get_token(self) -> str:
+        """Request a token for the desktop authentication flow."""
+        response = await self.async_request("auth.getToken", signed=True)
+        return response["token"]
+
+    def auth_url(self, token: str) -> str:
+        """Return the page on which the user grants access to a token."""
+        return f"{AUTH_URL}?api_key={self._api_key}&token={token}"
+
+    async def async_get_session(self, token: str) -> str:
+        """Exchange an authorized token for a session key."""
+        response = await self.async_request(
+            "auth.getSession", {"token": token}, signed=True
+        )
+        return response["session"]["key"]
+
+    async def async_get_username(self, session_key: str) -> str:
+        """Return the user behind a session key, validating all credentials."""
+        response = await self.async_request("user.getInfo", session_key=session_key)
+        return response["user"]["name"]
+
+    async def async_get_recent_tracks(
+        self, session_key: str, user: str, start: int, end: int
+    ) -> list[tuple[str, str, int]]:
+        """Return the artist, title and timestamp of the scrobbles of ``user``.
+
+        Every page of the scrobbles between the ``start`` and ``end`` UNIX
+        timestamps is requested.
+        """
+        scrobbles: list[tuple[str, str, int]] = []
+        page = pages = 1
+        while page <= pages:
+            response = await self.async_request(
+                "user.getRecentTracks",
+                {
+                    "user": user,
+                    "from": start,
+                    "to": end,
+                    "limit": RECENT_TRACKS_LIMIT,
+                    "page": page,
+                },
+                session_key=session_key,
+            )
+            recent = response["recenttracks"]
+            tracks = recent.get("track", [])
+            if isinstance(tracks, Mapping):
+                # a single track isn't wrapped in a list
+                tracks = [tracks]
+            scrobbles.extend(
+                (track["artist"]["#text"], track["name"], int(track["date"]["uts"]))
+                for track in tracks
+                # the track playing now has no date
+                if "date" in track
+            )
+            pages = int(recent["@attr"]["totalPages"])
+            page += 1
+        return scrobbles
+
+    async def async_get_track_info(self, artist: str, title: str) -> dict[str, Any]:
+        """Return what Last.fm knows about a track, autocorrecting its names."""
+        return await self.async_request(
+            "track.getInfo", {"artist": artist, "track": title, "autocorrect": 1}
+        )
+
+    async def async_update_now_playing(
+        self,
+        session_key: str,
+        artist: str,
+        title: str,
+        album: str | None = None,
+        duration: int | None = None,
+    ) -> dict[str, Any]:
+        """Set the now playing track of the account behind ``session_key``.
+
+        Several config entries can share an account: identical updates are
+        coalesced into a single request.
+        """
+        track = (artist, title, album)
+        sent = self._now_playing.get(session_key)
+        if (
+            sent is not None
+            and sent[0] == track
+            and time.monotonic() - sent[1] < NOW_PLAYING_COALESCE_WINDOW
+        ):
+            _LOGGER.debug("Now playing %s by %s was just sent, skipping", title, artist)
+            self.metrics.now_playing_coalesced += 1
+            return sent[2]
+
+        key = (session_key, *track)
+        if (task := self._now_playing_pending.get(key)) is None:
+            task = asyncio.create_task(
+                self.async_request(
+                    "track.updateNowPlaying",
+                    {
+                        "artist": artist,
+                        "track": title,
+                        "album": album,
+                        "duration": duration,
+                    },
+                    session_key=session_key,
+                )
+            )
+            self._now_playing_pending[key] = task
+            task.add_done_callback(lambda _: self._now_playing_pending.pop(key, None))
+        else:
+            self.metrics.now_playing_coalesced += 1
+        # shielded, so a cancelled caller doesn't cancel the update of the others
+        response = await asyncio.shield(task)
+        self._now_playing[session_key] = (track, time.monotonic(), response)
+        return response
+
+    async def async_scrobble(
+        self,
+        session_key: str,
+        artist: str,
+        title: str,
+        timestamp: int,
+        album: str | None = None,
+        duration: int | None = None,
+    ) -> dict[str, Any]:
+        """Scrobble a single track to the account behind ``session_key``."""
+        return await self.async_request(
+            "track.scrobble",
+            {
+                "artist": artist,
+                "track": title,
+                "timestamp": timestamp,
+                "album": album,
+                "duration": duration,
+            },
+            session_key=session_key,
+        )
+
+    async def async_scrobble_batch(
+        self, session_key: str, scrobbles: Sequence[Mapping[str, Any]]
+    ) -> dict[str, Any]:
+        """Scrobble up to 50 tracks in a single request.
+
+        Each scrobble is a mapping with ``artist``, ``track``, ``timestamp`` and
+        optionally ``album`` and ``duration``.
+        """
+        params: dict[str, Any] = {}
+        for index, scrobble in enumerate(scrobbles):
+            for key, value in scrobble.items():
+                params[f"{key}[{index}]"] = value
+        return await self.async_request(
+            "track.scrobble", params, session_key=session_key
+        )
+
+
+class ClientRegistry:
+    """One shared client per API key, used by all config entries."""
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession | Callable[[], aiohttp.ClientSession],
+        rate_limiter: RateLimiter | None = None,
+        *,
+        api_url: str = API_URL,
+    ) -> None:
+        """Initialize the registry; ``session`` is passed on to the clients.
+
+        ``api_url`` can point to a local stub server for testing.
+        """
+        self._session = session
+        self._rate_limiter = rate_limiter or RateLimiter()
+        self._api_url = api_url
+        self._clients: dict[tuple[str, str], LastFMClient] = {}
+        self._users: dict[tuple[str, str], int] = {}
+
+    def acquire(self, api_key: str, api_secret: str) -> LastFMClient:
+        """Return the client for an API key, creating it on first use."""
+        key = (api_key, api_secret)
+        if key not in self._clients:
+            self._clients[key] = LastFMClient(
+                self._session,
+                api_key,
+                api_secret,
+                api_url=self._api_url,
+                rate_limiter=self._rate_limiter,
+            )
+        self._users[key] = self._users.get(key, 0) + 1
+        return self._clients[key]
+
+    def get(self, api_key: str, api_secret: str) -> LastFMClient:
+        """Return the already acquired client for an API key."""
+        return self._clients[(api_key, api_secret)]
+
+    def release(self, api_key: str, api_secret: str) -> None:
+        """Drop the client for an API key once no config entry uses it."""
+        key = (api_key, api_secret)
+        self._users[key] -= 1
+        if not self._users[key]:
+            del self._users[key]
+            del self._clients[key]
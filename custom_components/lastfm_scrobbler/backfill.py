@@ -0,0 +1,310 @@
+"""Backfill of historical plays for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from collections.abc import AsyncIterator, Iterable
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from functools import partial
+import heapq
+import itertools
+import json
+import logging
+import time
+from typing import Any
+
+from homeassistant.const import CONF_API_KEY, CONF_ENTITY_ID
+from homeassistant.core import HomeAssistant, State
+from homeassistant.util import dt as dt_util
+
+from .api import LastFMClient, LastFMError
+from .const import (
+    CONF_API_SECRET,
+    CONF_CORRECT_METADATA,
+    CONF_SCROBBLE_ALL_PLAYERS,
+    CONF_SCROBBLE_PERCENTAGE,
+    CONF_SCROBBLE_STREAMS,
+    CONF_SESSION_KEY,
+    DATA_CLIENTS,
+    DATA_CORRECTIONS,
+    DATA_HISTORY,
+    DATA_HUB,
+    DATA_QUEUES,
+    DOMAIN,
+)
+from .corrections import CorrectionCache
+from .engine import PlayRebuilder, Scrobble, ScrobblerEngine
+from .history import KIND_SCROBBLE, ScrobbleHistory
+from .metadata import TrackInfo
+from .policies import ScrobblePolicies
+from .scrobble_queue import BATCH_SIZE, MAX_AGE, ScrobbleQueue, scrobble_results
+
+_LOGGER = logging.getLogger(__name__)
+
+EVENT_BACKFILL = f"{DOMAIN}_backfill"
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# a rebuilt play matches a known scrobble of the same track started this close
+DEDUP_TOLERANCE = 120
+# media_player history is loaded from the recorder one window at a time
+RECORDER_WINDOW = timedelta(hours=6)
+# lines of a history file read per executor job
+FILE_CHUNK = 1000
+
+RecordedState = tuple[str, str | None, dict[str, Any], datetime]
+
+
+@dataclass(slots=True)
+class BackfillProgress:
+    """Counters of a running backfill, fired with every batch."""
+
+    entry_id: str
+    status: str = STATUS_RUNNING
+    # rebuilt plays that crossed their scrobble threshold
+    plays: int = 0
+    scrobbled: int = 0
+    # submitted plays Last.fm ignored, e.g. for a timestamp in the future
+    ignored: int = 0
+    duplicates: int = 0
+    too_old: int = 0
+    error: str | None = None
+
+
+async def async_recorder_states(
+    hass: HomeAssistant, players: Iterable[str], start: datetime, end: datetime
+) -> AsyncIterator[RecordedState]:
+    """Yield the recorded states of media players in chronological order.
+
+    Every recorded update is loaded, not only the changes of the state
+    itself: a new track while the player keeps playing only changes its
+    attributes.
+    """
+    # imported here so the integration doesn't require the recorder
+    from homeassistant.components.recorder import get_instance, history
+
+    players = list(players)
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + RECORDER_WINDOW, end)
+
+        def _load(window_start: datetime = window_start, window_end=window_end):
+            return history.get_significant_states(
+                hass,
+                window_start,
+                window_end,
+                players,
+                # the state at the start of later windows was already seen
+                include_start_time_state=window_start == start,
+                significant_changes_only=False,
+            )
+
+        changes: dict[str, list[State]] = await get_instance(
+            hass
+        ).async_add_executor_job(_load)
+        for state in heapq.merge(
+            *changes.values(), key=lambda state: state.last_updated
+        ):
+            yield state.entity_id, state.state, state.attributes, state.last_updated
+        window_start = window_end
+
+
+async def async_file_states(
+    hass: HomeAssistant, path: str
+) -> AsyncIterator[RecordedState]:
+    """Yield the states of a JSON lines file, one state object per line."""
+    file = await hass.async_add_executor_job(partial(open, path, encoding="utf-8"))
+    try:
+        while lines := await hass.async_add_executor_job(file.readlines, FILE_CHUNK):
+            for line in lines:
+                if not line.strip():
+                    continue
+                state = json.loads(line)
+                updated = state.get("last_updated") or state["last_changed"]
+                if (when := dt_util.parse_datetime(updated)) is None:
+                    raise ValueError(f"Invalid timestamp {updated!r} in {path}")
+                yield (
+                    state["entity_id"],
+                    state["state"],
+                    state.get("attributes", {}),
+                    when,
+                )
+    finally:
+        await hass.async_add_executor_job(file.close)
+
+
+class Backfill:
+    """Rebuild the plays of a scrobbler from a history and submit the missing ones.
+
+    Plays are rebuilt with the threshold logic of the running scrobbler, then
+    submitted 50 at a time through the shared rate limited client. Plays
+    older than 14 days, which Last.fm rejects, are skipped, and so are plays
+    already scrobbled: those in the local history or the queue, and those
+    Last.fm lists for the account, e.g. scrobbled by another client or before
+    the local history existed.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry_id: str) -> None:
+        """Initialize the backfill of a config entry."""
+        config = hass.data[DOMAIN][entry_id]
+        self._hass = hass
+        self._session_key = config[CONF_SESSION_KEY]
+        self._client: LastFMClient = hass.data[DOMAIN][DATA_CLIENTS].get(
+            config[CONF_API_KEY], config[CONF_API_SECRET]
+        )
+        self._history: ScrobbleHistory = hass.data[DOMAIN][DATA_HISTORY]
+        self._queue: ScrobbleQueue = hass.data[DOMAIN][DATA_QUEUES][entry_id]
+        self.players: list[str] = config[CONF_ENTITY_ID]
+        # the Last.fm user of the session key, looked up with the first batch
+        self._user: str | None = None
+        self._rebuilder = PlayRebuilder(
+            ScrobblerEngine(
+                config[CONF_SCROBBLE_PERCENTAGE],
+                False,
+                # the normalizer of the running scrobbler, with its cache
+                hass.data[DOMAIN][DATA_HUB].normalizer(config),
+                config.get(CONF_SCROBBLE_ALL_PLAYERS, False),
+                config.get(CONF_SCROBBLE_STREAMS, False),
+                # only songs of streams already looked up are timed by duration
+                hass.data[DOMAIN][DATA_CORRECTIONS].duration,
+                ScrobblePolicies.from_config(config),
+            ),
+            self.players,
+        )
+        self._corrections: CorrectionCache | None = (
+            hass.data[DOMAIN][DATA_CORRECTIONS]
+            if config.get(CONF_CORRECT_METADATA, False)
+            else None
+        )
+        self.progress = BackfillProgress(entry_id)
+        self._batch: list[tuple[str, Scrobble]] = []
+        self._oldest_allowed = int(time.time()) - MAX_AGE
+
+    async def async_run(
+        self, states: AsyncIterator[RecordedState], end: datetime | None = None
+    ) -> None:
+        """Replay ``states``, up to ``end``, and submit the rebuilt plays."""
+        last: datetime | None = None
+        try:
+            async for entity_id, state, attributes, when in states:
+                await self._async_add(
+                    self._rebuilder.feed(entity_id, state, attributes, when)
+                )
+                last = when
+            # plays still running when the history ends may cross their threshold
+            if (end := end or last) is not None:
+                await self._async_add(self._rebuilder.advance(end))
+            if self._batch:
+                await self._async_submit()
+        except (LastFMError, OSError, ValueError, KeyError, TypeError) as ex:
+            self.progress.status = STATUS_FAILED
+            self.progress.error = str(ex)
+            _LOGGER.error("Backfill failed: %s", ex)
+        else:
+            self.progress.status = STATUS_DONE
+        self._async_report()
+
+    async def _async_add(self, scrobbles: list[tuple[str, Scrobble]]) -> None:
+        """Add rebuilt plays to the batch, submitting it once full."""
+        for player, scrobble in scrobbles:
+            self.progress.plays += 1
+            if scrobble["timestamp"] < self._oldest_allowed:
+                self.progress.too_old += 1
+                continue
+            self._batch.append((player, scrobble))
+            if len(self._batch) == BATCH_SIZE:
+                await self._async_submit()
+
+    async def _async_submit(self) -> None:
+        """Submit the plays of the batch that weren't scrobbled yet."""
+        batch, self._batch = self._batch, []
+        if self._corrections is not None:
+            # the history holds the corrected metadata
+            batch = [
+                (player, await self._async_correct(scrobble))
+                for player, scrobble in batch
+            ]
+        timestamps = [scrobble["timestamp"] for _, scrobble in batch]
+        start = min(timestamps) - DEDUP_TOLERANCE
+        end = max(timestamps) + DEDUP_TOLERANCE
+        if self._user is None:
+            self._user = await self._client.async_get_username(self._session_key)
+        scrobbled = await self._client.async_get_recent_tracks(
+            self._session_key, self._user, start, end
+        )
+        recorded_locally = await self._history.async_scrobbled(
+            self.progress.entry_id, start, end
+        )
+        # queued plays are only recorded once Last.fm accepted them
+        queued = [
+            (scrobble["artist"], scrobble["track"], scrobble["timestamp"])
+            for scrobble in self._queue.pending
+        ]
+        # Last.fm may list corrected names in another case
+        recorded: dict[tuple[str, str], list[int]] = {}
+        for artist, title, timestamp in itertools.chain(
+            scrobbled, recorded_locally, queued
+        ):
+            recorded.setdefault((artist.casefold(), title.casefold()), []).append(
+                timestamp
+            )
+        missing = [
+            (player, scrobble)
+            for player, scrobble in batch
+            if not any(
+                abs(timestamp - scrobble["timestamp"]) <= DEDUP_TOLERANCE
+                for timestamp in recorded.get(
+                    (scrobble["artist"].casefold(), scrobble["track"].casefold()), ()
+                )
+            )
+        ]
+        self.progress.duplicates += len(batch) - len(missing)
+        if missing:
+            scrobbles = [scrobble for _, scrobble in missing]
+            response = await self._client.async_scrobble_batch(
+                self._session_key, scrobbles
+            )
+            for (player, scrobble), accepted in zip(
+                missing, scrobble_results(scrobbles, response), strict=True
+            ):
+                if not accepted:
+                    self.progress.ignored += 1
+                    continue
+                self.progress.scrobbled += 1
+                self._history.async_record(
+                    self.progress.entry_id,
+                    player,
+                    KIND_SCROBBLE,
+                    scrobble["artist"],
+                    scrobble["track"],
+                    scrobble["album"],
+                    scrobble["duration"],
+                    scrobble["timestamp"],
+                )
+        self._async_report()
+
+    async def _async_correct(self, scrobble: Scrobble) -> Scrobble:
+        """Return a play with the canonical Last.fm metadata, if known."""
+        corrected = await self._corrections.async_correct(
+            self._client,
+            TrackInfo(
+                scrobble["artist"],
+                scrobble["track"],
+                scrobble["album"],
+                scrobble["duration"],
+            ),
+        )
+        return Scrobble(
+            artist=corrected.artist,
+            track=corrected.title,
+            album=corrected.album,
+            duration=corrected.duration,
+            timestamp=scrobble["timestamp"],
+        )
+
+    def _async_report(self) -> None:
+        """Fire the progress of the backfill."""
+        _LOGGER.info("Backfill progress: %s", self.progress)
+        self._hass.bus.async_fire(EVENT_BACKFILL, asdict(self.progress))
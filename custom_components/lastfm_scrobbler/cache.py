@@ -0,0 +1,56 @@
+"""Caches used by the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import Hashable, Iterator
+from typing import Generic, TypeVar
+
+_KT = TypeVar("_KT", bound=Hashable)
+_VT = TypeVar("_VT")
+
+_MISSING = object()
+
+
+class LRUCache(Generic[_KT, _VT]):
+    """Mapping keeping the ``maxsize`` most recently used items."""
+
+    def __init__(self, maxsize: int) -> None:
+        """Initialize the cache."""
+        self.maxsize = maxsize
+        self._data: OrderedDict[_KT, _VT] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """Return the number of cached items."""
+        return len(self._data)
+
+    def get(self, key: _KT, default: _VT | None = None) -> _VT | None:
+        """Return a cached item, marking it as recently used."""
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        """Return whether ``key`` is cached, without touching its recency."""
+        return key in self._data
+
+    def put(self, key: _KT, value: _VT) -> None:
+        """Cache an item, evicting the least recently used one if full."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def items(self) -> Iterator[tuple[_KT, _VT]]:
+        """Iterate over the cached items, least recently used first."""
+        return iter(self._data.items())
+
+    def clear(self) -> None:
+        """Remove all items."""
+        self._data.clear()
@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+from collections.abc import Mapping
+import hashlib
 import logging
 from typing import Any
 
@@ -10,32 +12,110 @@ import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.config_entries import ConfigFlow, ConfigFlowResult
 from homeassistant.const import CONF_API_KEY, CONF_ENTITY_ID, CONF_NAME
-from homeassistant.core import callback
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError, TemplateError
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.selector import (
     EntityFilterSelectorConfig,
     EntitySelector,
     EntitySelectorConfig,
+    NumberSelector,
+    NumberSelectorConfig,
+    NumberSelectorMode,
+    ObjectSelector,
+    SelectSelector,
+    SelectSelectorConfig,
+    TemplateSelector,
+    TextSelector,
+    TextSelectorConfig,
+    TimeSelector,
 )
+from homeassistant.helpers.template import Template
 
+from .api import (
+    AUTH_ERRORS,
+    ERROR_UNAUTHORIZED_TOKEN,
+    LastFMApiError,
+    LastFMClient,
+    LastFMConnectionError,
+)
 from .const import (
     CONF_API_SECRET,
+    CONF_ARTIST_SPLIT_EXCEPTIONS,
     CONF_CHECK_ENTITY,
+    CONF_CHECK_MODE,
+    CONF_CHECK_TEMPLATE,
+    CONF_CHECK_ZONES,
+    CONF_CORRECT_METADATA,
+    CONF_MIN_DURATION,
+    CONF_NOW_PLAYING_DELAY,
+    CONF_POLICIES,
+    CONF_SCROBBLE_ALL_PLAYERS,
     CONF_SCROBBLE_PERCENTAGE,
+    CONF_SCROBBLE_STREAMS,
     CONF_SESSION_KEY,
+    CONF_SKIP_ARTISTS,
+    CONF_SKIP_CONTENT_TYPES,
+    CONF_SKIP_TITLES,
+    CONF_STRIP_TITLE_SUFFIXES,
+    CONF_TIME_WINDOW_END,
+    CONF_TIME_WINDOW_START,
     CONF_UPDATE_NOW_PLAYING,
+    DATA_VALIDATED_CREDENTIALS,
     DOMAIN,
 )
+from .gating import CHECK_MODE_ALL, CHECK_MODE_ANY
+from .metadata import CONTENT_TYPE_TTS, DEFAULT_ARTIST_SPLIT_EXCEPTIONS
+from .now_playing import DEFAULT_NOW_PLAYING_DELAY
+from .policies import DEFAULT_MIN_DURATION, PolicyError, ScrobblePolicies
 
 _LOGGER = logging.getLogger(__name__)
 
+CHECK_ENTITY_DOMAINS = ["person", "device_tracker", "input_boolean", "switch"]
+CHECK_MODE_SELECTOR = SelectSelector(
+    SelectSelectorConfig(
+        options=[CHECK_MODE_ALL, CHECK_MODE_ANY], translation_key=CONF_CHECK_MODE
+    )
+)
+NOW_PLAYING_DELAY_SELECTOR = NumberSelector(
+    NumberSelectorConfig(
+        min=0, max=60, unit_of_measurement="s", mode=NumberSelectorMode.BOX
+    )
+)
+MIN_DURATION_SELECTOR = NumberSelector(
+    NumberSelectorConfig(
+        min=0, max=600, unit_of_measurement="s", mode=NumberSelectorMode.BOX
+    )
+)
+SKIP_PATTERNS_SELECTOR = TextSelector(TextSelectorConfig(multiple=True))
+# media_content_type values of the media_player integrations, and announcements
+SKIP_CONTENT_TYPES_SELECTOR = SelectSelector(
+    SelectSelectorConfig(
+        options=["podcast", "episode", "tvshow", "movie", "video", CONTENT_TYPE_TTS],
+        multiple=True,
+        custom_value=True,
+        translation_key=CONF_SKIP_CONTENT_TYPES,
+    )
+)
+ZONE_SELECTOR = EntitySelector(
+    EntitySelectorConfig(
+        filter=EntityFilterSelectorConfig(domain="zone"), multiple=True
+    )
+)
+
 STEP_USER_DATA_SCHEMA = vol.Schema(
     {
         vol.Required(CONF_NAME, default="My Scrobbler"): str,
         vol.Required(CONF_API_KEY): str,
         vol.Required(CONF_API_SECRET): str,  # API_SECRET
-        vol.Required(CONF_SESSION_KEY): str,  # SESSION_KEY
+        vol.Optional(CONF_SESSION_KEY): str,  # SESSION_KEY, empty to authorize
         vol.Required(CONF_SCROBBLE_PERCENTAGE, default=50): int,
         vol.Required(CONF_UPDATE_NOW_PLAYING, default=False): bool,
+        vol.Required(
+            CONF_NOW_PLAYING_DELAY, default=DEFAULT_NOW_PLAYING_DELAY
+        ): NOW_PLAYING_DELAY_SELECTOR,
+        vol.Required(CONF_SCROBBLE_ALL_PLAYERS, default=False): bool,
+        vol.Required(CONF_SCROBBLE_STREAMS, default=False): bool,
         vol.Required(CONF_ENTITY_ID): EntitySelector(
             EntitySelectorConfig(
                 filter=EntityFilterSelectorConfig(domain="media_player"), multiple=True
@@ -43,43 +123,310 @@ STEP_USER_DATA_SCHEMA = vol.Schema(
         ),
         vol.Optional(CONF_CHECK_ENTITY, default=[]): EntitySelector(
             EntitySelectorConfig(
-                filter=EntityFilterSelectorConfig(
-                    domain=["person", "input_boolean", "switch"]
-                ),
+                filter=EntityFilterSelectorConfig(domain=CHECK_ENTITY_DOMAINS),
                 multiple=True,
             )
         ),
+        vol.Optional(CONF_CHECK_MODE, default=CHECK_MODE_ALL): CHECK_MODE_SELECTOR,
+        vol.Optional(CONF_CHECK_ZONES, default=[]): ZONE_SELECTOR,
+        vol.Optional(CONF_TIME_WINDOW_START): TimeSelector(),
+        vol.Optional(CONF_TIME_WINDOW_END): TimeSelector(),
+        vol.Optional(CONF_CHECK_TEMPLATE): TemplateSelector(),
+        vol.Optional(
+            CONF_ARTIST_SPLIT_EXCEPTIONS,
+            default=list(DEFAULT_ARTIST_SPLIT_EXCEPTIONS),
+        ): TextSelector(TextSelectorConfig(multiple=True)),
+        vol.Required(CONF_STRIP_TITLE_SUFFIXES, default=False): bool,
+        vol.Required(CONF_CORRECT_METADATA, default=False): bool,
+        vol.Required(
+            CONF_MIN_DURATION, default=DEFAULT_MIN_DURATION
+        ): MIN_DURATION_SELECTOR,
+        vol.Optional(CONF_SKIP_ARTISTS, default=[]): SKIP_PATTERNS_SELECTOR,
+        vol.Optional(CONF_SKIP_TITLES, default=[]): SKIP_PATTERNS_SELECTOR,
+        vol.Optional(CONF_SKIP_CONTENT_TYPES, default=[]): SKIP_CONTENT_TYPES_SELECTOR,
+        vol.Optional(CONF_POLICIES): ObjectSelector(),
+    }
+)
+
+
+# the options are those of the setup, showing the current ones, but the name
+STEP_OPTIONS_DATA_SCHEMA = vol.Schema(
+    {
+        (vol.Required(CONF_SESSION_KEY) if key == CONF_SESSION_KEY else key): value
+        for key, value in STEP_USER_DATA_SCHEMA.schema.items()
+        if key != CONF_NAME
+    }
+)
+
+
+STEP_REAUTH_DATA_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_API_KEY): str,
+        vol.Required(CONF_API_SECRET): str,
+        vol.Optional(CONF_SESSION_KEY): str,  # empty to authorize again
     }
 )
 
 
+class CannotConnect(HomeAssistantError):
+    """Error to indicate we cannot connect."""
+
+
+class InvalidAuth(HomeAssistantError):
+    """Error to indicate there is invalid auth."""
+
+
+async def validate_credentials(
+    hass: HomeAssistant, api_key: str, api_secret: str, session_key: str
+) -> str:
+    """Validate the credentials against Last.fm and return the user name.
+
+    Valid credential sets are cached, so submitting the options flow again
+    doesn't hit the API. Rejected ones aren't: the user may grant access on
+    last.fm in the meantime.
+    """
+    cache: dict[str, str] = hass.data.setdefault(DOMAIN, {}).setdefault(
+        DATA_VALIDATED_CREDENTIALS, {}
+    )
+    # only keep a digest of the credentials around
+    key = hashlib.sha256(f"{api_key}:{api_secret}:{session_key}".encode()).hexdigest()
+    if (username := cache.get(key)) is None:
+        client = LastFMClient(async_get_clientsession(hass), api_key, api_secret)
+        try:
+            username = await client.async_get_username(session_key)
+        except LastFMApiError as ex:
+            if ex.code not in AUTH_ERRORS:
+                raise CannotConnect from ex
+            _LOGGER.debug("Last.fm rejected the credentials: %s", ex)
+            raise InvalidAuth from ex
+        except LastFMConnectionError as ex:
+            raise CannotConnect from ex
+        cache[key] = username
+    return username
+
+
+async def _async_validate_input(
+    hass: HomeAssistant, user_input: dict[str, Any], errors: dict[str, str]
+) -> None:
+    """Validate the credentials of a submitted form, filling ``errors``."""
+    try:
+        username = await validate_credentials(
+            hass,
+            user_input[CONF_API_KEY],
+            user_input[CONF_API_SECRET],
+            user_input[CONF_SESSION_KEY],
+        )
+    except CannotConnect:
+        errors["base"] = "cannot_connect"
+    except InvalidAuth:
+        errors["base"] = "invalid_auth"
+    except Exception:
+        _LOGGER.exception("Unexpected exception")
+        errors["base"] = "unknown"
+    else:
+        _LOGGER.debug("Credentials of %s are valid", username)
+
+
+def _validate_conditions(
+    hass: HomeAssistant, user_input: dict[str, Any], errors: dict[str, str]
+) -> None:
+    """Validate the scrobble conditions of a submitted form, filling ``errors``."""
+    if (user_input.get(CONF_TIME_WINDOW_START) is None) != (
+        user_input.get(CONF_TIME_WINDOW_END) is None
+    ):
+        errors[CONF_TIME_WINDOW_END] = "incomplete_time_window"
+    if template := user_input.get(CONF_CHECK_TEMPLATE):
+        try:
+            Template(template, hass).ensure_valid()
+        except TemplateError:
+            errors[CONF_CHECK_TEMPLATE] = "invalid_template"
+
+
+def _validate_policies(
+    user_input: dict[str, Any], errors: dict[str, str], placeholders: dict[str, str]
+) -> None:
+    """Validate the scrobble policies of a submitted form, filling ``errors``.
+
+    The reason is added to ``placeholders``, to be shown with the error.
+    """
+    try:
+        ScrobblePolicies.from_config(user_input)
+    except PolicyError as ex:
+        _LOGGER.warning("Invalid scrobble policy: %s", ex)
+        placeholders["error"] = str(ex)
+        errors[ex.option] = (
+            "invalid_policies" if ex.option == CONF_POLICIES else "invalid_pattern"
+        )
+
+
 class ScrobblerConfigFlow(ConfigFlow, domain=DOMAIN):
     """Handle a config flow for the scrobbler."""
 
     VERSION = 1
 
+    def __init__(self) -> None:
+        """Initialize the config flow."""
+        self._user_input: dict[str, Any] = {}
+        self._client: LastFMClient | None = None
+        self._token: str | None = None
+        self._reauth_entry: config_entries.ConfigEntry | None = None
+
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ) -> ConfigFlowResult:
         """Handle the initial step."""
         errors: dict[str, str] = {}
+        placeholders: dict[str, str] = {}
         if user_input is not None:
             #Check if all optional fields have defaults values
             user_input.setdefault(CONF_CHECK_ENTITY, [])
-            try:
-                pass
-            except Exception:
-                _LOGGER.exception("Unexpected exception")
-                errors["base"] = "unknown"
-            else:
+            user_input.setdefault(CONF_ARTIST_SPLIT_EXCEPTIONS, [])
+            for option in (
+                CONF_SKIP_ARTISTS,
+                CONF_SKIP_TITLES,
+                CONF_SKIP_CONTENT_TYPES,
+            ):
+                user_input.setdefault(option, [])
+            _validate_conditions(self.hass, user_input, errors)
+            _validate_policies(user_input, errors, placeholders)
+            if not errors and not user_input.get(CONF_SESSION_KEY):
+                # no session key yet: obtain one through the desktop auth flow
+                self._user_input = user_input
+                return await self.async_step_authorize()
+            if not errors:
+                await _async_validate_input(self.hass, user_input, errors)
+            if not errors:
                 return self.async_create_entry(
                     title=user_input[CONF_NAME], data=user_input
                 )
 
         return self.async_show_form(
-            step_id="user", data_schema=STEP_USER_DATA_SCHEMA, errors=errors
+            step_id="user",
+            data_schema=self.add_suggested_values_to_schema(
+                STEP_USER_DATA_SCHEMA, user_input
+            ),
+            description_placeholders=placeholders,
+            errors=errors,
+        )
+
+    async def async_step_authorize(
+        self, user_input: dict[str, Any] | None = None
+    ) -> ConfigFlowResult:
+        """Let the user grant access on last.fm and fetch the session key."""
+        errors: dict[str, str] = {}
+        if self._client is None:
+            self._client = LastFMClient(
+                async_get_clientsession(self.hass),
+                self._user_input[CONF_API_KEY],
+                self._user_input[CONF_API_SECRET],
+            )
+
+        if user_input is not None:
+            try:
+                session_key = await self._client.async_get_session(self._token)
+            except LastFMApiError as ex:
+                if ex.code == ERROR_UNAUTHORIZED_TOKEN:
+                    errors["base"] = "token_not_authorized"
+                else:
+                    _LOGGER.debug("Failed to get a session: %s", ex)
+                    errors["base"] = "invalid_auth"
+            except LastFMConnectionError:
+                errors["base"] = "cannot_connect"
+            else:
+                self._user_input[CONF_SESSION_KEY] = session_key
+                return self._async_finish()
+
+        if self._token is None:
+            try:
+                self._token = await self._client.async_get_token()
+            except LastFMApiError as ex:
+                return self._async_abort_authorize(
+                    "invalid_auth" if ex.code in AUTH_ERRORS else "cannot_connect"
+                )
+            except LastFMConnectionError:
+                return self._async_abort_authorize("cannot_connect")
+
+        return self.async_show_form(
+            step_id="authorize",
+            description_placeholders={"url": self._client.auth_url(self._token)},
+            errors=errors,
+        )
+
+    @callback
+    def _async_abort_authorize(self, error: str) -> ConfigFlowResult:
+        """Go back to the credentials when no token could be obtained."""
+        self._client = None
+        if self._reauth_entry is not None:
+            return self._async_show_reauth_confirm(self._user_input, {"base": error})
+        return self.async_show_form(
+            step_id="user",
+            data_schema=self.add_suggested_values_to_schema(
+                STEP_USER_DATA_SCHEMA, self._user_input
+            ),
+            errors={"base": error},
+        )
+
+    async def async_step_reauth(
+        self, entry_data: Mapping[str, Any]
+    ) -> ConfigFlowResult:
+        """Ask for new credentials after Last.fm rejected the stored ones."""
+        self._reauth_entry = self.hass.config_entries.async_get_entry(
+            self.context["entry_id"]
+        )
+        # the rejected credentials may have been validated before
+        self.hass.data.get(DOMAIN, {}).pop(DATA_VALIDATED_CREDENTIALS, None)
+        return await self.async_step_reauth_confirm()
+
+    async def async_step_reauth_confirm(
+        self, user_input: dict[str, Any] | None = None
+    ) -> ConfigFlowResult:
+        """Validate new credentials, authorizing again without a session key."""
+        errors: dict[str, str] = {}
+        if user_input is not None:
+            self._user_input = {**self._reauth_entry.data, **user_input}
+            if not user_input.get(CONF_SESSION_KEY):
+                self._client = self._token = None
+                return await self.async_step_authorize()
+            await _async_validate_input(self.hass, self._user_input, errors)
+            if not errors:
+                return self._async_finish()
+        return self._async_show_reauth_confirm(
+            user_input or dict(self._reauth_entry.data), errors
+        )
+
+    @callback
+    def _async_show_reauth_confirm(
+        self, user_input: Mapping[str, Any], errors: dict[str, str]
+    ) -> ConfigFlowResult:
+        """Show the credentials of the entry to authenticate again."""
+        return self.async_show_form(
+            step_id="reauth_confirm",
+            data_schema=self.add_suggested_values_to_schema(
+                STEP_REAUTH_DATA_SCHEMA,
+                # the rejected session key is of no use
+                {
+                    key: value
+                    for key, value in user_input.items()
+                    if key != CONF_SESSION_KEY
+                },
+            ),
+            description_placeholders={"name": self._reauth_entry.title},
+            errors=errors,
         )
 
+    @callback
+    def _async_finish(self) -> ConfigFlowResult:
+        """Create the entry, or update the one that needed new credentials."""
+        if self._reauth_entry is None:
+            return self.async_create_entry(
+                title=self._user_input[CONF_NAME], data=self._user_input
+            )
+        # applied by the update listener, reloading only for a new API key
+        self.hass.config_entries.async_update_entry(
+            self._reauth_entry, data=self._user_input
+        )
+        return self.async_abort(reason="reauth_successful")
+
     @staticmethod
     @callback
     def async_get_options_flow(config_entry):
@@ -98,18 +445,25 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
     ) -> ConfigFlowResult:
         """Handle the initial step."""
         errors: dict[str, str] = {}
+        placeholders: dict[str, str] = {}
         config = self.hass.data[DOMAIN][self.config_entry.entry_id]
 
-        if user_input is not None:            
+        if user_input is not None:
             #Check if all optional fields have defaults values
             user_input.setdefault(CONF_CHECK_ENTITY, [])
-            
-            try:
-                pass
-            except Exception:
-                _LOGGER.exception("Unexpected exception")
-                errors["base"] = "unknown"
-            else:
+            user_input.setdefault(CONF_ARTIST_SPLIT_EXCEPTIONS, [])
+            for option in (
+                CONF_SKIP_ARTISTS,
+                CONF_SKIP_TITLES,
+                CONF_SKIP_CONTENT_TYPES,
+            ):
+                user_input.setdefault(option, [])
+
+            _validate_conditions(self.hass, user_input, errors)
+            _validate_policies(user_input, errors, placeholders)
+            if not errors:
+                await _async_validate_input(self.hass, user_input, errors)
+            if not errors:
                 # preserve old name
                 user_input[CONF_NAME] = config[CONF_NAME]
                 # TODO: I don't really understand why or how these two calls work
@@ -120,44 +474,11 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                 )
                 return self.async_create_entry(data=user_input)
 
-        options_schema = vol.Schema(
-            {
-                vol.Required(CONF_API_KEY, default=config[CONF_API_KEY]): str,
-                vol.Required(
-                    CONF_API_SECRET, default=config[CONF_API_SECRET]
-                ): str,  # API_SECRET
-                vol.Required(
-                    CONF_SESSION_KEY, default=config[CONF_SESSION_KEY]
-                ): str,  # SESSION_KEY
-                vol.Required(
-                    CONF_SCROBBLE_PERCENTAGE,
-                    default=config[CONF_SCROBBLE_PERCENTAGE],
-                ): int,
-                vol.Required(
-                    CONF_UPDATE_NOW_PLAYING,
-                    default=config[CONF_UPDATE_NOW_PLAYING],
-                ): bool,
-                vol.Required(
-                    CONF_ENTITY_ID, default=config[CONF_ENTITY_ID]
-                ): EntitySelector(
-                    EntitySelectorConfig(
-                        filter=EntityFilterSelectorConfig(domain="media_player"),
-                        multiple=True,
-                    )
-                ),
-                vol.Optional(
-                    CONF_CHECK_ENTITY, default=config.get(CONF_CHECK_ENTITY, [])
-                ): EntitySelector(
-                    EntitySelectorConfig(
-                        filter=EntityFilterSelectorConfig(
-                            domain=["person", "input_boolean", "switch"]
-                        ),
-                        multiple=True,
-                    )
-                ),
-            }
-        )
-
         return self.async_show_form(
-            step_id="init", data_schema=options_schema, errors=errors
+            step_id="init",
+            data_schema=self.add_suggested_values_to_schema(
+                STEP_OPTIONS_DATA_SCHEMA, user_input or config
+            ),
+            description_placeholders=placeholders,
+            errors=errors,
         )
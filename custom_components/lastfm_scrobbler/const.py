@@ -3,6 +3,34 @@
 DOMAIN = "lastfm_scrobbler"
 CONF_SCROBBLE_PERCENTAGE = "scrobble_percentage"
 CONF_UPDATE_NOW_PLAYING = "update_now_playing"
+CONF_NOW_PLAYING_DELAY = "now_playing_delay"
 CONF_CHECK_ENTITY = "check_entity"
+CONF_CHECK_MODE = "check_mode"
+CONF_CHECK_ZONES = "check_zones"
+CONF_CHECK_TEMPLATE = "check_template"
+CONF_TIME_WINDOW_START = "time_window_start"
+CONF_TIME_WINDOW_END = "time_window_end"
 CONF_API_SECRET = "api_secret"
 CONF_SESSION_KEY = "session_key"
+CONF_ARTIST_SPLIT_EXCEPTIONS = "artist_split_exceptions"
+CONF_STRIP_TITLE_SUFFIXES = "strip_title_suffixes"
+CONF_CORRECT_METADATA = "correct_metadata"
+CONF_SCROBBLE_ALL_PLAYERS = "scrobble_all_players"
+CONF_SCROBBLE_STREAMS = "scrobble_streams"
+CONF_MIN_DURATION = "min_duration"
+CONF_SKIP_ARTISTS = "skip_artists"
+CONF_SKIP_TITLES = "skip_titles"
+CONF_SKIP_CONTENT_TYPES = "skip_content_types"
+CONF_POLICIES = "policies"
+
+# hass.data[DOMAIN] keys for runtime objects shared by the platforms
+DATA_CLIENTS = "clients"
+DATA_QUEUES = "queues"
+DATA_CORRECTIONS = "corrections"
+DATA_HUB = "hub"
+DATA_HISTORY = "history"
+DATA_METRICS = "metrics"
+DATA_VALIDATED_CREDENTIALS = "validated_credentials"
+
+# dispatched with the new config when options were applied without a reload
+SIGNAL_OPTIONS_UPDATED = f"{DOMAIN}_options_updated_{{}}"
@@ -0,0 +1,201 @@
+"""Last.fm metadata corrections for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, NamedTuple
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .api import ERROR_INVALID_PARAMETERS, LastFMApiError, LastFMClient, LastFMError
+from .cache import LRUCache
+from .const import DOMAIN
+from .metadata import TrackInfo
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+STORAGE_KEY = f"{DOMAIN}.corrections"
+SAVE_DELAY = 60
+
+CACHE_SIZE = 5000
+# how long a correction, or the lack of one, is trusted
+TTL = 30 * 24 * 3600
+NEGATIVE_TTL = 24 * 3600
+# never wait longer than this for a lookup before scrobbling
+LOOKUP_BUDGET = 2.0
+
+
+class Correction(NamedTuple):
+    """Canonical metadata of a track according to Last.fm."""
+
+    artist: str
+    title: str
+    album: str | None
+    duration: int | None
+
+
+class CorrectionCache:
+    """Persistent LRU of track.getInfo lookups, shared by all entries.
+
+    Each distinct track costs at most one lookup until its entry expires.
+    Failed lookups are not cached, tracks unknown to Last.fm are for a day.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the cache."""
+        self._hass = hass
+        self._store: Store[dict[str, list]] = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        # (artist, title) -> (correction or None, expiry as UNIX timestamp)
+        self._cache: LRUCache[tuple[str, str], tuple[Correction | None, float]] = (
+            LRUCache(CACHE_SIZE)
+        )
+        self._lookups: dict[tuple[str, str], asyncio.Task] = {}
+
+    async def async_load(self) -> None:
+        """Load the cached corrections from disk."""
+        if (data := await self._store.async_load()) is None:
+            return
+        now = time.time()
+        for artist, title, correction, expires in data["corrections"]:
+            if expires > now:
+                self._cache.put(
+                    (artist, title),
+                    (None if correction is None else Correction(*correction), expires),
+                )
+
+    def diagnostics(self) -> dict[str, Any]:
+        """Return the cache statistics."""
+        return {
+            "size": len(self._cache),
+            "hits": self._cache.hits,
+            "misses": self._cache.misses,
+            "pending_lookups": len(self._lookups),
+        }
+
+    @callback
+    def async_prefetch(self, client: LastFMClient, track: TrackInfo) -> None:
+        """Look a track up in the background, e.g. as soon as it starts playing."""
+        self.async_lookup(client, track)
+
+    async def async_correct(
+        self, client: LastFMClient, track: TrackInfo, budget: float = LOOKUP_BUDGET
+    ) -> TrackInfo:
+        """Return ``track`` with the canonical Last.fm metadata, if known.
+
+        Waits at most ``budget`` seconds; a slower lookup keeps running to fill
+        the cache but the track is returned as is.
+        """
+        task = self.async_lookup(client, track)
+        if task is None:
+            correction = self._get(track)
+        else:
+            try:
+                async with asyncio.timeout(budget):
+                    correction = await asyncio.shield(task)
+            except TimeoutError:
+                _LOGGER.debug(
+                    "Lookup of %s by %s is too slow", track.title, track.artist
+                )
+                correction = None
+
+        if correction is None:
+            return track
+        return track._replace(
+            artist=correction.artist,
+            title=correction.title,
+            # the album reported by the player is more likely the right release
+            album=track.album or correction.album,
+            duration=track.duration or correction.duration,
+        )
+
+    def duration(self, track: TrackInfo) -> int | None:
+        """Return the cached duration of a track, without looking it up."""
+        correction = self._get(track)
+        return None if correction is None else correction.duration
+
+    def _get(self, track: TrackInfo) -> Correction | None:
+        """Return the cached correction of a track."""
+        cached = self._cache.get((track.artist, track.title))
+        return None if cached is None else cached[0]
+
+    @callback
+    def async_lookup(
+        self, client: LastFMClient, track: TrackInfo
+    ) -> asyncio.Task[Correction | None] | None:
+        """Start a lookup unless the track is cached; return the running lookup."""
+        key = (track.artist, track.title)
+        if (cached := self._cache.get(key)) is not None and cached[1] > time.time():
+            return None
+        if (task := self._lookups.get(key)) is None:
+            task = self._hass.async_create_background_task(
+                self._async_fetch(client, key), f"{DOMAIN} track lookup"
+            )
+            self._lookups[key] = task
+            task.add_done_callback(lambda _: self._lookups.pop(key, None))
+        return task
+
+    async def _async_fetch(
+        self, client: LastFMClient, key: tuple[str, str]
+    ) -> Correction | None:
+        """Fetch and cache the correction of a track."""
+        artist, title = key
+        try:
+            response = await client.async_get_track_info(artist, title)
+        except LastFMApiError as ex:
+            if ex.code != ERROR_INVALID_PARAMETERS:
+                _LOGGER.debug("Failed to look %s by %s up: %s", title, artist, ex)
+                return None
+            # "Track not found"
+            self._put(key, None, NEGATIVE_TTL)
+            return None
+        except LastFMError as ex:
+            _LOGGER.debug("Failed to look %s by %s up: %s", title, artist, ex)
+            return None
+
+        try:
+            info = response["track"]
+            try:
+                duration = int(info.get("duration") or 0) // 1000 or None
+            except ValueError:
+                duration = None
+            correction = Correction(
+                info["artist"]["name"],
+                info["name"],
+                (info.get("album") or {}).get("title"),
+                duration,
+            )
+        except (KeyError, TypeError, ValueError, AttributeError) as ex:
+            # scrobble the metadata as it is rather than not at all
+            _LOGGER.debug("Unexpected info of %s by %s: %r", title, artist, ex)
+            return None
+        if (correction.artist, correction.title) != key:
+            _LOGGER.debug(
+                "Last.fm corrects %s by %s to %s by %s",
+                title,
+                artist,
+                correction.title,
+                correction.artist,
+            )
+        self._put(key, correction, TTL)
+        return correction
+
+    def _put(
+        self, key: tuple[str, str], correction: Correction | None, ttl: float
+    ) -> None:
+        """Cache a lookup result and schedule saving the cache."""
+        self._cache.put(key, (correction, time.time() + ttl))
+        self._store.async_delay_save(self._data_to_save, SAVE_DELAY)
+
+    @callback
+    def _data_to_save(self) -> dict[str, list]:
+        """Return the data to store."""
+        return {
+            "corrections": [
+                [artist, title, correction, expires]
+                for (artist, title), (correction, expires) in self._cache.items()
+            ]
+        }
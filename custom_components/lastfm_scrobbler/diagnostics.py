@@ -0,0 +1,41 @@
+"""Diagnostics support for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_API_KEY
+from homeassistant.core import HomeAssistant
+
+from .const import (
+    CONF_API_SECRET,
+    CONF_SESSION_KEY,
+    DATA_CLIENTS,
+    DATA_CORRECTIONS,
+    DATA_METRICS,
+    DATA_QUEUES,
+    DOMAIN,
+)
+
+TO_REDACT = {CONF_API_KEY, CONF_API_SECRET, CONF_SESSION_KEY}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    config = hass.data[DOMAIN][entry.entry_id]
+    client = hass.data[DOMAIN][DATA_CLIENTS].get(
+        config[CONF_API_KEY], config[CONF_API_SECRET]
+    )
+    return {
+        "config": async_redact_data(dict(entry.data), TO_REDACT),
+        "queue": hass.data[DOMAIN][DATA_QUEUES][entry.entry_id].diagnostics(),
+        "corrections": hass.data[DOMAIN][DATA_CORRECTIONS].diagnostics(),
+        "metrics": hass.data[DOMAIN][DATA_METRICS][entry.entry_id].as_dict(),
+        # shared by the entries using the same API key
+        "api": client.metrics.as_dict(),
+        "circuit": client.breaker(config[CONF_SESSION_KEY]).diagnostics(),
+    }
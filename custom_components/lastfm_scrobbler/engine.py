@@ -0,0 +1,353 @@
+"""Scrobbling decisions of the lastfm_scrobbler integration.
+
+Nothing in here depends on Home Assistant: the integration feeds media_player
+states to the observers and the entities act on the decisions of their engine,
+which keeps the logic usable by the simulation harness in ``scripts/``.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable, Mapping
+from dataclasses import dataclass, field
+from datetime import datetime
+import logging
+from typing import Any, TypedDict
+
+from .metadata import MetadataNormalizer, TrackInfo, content_type, is_stream
+from .policies import ScrobblePolicies, ScrobblePolicy
+from .tracker import (
+    MAX_THRESHOLD,
+    PlaybackTracker,
+    current_position,
+    scrobble_threshold,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# same value as homeassistant.const.STATE_PLAYING
+STATE_PLAYING = "playing"
+# grouped players start the same track within this many seconds of each other
+SYNC_TOLERANCE = 30
+# attributes the recorder excludes from the media_player history
+POSITION_ATTRIBUTES = ("media_position", "media_position_updated_at")
+
+
+class Scrobble(TypedDict):
+    """A play waiting to be submitted to Last.fm."""
+
+    artist: str
+    track: str
+    album: str | None
+    duration: int | None
+    timestamp: int
+
+
+@dataclass(slots=True)
+class Decision:
+    """What a scrobbler has to do after evaluating its media players."""
+
+    # the highest priority playing player, shown as the scrobbler's state
+    player: str | None = None
+    track: TrackInfo | None = None
+    # send track as the new now playing
+    update_now_playing: bool = False
+    # plays to scrobble, by player
+    scrobbles: dict[str, Scrobble] = field(default_factory=dict)
+    # evaluate again at these points in time to scrobble the track of a player
+    deadlines: dict[str, datetime] = field(default_factory=dict)
+    # stream segments whose duration is unknown, by player
+    estimates: dict[str, TrackInfo] = field(default_factory=dict)
+
+
+def track_identity(attributes: Mapping[str, Any]) -> tuple:
+    """Return what identifies a play session, before any normalization."""
+    return (
+        attributes.get("media_artist"),
+        attributes.get("media_title"),
+        attributes.get("media_album_name"),
+        attributes.get("media_content_id"),
+    )
+
+
+class PlayerObserver:
+    """The play session of one media_player, shared by all scrobblers watching it.
+
+    Position maths happen here once per state change, however many accounts
+    scrobble the player.
+    """
+
+    __slots__ = ("entity_id", "state", "attributes", "session")
+
+    def __init__(self, entity_id: str) -> None:
+        """Initialize the observer of ``entity_id``."""
+        self.entity_id = entity_id
+        self.state: str | None = None
+        self.attributes: Mapping[str, Any] = {}
+        # the track last seen playing on the player
+        self.session: PlaybackTracker | None = None
+
+    @property
+    def playing(self) -> bool:
+        """Return whether the player is playing."""
+        return self.state == STATE_PLAYING
+
+    def update(
+        self, state: str | None, attributes: Mapping[str, Any], now: datetime
+    ) -> None:
+        """Record a new state of the player."""
+        self.state = state
+        self.attributes = attributes
+        playing = state == STATE_PLAYING
+        if playing:
+            identity = track_identity(attributes)
+            if self.session is None or self.session.track != identity:
+                # a new title on a stream is a new segment, timed from now
+                position = (
+                    0 if is_stream(attributes) else current_position(attributes, now)
+                )
+                self.session = PlaybackTracker(identity, position, now)
+        if self.session is not None:
+            self.session.update(playing, now)
+
+
+class ScrobblerEngine:
+    """Pick the highest priority player and decide when to scrobble.
+
+    With ``concurrent`` set, every playing player is scrobbled, and the
+    priority only decides what is shown and sent as now playing. With
+    ``streams`` set, each song of a stream is scrobbled once it played for
+    the threshold of its duration as estimated by ``durations``, or for 4
+    minutes when its duration is unknown. Tracks rejected by the policy of
+    their player and content type are ignored, as if nothing was playing.
+    """
+
+    __slots__ = (
+        "normalizer",
+        "policies",
+        "scrobble_percentage",
+        "update_now_playing",
+        "concurrent",
+        "streams",
+        "durations",
+        "now_playing",
+        "last_scrobbled_track",
+        "scrobbled_sessions",
+        "tracker",
+        "restored_session",
+    )
+
+    def __init__(
+        self,
+        scrobble_percentage: float,
+        update_now_playing: bool,
+        normalizer: MetadataNormalizer | None = None,
+        concurrent: bool = False,
+        streams: bool = False,
+        durations: Callable[[TrackInfo], int | None] | None = None,
+        policies: ScrobblePolicies | None = None,
+    ) -> None:
+        """Initialize the engine; ``durations`` must not block."""
+        self.normalizer = normalizer or MetadataNormalizer()
+        self.policies = policies or ScrobblePolicies()
+        self.scrobble_percentage = scrobble_percentage
+        self.update_now_playing = update_now_playing
+        self.concurrent = concurrent
+        self.streams = streams
+        self.durations = durations
+        self.now_playing: tuple | None = None
+        self.last_scrobbled_track: tuple | None = None
+        # session track and start of the last scrobbled play of each player
+        self.scrobbled_sessions: dict[str, tuple[tuple, int]] = {}
+        # the play session of the selected player
+        self.tracker: PlaybackTracker | None = None
+        # track and start of the session that was running before a restart
+        self.restored_session: tuple[tuple, int] | None = None
+
+    def evaluate(self, players: Iterable[PlayerObserver], now: datetime) -> Decision:
+        """Evaluate the observed players by priority."""
+        decision = Decision()
+        for player in players:
+            if not player.playing:
+                continue
+
+            if (track := self.normalizer.normalize(player.attributes)) is None:
+                # no scrobbling without artist and track info -
+                # go straight to the next player instead of doing more, ultimately useless work
+                _LOGGER.info(
+                    "%s is playing but missing artist/track info. Unable to scrobble",
+                    player.entity_id,
+                )
+                continue
+
+            policy = self.policies.resolve(
+                player.entity_id, content_type(player.attributes)
+            )
+            if not policy.allows(track):
+                _LOGGER.debug(
+                    "%s plays %s by %s, which its policy doesn't scrobble",
+                    player.entity_id,
+                    track.title,
+                    track.artist,
+                )
+                continue
+
+            if decision.player is None:
+                _LOGGER.debug(
+                    "Found the highest priority active player: %s", player.entity_id
+                )
+                self._select(decision, player, track)
+            self._process(decision, player, track, policy, now)
+            if not self.concurrent:
+                # at this point, we know the current player is playing has scrobble-able info.
+                # as we encounter this going through a list whose order is representing a priority,
+                # we must not continue with any other player after processing this one.
+                break
+
+        return decision
+
+    def _select(
+        self, decision: Decision, player: PlayerObserver, track: TrackInfo
+    ) -> None:
+        """Show the track of the highest priority player and send it as now playing."""
+        decision.player = player.entity_id
+        decision.track = track
+        session = player.session
+        if self.restored_session is not None:
+            if self.restored_session[0] == session.track:
+                # keep the session that was running before the restart
+                session.started = self.restored_session[1]
+            self.restored_session = None
+        self.tracker = session
+
+        if self.update_now_playing and self.now_playing != track.key:
+            self.now_playing = track.key
+            decision.update_now_playing = True
+
+    def _process(
+        self,
+        decision: Decision,
+        player: PlayerObserver,
+        track: TrackInfo,
+        policy: ScrobblePolicy,
+        now: datetime,
+    ) -> None:
+        """Decide about the scrobble of a playing track."""
+        session = player.session
+        if not (duration := track.duration) and not self.streams:
+            return
+        if self._scrobbled(player.entity_id, track, session):
+            return
+
+        if not duration and self.durations is not None:
+            duration = self.durations(track)
+            if duration and duration < policy.min_duration:
+                # e.g. a jingle between the songs of a stream
+                return
+        if duration:
+            percentage = policy.scrobble_percentage
+            threshold = scrobble_threshold(
+                duration,
+                self.scrobble_percentage if percentage is None else percentage,
+            )
+        else:
+            decision.estimates[player.entity_id] = track
+            threshold = MAX_THRESHOLD
+        deadline = session.deadline(threshold, now)
+        _LOGGER.debug(
+            "Listened to %s for %ss/%ss, scrobble threshold at %ss",
+            player.entity_id,
+            session.listened(now),
+            duration,
+            threshold,
+        )
+        if deadline is not None and deadline > now:
+            # wake up exactly when the threshold is crossed instead of polling
+            decision.deadlines[player.entity_id] = deadline
+        elif deadline is not None:
+            # If the track has changed since the last scrobble, scrobble it
+            self.last_scrobbled_track = track.key
+            self.scrobbled_sessions[player.entity_id] = (
+                session.track,
+                session.started,
+            )
+            decision.scrobbles[player.entity_id] = Scrobble(
+                artist=track.artist,
+                track=track.title,
+                album=track.album,
+                duration=duration,
+                # Last.fm expects the time the track started playing
+                timestamp=session.started,
+            )
+
+    def _scrobbled(
+        self, entity_id: str, track: TrackInfo, session: PlaybackTracker
+    ) -> bool:
+        """Return whether a play session was scrobbled already."""
+        if self.scrobbled_sessions.get(entity_id) == (session.track, session.started):
+            # e.g. the player lost the priority and got it back
+            return True
+        if not self.concurrent:
+            return track.key == self.last_scrobbled_track
+        # grouped players play the same track in sync: scrobble it once
+        return any(
+            scrobbled == session.track
+            and abs(started - session.started) <= SYNC_TOLERANCE
+            for scrobbled, started in self.scrobbled_sessions.values()
+        )
+
+
+class PlayRebuilder:
+    """Replay a recorded media_player history through a scrobbler engine.
+
+    States must be fed in chronological order; scrobble deadlines falling
+    between two states are honoured in the recorded time, exactly as the
+    entity's timers would have. The recorder doesn't store media positions,
+    so they are ignored: the time listened to a track is rebuilt from the
+    state and track changes alone. Only the observers and the next deadline
+    are kept, so any length of history replays in constant memory.
+    """
+
+    def __init__(self, engine: ScrobblerEngine, players: Iterable[str]) -> None:
+        """Replay the history of ``players``, in priority order."""
+        self._engine = engine
+        self._observers = {player: PlayerObserver(player) for player in players}
+        self._deadline: datetime | None = None
+
+    def feed(
+        self,
+        entity_id: str,
+        state: str | None,
+        attributes: Mapping[str, Any],
+        when: datetime,
+    ) -> list[tuple[str, Scrobble]]:
+        """Apply a recorded state and return ``(player, play)`` scrobbled until then."""
+        scrobbles = self.advance(when)
+        if (observer := self._observers.get(entity_id)) is not None:
+            observer.update(
+                state,
+                {
+                    key: value
+                    for key, value in attributes.items()
+                    if key not in POSITION_ATTRIBUTES
+                },
+                when,
+            )
+            scrobbles.extend(self._evaluate(when))
+        return scrobbles
+
+    def advance(self, when: datetime) -> list[tuple[str, Scrobble]]:
+        """Return ``(player, play)`` crossing their threshold until ``when``."""
+        scrobbles: list[tuple[str, Scrobble]] = []
+        while self._deadline is not None and self._deadline <= when:
+            scrobbles.extend(self._evaluate(self._deadline))
+        return scrobbles
+
+    def _evaluate(self, now: datetime) -> list[tuple[str, Scrobble]]:
+        """Evaluate the engine at ``now`` and remember its next deadline."""
+        decision = self._engine.evaluate(self._observers.values(), now)
+        # a deadline that isn't ahead would replay the same moment forever
+        self._deadline = min(
+            (deadline for deadline in decision.deadlines.values() if deadline > now),
+            default=None,
+        )
+        return list(decision.scrobbles.items())
@@ -0,0 +1,221 @@
+"""Conditions deciding whether a lastfm_scrobbler scrobbles."""
+
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable
+from datetime import datetime, time, timedelta
+import logging
+
+from homeassistant.const import STATE_HOME, STATE_ON
+from homeassistant.core import (
+    CALLBACK_TYPE,
+    Event,
+    EventStateChangedData,
+    HomeAssistant,
+    State,
+    callback,
+    split_entity_id,
+)
+from homeassistant.exceptions import HomeAssistantError, TemplateError
+from homeassistant.helpers import condition
+from homeassistant.helpers.event import (
+    TrackTemplate,
+    TrackTemplateResult,
+    async_track_point_in_time,
+    async_track_state_change_event,
+    async_track_template_result,
+)
+from homeassistant.helpers.template import Template, result_as_boolean
+from homeassistant.util import dt as dt_util
+
+_LOGGER = logging.getLogger(__name__)
+
+CHECK_MODE_ALL = "all"
+CHECK_MODE_ANY = "any"
+
+# entities located in zones rather than switched on or off
+LOCATED_DOMAINS = ("person", "device_tracker")
+
+
+def in_time_window(now: time, start: time | None, end: time | None) -> bool:
+    """Return whether ``now`` is within a daily window, which may span midnight."""
+    if start is None or end is None or start == end:
+        return True
+    if start < end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+class ScrobbleGate:
+    """Whether a scrobbler may scrobble, kept up to date incrementally.
+
+    Each check entity is only re-checked when its own state changes, the time
+    window flips at its boundaries and the template re-renders when what it
+    references changes. Reading ``allowed`` costs nothing.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        check_entities: Iterable[str],
+        *,
+        mode: str = CHECK_MODE_ALL,
+        zones: Iterable[str] = (),
+        window_start: time | None = None,
+        window_end: time | None = None,
+        template: str | None = None,
+        on_change: Callable[[], None],
+    ) -> None:
+        """Initialize the gate; nothing is checked until it is started."""
+        self._hass = hass
+        self._check_entities = list(check_entities)
+        self._mode = mode
+        self._zones = list(zones)
+        self._window = (window_start, window_end)
+        self._template = Template(template, hass) if template else None
+        self._on_change = on_change
+        # check entity -> whether it agrees to scrobble
+        self._agreeing: dict[str, bool] = {}
+        self._entities_ok = True
+        self._window_ok = True
+        self._template_ok = True
+        self.allowed = True
+        # the scrobbler evaluates right after starting the gate anyway
+        self._notify = False
+        self._unsubs: list[CALLBACK_TYPE] = []
+        self._unsub_window: CALLBACK_TYPE | None = None
+
+    @callback
+    def async_start(self) -> None:
+        """Evaluate all conditions and start following their changes."""
+        for entity_id in self._check_entities:
+            self._agreeing[entity_id] = self._agrees(
+                entity_id, self._hass.states.get(entity_id)
+            )
+        self._entities_ok = self._combine()
+        if self._check_entities:
+            self._unsubs.append(
+                async_track_state_change_event(
+                    self._hass, self._check_entities, self._async_entity_changed
+                )
+            )
+        if None not in self._window and self._window[0] != self._window[1]:
+            self._async_window_changed(dt_util.now())
+        if self._template is not None:
+            info = async_track_template_result(
+                self._hass,
+                [TrackTemplate(self._template, None)],
+                self._async_template_changed,
+            )
+            info.async_refresh()
+            self._unsubs.append(info.async_remove)
+        self._update()
+        self._notify = True
+
+    @callback
+    def async_stop(self) -> None:
+        """Stop following the conditions."""
+        self._notify = False
+        for unsub in self._unsubs:
+            unsub()
+        self._unsubs.clear()
+        if self._unsub_window is not None:
+            self._unsub_window()
+            self._unsub_window = None
+
+    def _agrees(self, entity_id: str, state: State | None) -> bool:
+        """Return whether a check entity agrees to scrobble."""
+        if state is None:
+            _LOGGER.warning("%s doesn't exist - this prevents scrobbling!", entity_id)
+            return False
+        domain = split_entity_id(entity_id)[0]
+        if domain in ("input_boolean", "switch"):
+            agrees = state.state == STATE_ON
+        elif domain in LOCATED_DOMAINS and self._zones:
+            agrees = any(self._in_zone(zone, state) for zone in self._zones)
+        elif domain in LOCATED_DOMAINS:
+            agrees = state.state == STATE_HOME
+        else:
+            agrees = True
+        _LOGGER.debug(
+            "%s is %s - %s to scrobble",
+            entity_id,
+            state.state,
+            "agreed" if agrees else "not agreed",
+        )
+        return agrees
+
+    def _in_zone(self, zone: str, state: State) -> bool:
+        """Return whether a located entity is in a zone."""
+        try:
+            return condition.zone(self._hass, zone, state)
+        except HomeAssistantError:
+            # e.g. the zone was deleted or the entity has no GPS coordinates
+            return False
+
+    def _combine(self) -> bool:
+        """Combine the results of the check entities."""
+        if not self._agreeing:
+            return True
+        if self._mode == CHECK_MODE_ANY:
+            return any(self._agreeing.values())
+        return all(self._agreeing.values())
+
+    @callback
+    def _update(self) -> None:
+        """Recompute the cached flag and notify the scrobbler if it flipped."""
+        allowed = self._entities_ok and self._window_ok and self._template_ok
+        if allowed == self.allowed:
+            return
+        self.allowed = allowed
+        _LOGGER.debug("Scrobbling is now %s", "allowed" if allowed else "blocked")
+        if self._notify:
+            self._on_change()
+
+    @callback
+    def _async_entity_changed(self, event: Event[EventStateChangedData]) -> None:
+        """Re-check the one check entity that changed."""
+        entity_id = event.data["entity_id"]
+        agrees = self._agrees(entity_id, event.data["new_state"])
+        if agrees == self._agreeing[entity_id]:
+            return
+        self._agreeing[entity_id] = agrees
+        self._entities_ok = self._combine()
+        self._update()
+
+    @callback
+    def _async_window_changed(self, now: datetime) -> None:
+        """Enter or leave the time window, then wait for its next boundary."""
+        start, end = self._window
+        self._window_ok = in_time_window(now.time(), start, end)
+        next_boundary = min(self._next(now, boundary) for boundary in (start, end))
+        self._unsub_window = async_track_point_in_time(
+            self._hass, self._async_window_changed, next_boundary
+        )
+        self._update()
+
+    @staticmethod
+    def _next(now: datetime, boundary: time) -> datetime:
+        """Return the next local time ``boundary`` is reached after ``now``."""
+        moment = now.replace(
+            hour=boundary.hour,
+            minute=boundary.minute,
+            second=boundary.second,
+            microsecond=0,
+        )
+        if moment <= now:
+            moment += timedelta(days=1)
+        return moment
+
+    @callback
+    def _async_template_changed(
+        self, _event: Event | None, updates: list[TrackTemplateResult]
+    ) -> None:
+        """Follow the rendered template condition."""
+        result = updates.pop().result
+        if isinstance(result, TemplateError):
+            _LOGGER.warning("Error rendering the scrobble condition: %s", result)
+            self._template_ok = False
+        else:
+            self._template_ok = result_as_boolean(result)
+        self._update()
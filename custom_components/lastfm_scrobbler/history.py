@@ -0,0 +1,281 @@
+"""Local scrobble history of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from datetime import datetime
+from functools import partial
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, NamedTuple
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+_LOGGER = logging.getLogger(__name__)
+
+DATABASE_FILE = "lastfm_scrobbler.db"
+
+KIND_SCROBBLE = "scrobble"
+KIND_NOW_PLAYING = "now_playing"
+
+# plays are written at most this many seconds after happening...
+WRITE_DELAY = 10
+# ...or as soon as this many are pending
+WRITE_BATCH = 100
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS plays (
+        id INTEGER PRIMARY KEY,
+        entry_id TEXT NOT NULL,
+        player TEXT,
+        kind TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        title TEXT NOT NULL,
+        album TEXT,
+        duration INTEGER,
+        timestamp INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS plays_entry ON plays (entry_id, kind, timestamp)",
+    "CREATE INDEX IF NOT EXISTS plays_player ON plays (player, kind, timestamp)",
+    "CREATE INDEX IF NOT EXISTS plays_artist ON plays (artist, kind, timestamp)",
+)
+
+
+class Play(NamedTuple):
+    """A row of the history."""
+
+    entry_id: str
+    player: str | None
+    kind: str
+    artist: str
+    title: str
+    album: str | None
+    duration: int | None
+    timestamp: int
+
+
+class HistoryDatabase:
+    """Append-only SQLite store of plays; every method blocks."""
+
+    def __init__(self, path: str) -> None:
+        """Initialize the database; it is opened on first use."""
+        self._path = path
+        self._connection: sqlite3.Connection | None = None
+        # executor jobs run in any thread of the pool
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection, creating the schema on first use."""
+        if self._connection is None:
+            connection = sqlite3.connect(self._path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+            self._connection = connection
+        return self._connection
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def insert(self, plays: Iterable[Play]) -> None:
+        """Append plays in a single transaction."""
+        with self._lock, self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO plays (entry_id, player, kind, artist, title, album,"
+                " duration, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                plays,
+            )
+
+    def delete_entry(self, entry_id: str) -> None:
+        """Delete the history of a config entry."""
+        with self._lock, self._connect() as connection:
+            connection.execute("DELETE FROM plays WHERE entry_id = ?", (entry_id,))
+
+    def top_artists(
+        self,
+        since: int,
+        *,
+        entry_id: str | None = None,
+        player: str | None = None,
+        limit: int = 10,
+    ) -> list[tuple[str, int]]:
+        """Return the most scrobbled artists since a UNIX timestamp."""
+        where, params = self._where(since, entry_id, player)
+        with self._lock:
+            return (
+                self._connect()
+                .execute(
+                    f"SELECT artist, COUNT(*) AS plays FROM plays WHERE {where}"
+                    " GROUP BY artist ORDER BY plays DESC, artist LIMIT ?",
+                    (*params, limit),
+                )
+                .fetchall()
+            )
+
+    def play_count(
+        self, since: int, *, entry_id: str | None = None, player: str | None = None
+    ) -> int:
+        """Return the number of scrobbles since a UNIX timestamp."""
+        where, params = self._where(since, entry_id, player)
+        with self._lock:
+            return (
+                self._connect()
+                .execute(f"SELECT COUNT(*) FROM plays WHERE {where}", params)
+                .fetchone()[0]
+            )
+
+    def scrobbled(
+        self, entry_id: str, start: int, end: int
+    ) -> set[tuple[str, str, int]]:
+        """Return ``(artist, title, timestamp)`` of an entry's scrobbles in a range."""
+        with self._lock:
+            return set(
+                self._connect().execute(
+                    "SELECT artist, title, timestamp FROM plays WHERE entry_id = ?"
+                    " AND kind = ? AND timestamp BETWEEN ? AND ?",
+                    (entry_id, KIND_SCROBBLE, start, end),
+                )
+            )
+
+    @staticmethod
+    def _where(
+        since: int, entry_id: str | None, player: str | None
+    ) -> tuple[str, tuple]:
+        """Return the filter of a query on scrobbles, using the best index."""
+        clauses = ["kind = ?", "timestamp >= ?"]
+        params: list[Any] = [KIND_SCROBBLE, since]
+        if entry_id is not None:
+            clauses.insert(0, "entry_id = ?")
+            params.insert(0, entry_id)
+        if player is not None:
+            clauses.insert(0, "player = ?")
+            params.insert(0, player)
+        return " AND ".join(clauses), tuple(params)
+
+
+class ScrobbleHistory:
+    """Records plays without blocking the event loop.
+
+    Plays are buffered and written in batches by an executor job; queries run
+    in the executor too, after the pending plays were written.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the history."""
+        self._hass = hass
+        self.database = HistoryDatabase(hass.config.path(DATABASE_FILE))
+        self._pending: list[Play] = []
+        self._unsub_write: CALLBACK_TYPE | None = None
+
+    @callback
+    def async_record(
+        self,
+        entry_id: str,
+        player: str | None,
+        kind: str,
+        artist: str,
+        title: str,
+        album: str | None,
+        duration: int | None,
+        timestamp: int | None = None,
+    ) -> None:
+        """Buffer a play; ``timestamp`` defaults to now."""
+        self._pending.append(
+            Play(
+                entry_id,
+                player,
+                kind,
+                artist,
+                title,
+                album,
+                duration,
+                int(time.time()) if timestamp is None else timestamp,
+            )
+        )
+        if len(self._pending) >= WRITE_BATCH:
+            self._hass.async_create_background_task(
+                self.async_write(), "lastfm_scrobbler write history"
+            )
+        elif self._unsub_write is None:
+            self._unsub_write = async_call_later(
+                self._hass, WRITE_DELAY, self._async_write_later
+            )
+
+    @callback
+    def _async_write_later(self, _now: datetime) -> None:
+        """Write the plays buffered during the write delay."""
+        self._unsub_write = None
+        self._hass.async_create_background_task(
+            self.async_write(), "lastfm_scrobbler write history"
+        )
+
+    async def async_write(self) -> None:
+        """Write the buffered plays."""
+        if self._unsub_write is not None:
+            self._unsub_write()
+            self._unsub_write = None
+        if not self._pending:
+            return
+        plays, self._pending = self._pending, []
+        try:
+            await self._hass.async_add_executor_job(self.database.insert, plays)
+        except sqlite3.Error as ex:
+            _LOGGER.error("Failed to write %s plays to the history: %s", len(plays), ex)
+
+    async def async_close(self) -> None:
+        """Write the buffered plays and close the database."""
+        await self.async_write()
+        await self._hass.async_add_executor_job(self.database.close)
+
+    async def async_top_artists(
+        self,
+        since: int,
+        *,
+        entry_id: str | None = None,
+        player: str | None = None,
+        limit: int = 10,
+    ) -> list[tuple[str, int]]:
+        """Return the most scrobbled artists since a UNIX timestamp."""
+        await self.async_write()
+        return await self._hass.async_add_executor_job(
+            partial(
+                self.database.top_artists,
+                since,
+                entry_id=entry_id,
+                player=player,
+                limit=limit,
+            )
+        )
+
+    async def async_play_count(
+        self, since: int, *, entry_id: str | None = None, player: str | None = None
+    ) -> int:
+        """Return the number of scrobbles since a UNIX timestamp."""
+        await self.async_write()
+        return await self._hass.async_add_executor_job(
+            partial(self.database.play_count, since, entry_id=entry_id, player=player)
+        )
+
+    async def async_scrobbled(
+        self, entry_id: str, start: int, end: int
+    ) -> set[tuple[str, str, int]]:
+        """Return ``(artist, title, timestamp)`` of an entry's scrobbles in a range."""
+        await self.async_write()
+        return await self._hass.async_add_executor_job(
+            self.database.scrobbled, entry_id, start, end
+        )
+
+    async def async_delete_entry(self, entry_id: str) -> None:
+        """Delete the history of a removed config entry."""
+        await self.async_write()
+        await self._hass.async_add_executor_job(self.database.delete_entry, entry_id)
@@ -0,0 +1,179 @@
+"""Shared media_player observation for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable, Mapping
+from datetime import datetime
+import logging
+from typing import Any
+
+from homeassistant.core import (
+    CALLBACK_TYPE,
+    Event,
+    EventStateChangedData,
+    HomeAssistant,
+    State,
+    callback,
+)
+from homeassistant.helpers.event import (
+    async_track_point_in_utc_time,
+    async_track_state_change_event,
+)
+from homeassistant.util import dt as dt_util
+
+from .const import CONF_ARTIST_SPLIT_EXCEPTIONS, CONF_STRIP_TITLE_SUFFIXES
+from .engine import PlayerObserver
+from .metadata import DEFAULT_ARTIST_SPLIT_EXCEPTIONS, MetadataNormalizer
+
+_LOGGER = logging.getLogger(__name__)
+
+# media_player attributes that can change what (or when) we scrobble
+RELEVANT_ATTRIBUTES = (
+    "media_artist",
+    "media_title",
+    "media_album_name",
+    "media_duration",
+    "media_position",
+    "media_position_updated_at",
+    "media_content_id",
+    "media_content_type",
+)
+
+
+def _relevant_state(state: State | None) -> tuple | None:
+    """Return the parts of a media_player state the scrobbler reacts to."""
+    if state is None:
+        return None
+    return (
+        state.state,
+        *(state.attributes.get(attribute) for attribute in RELEVANT_ATTRIBUTES),
+    )
+
+
+class PlayerHub:
+    """Observe every media_player once, whatever the number of scrobblers.
+
+    Each player gets a single state listener and a single ``PlayerObserver``
+    holding its play session. Scrobblers subscribe to the players they watch
+    and are called after the observer was updated. Scrobblers waiting for the
+    same threshold crossing of a player share one timer, and scrobblers with
+    the same metadata options share one normalizer and its cache.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the hub."""
+        self._hass = hass
+        self._observers: dict[str, PlayerObserver] = {}
+        self._listeners: dict[str, list[Callable[[], None]]] = {}
+        self._unsub_state_changes: dict[str, CALLBACK_TYPE] = {}
+        self._timers: dict[
+            tuple[str, datetime], tuple[CALLBACK_TYPE, list[Callable[[], None]]]
+        ] = {}
+        self._normalizers: dict[tuple, MetadataNormalizer] = {}
+
+    def observer(self, entity_id: str) -> PlayerObserver | None:
+        """Return the observer of a subscribed media_player."""
+        return self._observers.get(entity_id)
+
+    def normalizer(self, config: Mapping[str, Any]) -> MetadataNormalizer:
+        """Return the normalizer shared by all scrobblers with these options."""
+        key = (
+            tuple(
+                config.get(
+                    CONF_ARTIST_SPLIT_EXCEPTIONS, DEFAULT_ARTIST_SPLIT_EXCEPTIONS
+                )
+            ),
+            config.get(CONF_STRIP_TITLE_SUFFIXES, False),
+        )
+        if (normalizer := self._normalizers.get(key)) is None:
+            normalizer = MetadataNormalizer(*key)
+            self._normalizers[key] = normalizer
+        return normalizer
+
+    @callback
+    def async_subscribe(
+        self, entity_ids: Iterable[str], listener: Callable[[], None]
+    ) -> CALLBACK_TYPE:
+        """Call ``listener`` whenever one of the media_players changed."""
+        entity_ids = list(entity_ids)
+        for entity_id in entity_ids:
+            if entity_id not in self._observers:
+                self._async_observe(entity_id)
+            self._listeners[entity_id].append(listener)
+
+        @callback
+        def unsubscribe() -> None:
+            for entity_id in entity_ids:
+                listeners = self._listeners[entity_id]
+                listeners.remove(listener)
+                if not listeners:
+                    self._async_forget(entity_id)
+
+        return unsubscribe
+
+    @callback
+    def async_track_deadline(
+        self, entity_id: str, deadline: datetime, listener: Callable[[], None]
+    ) -> CALLBACK_TYPE:
+        """Call ``listener`` when a player reaches ``deadline``."""
+        key = (entity_id, deadline)
+        if (timer := self._timers.get(key)) is None:
+
+            @callback
+            def fire(_now: datetime) -> None:
+                _, listeners = self._timers.pop(key)
+                for due in listeners:
+                    due()
+
+            timer = (async_track_point_in_utc_time(self._hass, fire, deadline), [])
+            self._timers[key] = timer
+        timer[1].append(listener)
+
+        @callback
+        def cancel() -> None:
+            if (timer := self._timers.get(key)) is None or listener not in timer[1]:
+                return
+            timer[1].remove(listener)
+            if not timer[1]:
+                timer[0]()
+                del self._timers[key]
+
+        return cancel
+
+    @callback
+    def _async_observe(self, entity_id: str) -> None:
+        """Start observing a media_player."""
+        observer = PlayerObserver(entity_id)
+        if (state := self._hass.states.get(entity_id)) is not None:
+            observer.update(state.state, state.attributes, dt_util.utcnow())
+        self._observers[entity_id] = observer
+        self._listeners[entity_id] = []
+        self._unsub_state_changes[entity_id] = async_track_state_change_event(
+            self._hass, entity_id, self._async_state_changed
+        )
+
+    @callback
+    def _async_forget(self, entity_id: str) -> None:
+        """Stop observing a media_player nobody watches anymore."""
+        self._unsub_state_changes.pop(entity_id)()
+        del self._observers[entity_id]
+        del self._listeners[entity_id]
+
+    @callback
+    def _async_state_changed(self, event: Event[EventStateChangedData]) -> None:
+        """Update the observer once, then notify its scrobblers."""
+        if _relevant_state(event.data["old_state"]) == _relevant_state(
+            new_state := event.data["new_state"]
+        ):
+            # e.g. volume or entity_picture changes are of no interest to us
+            return
+        entity_id = event.data["entity_id"]
+        if new_state is None:
+            self._observers[entity_id].update(None, {}, dt_util.utcnow())
+        else:
+            self._observers[entity_id].update(
+                new_state.state, new_state.attributes, dt_util.utcnow()
+            )
+        _LOGGER.debug("%s changed - notifying its scrobblers", entity_id)
+        for listener in list(self._listeners[entity_id]):
+            listener()
@@ -0,0 +1,202 @@
+"""Media player metadata handling for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable, Mapping, Sequence
+import logging
+import re
+from typing import Any, NamedTuple
+
+from .cache import LRUCache
+
+_LOGGER = logging.getLogger(__name__)
+
+PLAYER_TYPE_GENERIC = "generic"
+PLAYER_TYPE_MASS = "music_assistant"
+
+# content type of text-to-speech announcements, which players report as music
+CONTENT_TYPE_TTS = "tts"
+
+DEFAULT_ARTIST_SPLIT_EXCEPTIONS = ("AC/DC",)
+DEFAULT_CACHE_SIZE = 256
+
+_MISSING: Any = object()
+
+# "Title (feat. X)", "Title [Remastered 2011]", "Title - Live at Wembley", ...
+_SUFFIX_WORDS = r"(?:feat\.?|ft\.|featuring|(?:\d{4}\s+)?remaster(?:ed)?|live\b)"
+_SUFFIX_RE = re.compile(
+    rf"\s*(?:[(\[]\s*{_SUFFIX_WORDS}[^)\]]*[)\]]|\s-\s+{_SUFFIX_WORDS}.*|"
+    r"\s(?:feat\.?|ft\.|featuring)\s.*)$",
+    re.IGNORECASE,
+)
+_FEATURING_RE = re.compile(r"\s+(?:feat\.?|ft\.|featuring)\s.*$", re.IGNORECASE)
+
+
+class TrackInfo(NamedTuple):
+    """What a media player is playing, cleaned up for Last.fm."""
+
+    artist: str
+    title: str
+    album: str | None
+    duration: int | None
+    radio: bool = False
+
+    @property
+    def key(self) -> tuple[str, str, str | None]:
+        """Return what identifies the track when deduplicating."""
+        return (self.artist, self.title, self.album)
+
+
+class RawTrack(NamedTuple):
+    """Metadata passed from one normalization rule to the next."""
+
+    artist: str
+    title: str
+    album: str | None
+    duration: int | None
+    content_id: str | None
+    radio: bool = False
+
+
+Rule = Callable[[RawTrack], RawTrack]
+
+
+def split_artists(exceptions: Iterable[str]) -> Rule:
+    """Return a rule keeping the first of slash separated artists."""
+    excluded = frozenset(exception.lower() for exception in exceptions)
+
+    def rule(track: RawTrack) -> RawTrack:
+        if "/" not in track.artist or track.artist.lower() in excluded:
+            return track
+        # Music Assistant lists multiple artists from spotify (and maybe other sources)
+        # separated by slashes ("/"). That's unusual and will mess up scrobbles.
+        # It seems what would be considered the main artist is usually the first one
+        # mentioned, so we'll take that one.
+        artist = track.artist.split("/")[0]
+        _LOGGER.debug("Split multi-artists %s to %s", track.artist, artist)
+        return track._replace(artist=artist)
+
+    return rule
+
+
+def strip_suffixes(track: RawTrack) -> RawTrack:
+    """Strip featured artists and remaster/live suffixes."""
+    title = track.title
+    while (stripped := _SUFFIX_RE.sub("", title)) != title and stripped:
+        title = stripped
+    artist = _FEATURING_RE.sub("", track.artist) or track.artist
+    if (artist, title) == (track.artist, track.title):
+        return track
+    _LOGGER.debug(
+        "Stripped %s - %s to %s - %s", track.artist, track.title, artist, title
+    )
+    return track._replace(artist=artist, title=title)
+
+
+def detect_radio(track: RawTrack) -> RawTrack:
+    """Flag radio streams, whose album and duration are meaningless."""
+    if not track.content_id or "radio" not in track.content_id:
+        return track
+    # When playing radio through Music Assistant, the name of the radio station
+    # is added as album and the track duration is unreliable (very long)
+    _LOGGER.debug("Won't use album info and track duration from radio playback")
+    return track._replace(album=None, duration=None, radio=True)
+
+
+def player_type(attributes: Mapping[str, Any]) -> str:
+    """Return which normalization pipeline applies to a media_player."""
+    # Music Assistant based media_players can be identified by the
+    # "mass_player_type" attribute
+    if attributes.get("mass_player_type"):
+        return PLAYER_TYPE_MASS
+    return PLAYER_TYPE_GENERIC
+
+
+def is_stream(attributes: Mapping[str, Any]) -> bool:
+    """Return whether a media_player plays a continuous stream, e.g. a radio.
+
+    The position of a stream counts from when it was tuned in, and songs are
+    only told apart by their titles.
+    """
+    if not attributes.get("media_duration"):
+        return True
+    content_id = attributes.get("media_content_id")
+    return (
+        player_type(attributes) == PLAYER_TYPE_MASS
+        and content_id is not None
+        and "radio" in content_id
+    )
+
+
+def content_type(attributes: Mapping[str, Any]) -> str | None:
+    """Return the kind of media a media_player plays, e.g. music or podcast."""
+    content_id = attributes.get("media_content_id") or ""
+    if content_id.startswith("media-source://tts") or "/api/tts_proxy/" in content_id:
+        return CONTENT_TYPE_TTS
+    return attributes.get("media_content_type")
+
+
+class MetadataNormalizer:
+    """Ordered normalization rules per player type, memoized per raw track."""
+
+    def __init__(
+        self,
+        artist_split_exceptions: Iterable[str] = DEFAULT_ARTIST_SPLIT_EXCEPTIONS,
+        strip_title_suffixes: bool = False,
+        rules: Mapping[str, Sequence[Rule]] | None = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ) -> None:
+        """Build the pipelines; ``rules`` replaces the default ones."""
+        if rules is None:
+            common: list[Rule] = [strip_suffixes] if strip_title_suffixes else []
+            rules = {
+                PLAYER_TYPE_GENERIC: common,
+                PLAYER_TYPE_MASS: [
+                    split_artists(artist_split_exceptions),
+                    *common,
+                    detect_radio,
+                ],
+            }
+        self._rules = {kind: tuple(pipeline) for kind, pipeline in rules.items()}
+        self._cache: LRUCache[tuple, TrackInfo | None] = LRUCache(cache_size)
+
+    def normalize(self, attributes: Mapping[str, Any]) -> TrackInfo | None:
+        """Return the track described by media_player attributes.
+
+        ``None`` is returned when artist or title are missing, as such a track
+        can't be scrobbled.
+        """
+        kind = player_type(attributes)
+        key = (
+            kind,
+            attributes.get("media_artist"),
+            attributes.get("media_title"),
+            attributes.get("media_album_name"),
+            attributes.get("media_content_id"),
+            attributes.get("media_duration"),
+        )
+        if (track := self._cache.get(key, _MISSING)) is _MISSING:
+            track = self._normalize(kind, *key[1:])
+            self._cache.put(key, track)
+        return track
+
+    def _normalize(
+        self,
+        kind: str,
+        artist: str | None,
+        title: str | None,
+        album: str | None,
+        content_id: str | None,
+        duration: Any,
+    ) -> TrackInfo | None:
+        """Run the pipeline of a player type."""
+        if not artist or not title:
+            return None
+        try:
+            duration = int(duration)
+        except (TypeError, ValueError):
+            duration = None
+        raw = RawTrack(artist, title, album, duration, content_id)
+        for rule in self._rules.get(kind, ()):
+            raw = rule(raw)
+        return TrackInfo(raw.artist, raw.title, raw.album, raw.duration, raw.radio)
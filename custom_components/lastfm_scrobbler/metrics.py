@@ -0,0 +1,135 @@
+"""Runtime metrics of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Sequence
+from typing import Any
+
+# milliseconds spent evaluating the players of a scrobbler
+EVALUATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+# seconds Last.fm took to answer a request
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# seconds from a track crossing its threshold to Last.fm accepting its scrobble
+SCROBBLE_DELAY_BUCKETS = (1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class Histogram:
+    """Observations counted per bucket; observing is a bisect and an increment."""
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        """Initialize the histogram with the upper bounds of its buckets."""
+        self.bounds = tuple(bounds)
+        # the last bucket holds everything above the highest bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Count an observation."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float | None:
+        """Return the mean of the observations, if any."""
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> float | None:
+        """Return the upper bound of the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts, strict=False):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return a summary and the buckets, for diagnostics and attributes."""
+        mean = self.mean
+        return {
+            "count": self.count,
+            "mean": None if mean is None else round(mean, 3),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 3),
+            "buckets": {
+                **{
+                    f"le_{bound}": count
+                    for bound, count in zip(self.bounds, self.counts, strict=False)
+                },
+                "inf": self.counts[-1],
+            },
+        }
+
+
+class ApiMetrics:
+    """Latency and outcome of the requests of a Last.fm client."""
+
+    __slots__ = ("latency", "requests", "errors", "rejected", "now_playing_coalesced")
+
+    def __init__(self) -> None:
+        """Initialize the metrics."""
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.requests = 0
+        # Last.fm error code, or "connection", -> number of failed requests
+        self.errors: Counter[str] = Counter()
+        # requests held back by an open circuit, which never reached Last.fm
+        self.rejected = 0
+        # now playing updates answered by an identical update of another entry
+        self.now_playing_coalesced = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the metrics for diagnostics."""
+        return {
+            "requests": self.requests,
+            "latency_s": self.latency.as_dict(),
+            "errors": dict(self.errors),
+            "rejected": self.rejected,
+            "now_playing_coalesced": self.now_playing_coalesced,
+        }
+
+
+class ScrobblerMetrics:
+    """What a scrobbler spent its time on and how fast its scrobbles got through."""
+
+    __slots__ = (
+        "evaluation",
+        "scrobble_delay",
+        "now_playing_sent",
+        "now_playing_skipped",
+        "scrobbles",
+        "setup_time",
+    )
+
+    def __init__(self) -> None:
+        """Initialize the metrics."""
+        self.evaluation = Histogram(EVALUATION_BUCKETS)
+        self.scrobble_delay = Histogram(SCROBBLE_DELAY_BUCKETS)
+        self.now_playing_sent = 0
+        # evaluations of an already announced track, which sent nothing
+        self.now_playing_skipped = 0
+        self.scrobbles = 0
+        # milliseconds it took to set the entry up, including its entities
+        self.setup_time: float | None = None
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the metrics for diagnostics."""
+        return {
+            "evaluation_ms": self.evaluation.as_dict(),
+            "scrobble_delay_s": self.scrobble_delay.as_dict(),
+            "now_playing_sent": self.now_playing_sent,
+            "now_playing_skipped": self.now_playing_skipped,
+            "scrobbles": self.scrobbles,
+            "setup_ms": None if self.setup_time is None else round(self.setup_time, 1),
+        }
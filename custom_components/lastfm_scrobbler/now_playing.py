@@ -0,0 +1,171 @@
+"""Debounced "now playing" updates for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Coroutine
+from datetime import datetime
+import logging
+import time
+from typing import Any
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .metadata import TrackInfo
+
+_LOGGER = logging.getLogger(__name__)
+
+# seconds a track must stay selected before it is sent as now playing
+DEFAULT_NOW_PLAYING_DELAY = 3
+# Last.fm lets a now playing status expire; long tracks are re-announced before
+NOW_PLAYING_REFRESH = 4 * 60
+
+Sender = Callable[[TrackInfo, str | None], Coroutine[Any, Any, bool]]
+
+
+class NowPlayingDispatcher:
+    """Send the now playing track of a scrobbler once it settled.
+
+    A new track is only sent after ``delay`` seconds without another one
+    replacing it, so skipping through a playlist or metadata arriving in
+    several state changes results in a single request for the final track.
+    An update still running when a newer track settles is cancelled. While
+    the sent track keeps playing, it is re-sent every ``NOW_PLAYING_REFRESH``
+    seconds.
+    """
+
+    __slots__ = (
+        "_hass",
+        "_send",
+        "delay",
+        "_on_dropped",
+        "_pending",
+        "_sending",
+        "_sent",
+        "_unsub_settle",
+        "_unsub_refresh",
+        "_player",
+    )
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        send: Sender,
+        delay: float = DEFAULT_NOW_PLAYING_DELAY,
+        on_dropped: Callable[[], None] | None = None,
+    ) -> None:
+        """Initialize the dispatcher.
+
+        ``send`` returns whether Last.fm accepted the update; ``on_dropped``
+        is called when a track stopped before it could be sent.
+        """
+        self._hass = hass
+        self._send = send
+        self.delay = delay
+        self._on_dropped = on_dropped
+        self._pending: tuple[TrackInfo, str | None] | None = None
+        self._sending: tuple[TrackInfo, asyncio.Task] | None = None
+        # the track Last.fm shows, and when it was sent
+        self._sent: tuple[TrackInfo, float] | None = None
+        self._unsub_settle: CALLBACK_TYPE | None = None
+        self._unsub_refresh: CALLBACK_TYPE | None = None
+        self._player: str | None = None
+
+    @callback
+    def async_request(self, track: TrackInfo, player: str | None) -> None:
+        """Send ``track`` once no other track replaced it for the delay."""
+        self._cancel(settle=True, refresh=True)
+        self._pending = (track, player)
+        if self.delay <= 0:
+            self._async_settled(None)
+        else:
+            self._unsub_settle = async_call_later(
+                self._hass, self.delay, self._async_settled
+            )
+
+    @callback
+    def async_playing(self, track: TrackInfo | None, player: str | None) -> None:
+        """Follow the selected track, to keep its status alive or drop it."""
+        if track is None:
+            # nothing to announce or keep alive anymore
+            if self._pending is not None:
+                _LOGGER.debug("Dropping now playing %s", self._pending[0].title)
+                self._pending = None
+                self._cancel(settle=True)
+                if self._on_dropped is not None:
+                    self._on_dropped()
+            self._cancel(refresh=True)
+            return
+        if self._pending is not None or self._sending is not None:
+            return
+        self._player = player
+        if self._sent is None or self._sent[0].key != track.key:
+            # e.g. restored after a restart: assume it was just sent
+            self._sent = (track, time.monotonic())
+        if self._unsub_refresh is None:
+            self._schedule_refresh()
+
+    @callback
+    def async_stop(self) -> None:
+        """Cancel everything, e.g. when the scrobbler is removed."""
+        self._pending = None
+        self._cancel(settle=True, refresh=True)
+        if self._sending is not None:
+            self._sending[1].cancel()
+            self._sending = None
+
+    @callback
+    def _async_settled(self, _now: datetime | None) -> None:
+        """Send the track that didn't change during the delay."""
+        self._unsub_settle = None
+        if self._pending is None:
+            return
+        (track, player), self._pending = self._pending, None
+        if self._sending is not None:
+            _LOGGER.debug("Cancelling now playing %s", self._sending[0].title)
+            self._sending[1].cancel()
+        self._async_start(track, player)
+
+    @callback
+    def _async_start(self, track: TrackInfo, player: str | None) -> None:
+        """Send an update in the background."""
+        self._player = player
+        task = self._hass.async_create_task(self._async_send(track, player))
+        self._sending = (track, task)
+
+    async def _async_send(self, track: TrackInfo, player: str | None) -> None:
+        """Send an update and keep it alive if Last.fm accepted it."""
+        try:
+            accepted = await self._send(track, player)
+        finally:
+            if self._sending is not None and self._sending[0] is track:
+                self._sending = None
+        if accepted:
+            self._sent = (track, time.monotonic())
+            self._schedule_refresh()
+
+    def _schedule_refresh(self) -> None:
+        """Re-send the sent track before its status expires."""
+        delay = NOW_PLAYING_REFRESH - (time.monotonic() - self._sent[1])
+        self._unsub_refresh = async_call_later(
+            self._hass, max(delay, 0), self._async_refresh
+        )
+
+    @callback
+    def _async_refresh(self, _now: datetime) -> None:
+        """Re-send the track that is still playing."""
+        self._unsub_refresh = None
+        if self._sent is None or self._pending is not None or self._sending is not None:
+            return
+        _LOGGER.debug("Refreshing now playing %s", self._sent[0].title)
+        self._async_start(self._sent[0], self._player)
+
+    def _cancel(self, *, settle: bool = False, refresh: bool = False) -> None:
+        """Cancel the settle and/or the refresh timer."""
+        if settle and self._unsub_settle is not None:
+            self._unsub_settle()
+            self._unsub_settle = None
+        if refresh and self._unsub_refresh is not None:
+            self._unsub_refresh()
+            self._unsub_refresh = None
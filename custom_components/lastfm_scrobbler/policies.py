@@ -0,0 +1,263 @@
+"""Scrobble policies of the lastfm_scrobbler integration.
+
+Like the engine, nothing in here depends on Home Assistant.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from fnmatch import translate
+import itertools
+import re
+from typing import Any
+
+from .const import (
+    CONF_MIN_DURATION,
+    CONF_POLICIES,
+    CONF_SCROBBLE_PERCENTAGE,
+    CONF_SKIP_ARTISTS,
+    CONF_SKIP_CONTENT_TYPES,
+    CONF_SKIP_TITLES,
+)
+from .metadata import TrackInfo
+
+# Last.fm ignores scrobbles of tracks shorter than 30 seconds
+DEFAULT_MIN_DURATION = 30
+
+# a policy with skip set ignores its player or content type altogether
+SKIP = "skip"
+POLICY_OPTIONS = frozenset(
+    (
+        CONF_MIN_DURATION,
+        CONF_SCROBBLE_PERCENTAGE,
+        SKIP,
+        CONF_SKIP_ARTISTS,
+        CONF_SKIP_TITLES,
+        CONF_SKIP_CONTENT_TYPES,
+    )
+)
+PATTERN_OPTIONS = (CONF_SKIP_ARTISTS, CONF_SKIP_TITLES)
+
+# policies keyed by an entity id apply to a player, others to a content type
+PLAYER_PREFIX = "media_player."
+
+
+class PolicyError(ValueError):
+    """Error to indicate an invalid scrobble policy."""
+
+    def __init__(self, option: str, message: str) -> None:
+        """Initialize the error, ``option`` being the config option at fault."""
+        super().__init__(message)
+        self.option = option
+
+
+def _pattern(option: str, pattern: str) -> str:
+    """Return the regular expression of a skip pattern.
+
+    Patterns are globs matching the whole value, e.g. ``*podcast*``, unless
+    they are wrapped in slashes: ``/live at \\w+/`` is a regular expression
+    found anywhere in the value.
+    """
+    if len(pattern) > 2 and pattern[0] == pattern[-1] == "/":
+        expression = f".*?(?:{pattern[1:-1]})"
+        try:
+            # also rejects inline flags, which can't be part of the matcher
+            re.compile(expression)
+        except re.error as ex:
+            raise PolicyError(option, f"invalid pattern {pattern}: {ex}") from ex
+        return expression
+    return translate(pattern)
+
+
+def _strings(option: str, key: str, value: Any) -> list[str]:
+    """Return the patterns or content types of a policy."""
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise PolicyError(option, f"{key}: expected a list of strings")
+    return value
+
+
+def _validate(
+    option: str, key: str, policy: Any, content_type: bool = False
+) -> dict[str, Any]:
+    """Return a validated policy, its skip patterns translated.
+
+    The policy of a content type can't skip other content types.
+    """
+    if not isinstance(policy, Mapping):
+        raise PolicyError(option, f"{key}: expected a mapping of options")
+    if unknown := set(policy) - POLICY_OPTIONS:
+        raise PolicyError(
+            option, f"{key}: unknown options {', '.join(sorted(unknown))}"
+        )
+    if content_type and CONF_SKIP_CONTENT_TYPES in policy:
+        raise PolicyError(
+            option, f"{key}: {CONF_SKIP_CONTENT_TYPES} only applies to media players"
+        )
+    validated = dict(policy)
+    for name, maximum in ((CONF_MIN_DURATION, None), (CONF_SCROBBLE_PERCENTAGE, 100)):
+        value = validated.get(name)
+        if value is None:
+            continue
+        if (
+            isinstance(value, bool)
+            or not isinstance(value, (int, float))
+            or value < 0
+            or (maximum is not None and value > maximum)
+        ):
+            raise PolicyError(option, f"{key}: invalid {name} {value}")
+    if not isinstance(validated.get(SKIP, False), bool):
+        raise PolicyError(option, f"{key}: {SKIP} must be true or false")
+    validated[CONF_SKIP_CONTENT_TYPES] = [
+        content_type.lower()
+        for content_type in _strings(
+            option, key, validated.get(CONF_SKIP_CONTENT_TYPES, [])
+        )
+    ]
+    for name in PATTERN_OPTIONS:
+        validated[name] = [
+            _pattern(option if key else name, pattern)
+            for pattern in _strings(option, key, validated.get(name, []))
+            if pattern
+        ]
+    return validated
+
+
+@dataclass(frozen=True, slots=True)
+class ScrobblePolicy:
+    """What a scrobbler accepts from one player and content type."""
+
+    min_duration: float = 0
+    # None: the scrobble percentage of the scrobbler
+    scrobble_percentage: float | None = None
+    skip: bool = False
+    skip_artists: re.Pattern | None = None
+    skip_titles: re.Pattern | None = None
+
+    def allows(self, track: TrackInfo) -> bool:
+        """Return whether ``track`` may be announced and scrobbled."""
+        if self.skip:
+            return False
+        if track.duration and track.duration < self.min_duration:
+            return False
+        if self.skip_artists is not None and self.skip_artists.match(track.artist):
+            return False
+        return self.skip_titles is None or not self.skip_titles.match(track.title)
+
+
+class ScrobblePolicies:
+    """The policies of a scrobbler, compiled once for every player and content type.
+
+    The options of the scrobbler apply to everything. A policy of a content
+    type (e.g. ``podcast``, or ``tts`` for announcements) overrides them, and
+    a policy of a media player overrides both. Skip lists add up. Every
+    combination is compiled up front into one matcher per skip list, so
+    finding the policy of a playing track is a dictionary lookup.
+    """
+
+    def __init__(
+        self,
+        min_duration: float = 0,
+        skip_artists: Iterable[str] = (),
+        skip_titles: Iterable[str] = (),
+        skip_content_types: Iterable[str] = (),
+        policies: Mapping[str, Any] | None = None,
+    ) -> None:
+        """Compile the policies; raise ``PolicyError`` if one is invalid."""
+        base = _validate(
+            CONF_POLICIES,
+            "",
+            {
+                CONF_MIN_DURATION: min_duration,
+                CONF_SKIP_ARTISTS: list(skip_artists),
+                CONF_SKIP_TITLES: list(skip_titles),
+                CONF_SKIP_CONTENT_TYPES: list(skip_content_types),
+            },
+        )
+        if not isinstance(policies or {}, Mapping):
+            raise PolicyError(CONF_POLICIES, "expected a mapping of policies")
+        players: dict[str | None, dict[str, Any]] = {None: {}}
+        content_types: dict[str | None, dict[str, Any]] = {None: {}}
+        for key, policy in (policies or {}).items():
+            if not isinstance(key, str) or not key:
+                raise PolicyError(
+                    CONF_POLICIES,
+                    f"{key!r}: expected a media player or a content type",
+                )
+            if key.startswith(PLAYER_PREFIX):
+                players[key] = _validate(CONF_POLICIES, key, policy)
+            else:
+                content_types[key.lower()] = _validate(
+                    CONF_POLICIES, key, policy, content_type=True
+                )
+        # skipped content types need a policy even without options of their own
+        for policy in (base, *players.values()):
+            for content_type in policy.get(CONF_SKIP_CONTENT_TYPES, ()):
+                content_types.setdefault(content_type, {})
+        self._policies = {
+            (player, content_type): self._compile(
+                base, content_types[content_type], players[player], content_type
+            )
+            for player, content_type in itertools.product(players, content_types)
+        }
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any]) -> ScrobblePolicies:
+        """Return the policies configured for an entry."""
+        return cls(
+            config.get(CONF_MIN_DURATION, DEFAULT_MIN_DURATION),
+            config.get(CONF_SKIP_ARTISTS, ()),
+            config.get(CONF_SKIP_TITLES, ()),
+            config.get(CONF_SKIP_CONTENT_TYPES, ()),
+            config.get(CONF_POLICIES),
+        )
+
+    @staticmethod
+    def _compile(
+        base: Mapping[str, Any],
+        content_type_policy: Mapping[str, Any],
+        player_policy: Mapping[str, Any],
+        content_type: str | None,
+    ) -> ScrobblePolicy:
+        """Merge the policies applying to a player and content type."""
+        layers = (base, content_type_policy, player_policy)
+        merged: dict[str, Any] = {}
+        for layer in layers:
+            merged.update(
+                (name, layer[name])
+                for name in (CONF_MIN_DURATION, CONF_SCROBBLE_PERCENTAGE, SKIP)
+                if layer.get(name) is not None
+            )
+        matchers = []
+        for name in PATTERN_OPTIONS:
+            expressions = [
+                expression for layer in layers for expression in layer.get(name, ())
+            ]
+            matchers.append(
+                re.compile(
+                    "|".join(f"(?:{expression})" for expression in expressions),
+                    re.IGNORECASE,
+                )
+                if expressions
+                else None
+            )
+        return ScrobblePolicy(
+            merged.get(CONF_MIN_DURATION, 0),
+            merged.get(CONF_SCROBBLE_PERCENTAGE),
+            merged.get(SKIP, False)
+            or content_type in base[CONF_SKIP_CONTENT_TYPES]
+            or content_type in player_policy.get(CONF_SKIP_CONTENT_TYPES, ()),
+            *matchers,
+        )
+
+    def resolve(self, player: str, content_type: str | None) -> ScrobblePolicy:
+        """Return the policy of what ``player`` plays."""
+        if content_type is not None:
+            content_type = content_type.lower()
+        # only players and content types with a policy of their own are compiled
+        for key in ((player, content_type), (player, None), (None, content_type)):
+            if (policy := self._policies.get(key)) is not None:
+                return policy
+        return self._policies[(None, None)]
@@ -0,0 +1,323 @@
+"""Persistent queue of pending scrobbles for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from datetime import datetime
+import logging
+import math
+import time
+from typing import Any
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+
+from .api import LastFMCircuitOpenError, LastFMClient, LastFMError
+from .const import DOMAIN
+from .engine import Scrobble
+from .history import KIND_SCROBBLE, ScrobbleHistory
+from .metrics import ScrobblerMetrics
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+SAVE_DELAY = 1
+
+# track.scrobble accepts at most 50 scrobbles per request
+BATCH_SIZE = 50
+# Last.fm rejects scrobbles with a timestamp older than 14 days
+MAX_AGE = 14 * 24 * 3600
+MIN_RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+# scrobbles queued within this many seconds are submitted in one request
+BATCH_DELAY = 2
+
+
+def _storage_key(entry_id: str) -> str:
+    """Return the storage key of the queue of a config entry."""
+    return f"{DOMAIN}.queue.{entry_id}"
+
+
+async def async_remove_queue(hass: HomeAssistant, entry_id: str) -> None:
+    """Remove the stored queue of a config entry from disk."""
+    await Store(hass, STORAGE_VERSION, _storage_key(entry_id)).async_remove()
+
+
+def scrobble_results(batch: list[Scrobble], response: dict[str, Any]) -> list[bool]:
+    """Return whether Last.fm accepted each scrobble of a batch, logging them."""
+    results = response.get("scrobbles", {}).get("scrobble", [])
+    if isinstance(results, dict):
+        results = [results]
+    accepted = []
+    for index, scrobble in enumerate(batch):
+        ignored = (
+            results[index].get("ignoredMessage", {}) if index < len(results) else {}
+        )
+        if ignored.get("code", "0") != "0":
+            _LOGGER.warning(
+                "Last.fm ignored scrobble of %s by %s: %s",
+                scrobble["track"],
+                scrobble["artist"],
+                ignored.get("#text") or ignored["code"],
+            )
+            accepted.append(False)
+        else:
+            _LOGGER.info(
+                "Successfully scrobbled %s by %s", scrobble["track"], scrobble["artist"]
+            )
+            accepted.append(True)
+    return accepted
+
+
+def _key(scrobble: Scrobble) -> tuple[int, str, str]:
+    """Return what identifies a queued scrobble."""
+    return (scrobble["timestamp"], scrobble["artist"], scrobble["track"])
+
+
+class ScrobbleQueue:
+    """Durable per config entry queue, flushed to Last.fm in batches.
+
+    Plays are recorded in the local history once Last.fm accepted them, so
+    plays it ignored, or that expired in the queue, never count as scrobbled.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry_id: str,
+        client: LastFMClient,
+        session_key: str,
+        metrics: ScrobblerMetrics | None = None,
+        history: ScrobbleHistory | None = None,
+    ) -> None:
+        """Initialize the queue."""
+        self._hass = hass
+        self._entry_id = entry_id
+        self._client = client
+        self.session_key = session_key
+        self._store: Store[dict[str, list]] = Store(
+            hass, STORAGE_VERSION, _storage_key(entry_id)
+        )
+        self._scrobbles: list[Scrobble] = []
+        # the media player of each pending scrobble, for the history
+        self._players: list[str | None] = []
+        self._history = history
+        self._lock = asyncio.Lock()
+        self._retry_delay = 0
+        self._unsub_retry: CALLBACK_TYPE | None = None
+        self._unsub_batch: CALLBACK_TYPE | None = None
+        self._flush_task: asyncio.Task | None = None
+        self._last_error: str | None = None
+        self._metrics = metrics
+        # (timestamp, artist, track) -> monotonic time its threshold was crossed
+        self._crossed: dict[tuple[int, str, str], float] = {}
+
+    async def async_load(self) -> None:
+        """Load the scrobbles that were pending when Home Assistant stopped."""
+        if (data := await self._store.async_load()) is not None:
+            self._scrobbles = data["scrobbles"]
+            # queues stored by older versions don't know the players
+            self._players = data.get("players") or [None] * len(self._scrobbles)
+            _LOGGER.debug("Loaded %s pending scrobbles", len(self._scrobbles))
+
+    async def async_shutdown(self) -> None:
+        """Stop retrying and write pending scrobbles to disk."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            # let the flush stop before the queue it updates is saved
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._flush_task
+        async with self._lock:
+            self._cancel_retry()
+            if self._unsub_batch is not None:
+                self._unsub_batch()
+                self._unsub_batch = None
+            await self._store.async_save(self._data_to_save())
+
+    @property
+    def depth(self) -> int:
+        """Return the number of pending scrobbles."""
+        return len(self._scrobbles)
+
+    @property
+    def pending(self) -> list[Scrobble]:
+        """Return the scrobbles not accepted by Last.fm yet."""
+        return list(self._scrobbles)
+
+    @callback
+    def async_add(
+        self,
+        scrobble: Scrobble,
+        player: str | None = None,
+        crossed: float | None = None,
+    ) -> None:
+        """Queue a scrobble and submit it shortly, with whatever follows it.
+
+        ``crossed`` is the ``time.monotonic()`` the track crossed its scrobble
+        threshold at, to measure how long its scrobble took to be accepted.
+        """
+        self._scrobbles.append(scrobble)
+        self._players.append(player)
+        if crossed is not None and self._metrics is not None:
+            self._crossed[_key(scrobble)] = crossed
+        self._store.async_delay_save(self._data_to_save, SAVE_DELAY)
+        if self._unsub_retry is None and self._unsub_batch is None:
+            # no backoff running: Last.fm is assumed to be up
+            self._unsub_batch = async_call_later(
+                self._hass, BATCH_DELAY, self._async_submit_batch
+            )
+
+    @callback
+    def _async_submit_batch(self, _now: datetime) -> None:
+        """Flush the scrobbles queued during the batch delay."""
+        self._unsub_batch = None
+        self.async_schedule_flush()
+
+    @callback
+    def async_schedule_flush(self) -> None:
+        """Flush the queue in the background."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = self._hass.async_create_background_task(
+                self.async_flush(), f"{DOMAIN} flush scrobble queue"
+            )
+
+    async def async_flush(self) -> None:
+        """Submit all pending scrobbles, BATCH_SIZE at a time."""
+        async with self._lock:
+            self._cancel_retry()
+            self._drop_expired()
+            while self._scrobbles:
+                batch = self._scrobbles[:BATCH_SIZE]
+                try:
+                    response = await self._client.async_scrobble_batch(
+                        self.session_key, batch
+                    )
+                except LastFMError as ex:
+                    self._last_error = str(ex)
+                    if not ex.retryable and not ex.auth:
+                        # e.g. invalid parameters: the batch will never be accepted
+                        _LOGGER.error(
+                            "Last.fm rejected %s scrobbles, dropping them: %s",
+                            len(batch),
+                            ex,
+                        )
+                        self._remove(len(batch))
+                        continue
+                    if ex.auth:
+                        self._async_start_reauth()
+                    self._schedule_retry(ex)
+                    _LOGGER.warning(
+                        "Failed to submit %s scrobbles, retrying in %ss: %s",
+                        len(self._scrobbles),
+                        self._retry_delay,
+                        ex,
+                    )
+                    return
+                self._record(batch, scrobble_results(batch, response))
+                if self._crossed:
+                    self._observe_delays(batch)
+                self._remove(len(batch))
+            self._retry_delay = 0
+            self._last_error = None
+
+    def diagnostics(self) -> dict[str, Any]:
+        """Return the queue depth and age for the diagnostics download."""
+        oldest = self._scrobbles[0]["timestamp"] if self._scrobbles else None
+        return {
+            "depth": len(self._scrobbles),
+            "oldest_age": None if oldest is None else int(time.time()) - oldest,
+            "retry_delay": self._retry_delay,
+            "retry_scheduled": self._unsub_retry is not None,
+            "last_error": self._last_error,
+        }
+
+    def _record(self, batch: list[Scrobble], accepted: list[bool]) -> None:
+        """Record the scrobbles of a batch Last.fm accepted in the history."""
+        if self._history is None:
+            return
+        for scrobble, player, ok in zip(batch, self._players, accepted, strict=False):
+            if ok:
+                self._history.async_record(
+                    self._entry_id,
+                    player,
+                    KIND_SCROBBLE,
+                    scrobble["artist"],
+                    scrobble["track"],
+                    scrobble["album"],
+                    scrobble["duration"],
+                    scrobble["timestamp"],
+                )
+
+    def _remove(self, count: int) -> None:
+        """Remove the first ``count`` scrobbles, submitted or dropped."""
+        del self._scrobbles[:count]
+        del self._players[:count]
+        self._store.async_delay_save(self._data_to_save, SAVE_DELAY)
+
+    def _observe_delays(self, batch: list[Scrobble]) -> None:
+        """Measure how long the submitted scrobbles took since their threshold."""
+        now = time.monotonic()
+        for scrobble in batch:
+            if (crossed := self._crossed.pop(_key(scrobble), None)) is not None:
+                self._metrics.scrobble_delay.observe(now - crossed)
+
+    @callback
+    def _data_to_save(self) -> dict[str, list]:
+        """Return the data to store."""
+        return {"scrobbles": self._scrobbles, "players": self._players}
+
+    def _drop_expired(self) -> None:
+        """Drop scrobbles Last.fm would reject for being too old."""
+        oldest_allowed = int(time.time()) - MAX_AGE
+        if expired := [s for s in self._scrobbles if s["timestamp"] < oldest_allowed]:
+            _LOGGER.warning(
+                "Dropping %s scrobbles older than 14 days that could not be submitted",
+                len(expired),
+            )
+            kept = [
+                (scrobble, player)
+                for scrobble, player in zip(self._scrobbles, self._players, strict=True)
+                if scrobble["timestamp"] >= oldest_allowed
+            ]
+            self._scrobbles = [scrobble for scrobble, _ in kept]
+            self._players = [player for _, player in kept]
+            for scrobble in expired:
+                self._crossed.pop(_key(scrobble), None)
+
+    def _schedule_retry(self, error: LastFMError) -> None:
+        """Retry the flush with an exponential backoff."""
+        if error.auth:
+            # new credentials flush the queue; this is in case Last.fm erred
+            self._retry_delay = MAX_RETRY_DELAY
+        else:
+            self._retry_delay = min(
+                max(self._retry_delay * 2, MIN_RETRY_DELAY), MAX_RETRY_DELAY
+            )
+        if isinstance(error, LastFMCircuitOpenError):
+            # nothing gets through before the circuit lets a probe through
+            self._retry_delay = max(self._retry_delay, math.ceil(error.retry_in))
+        self._unsub_retry = async_call_later(
+            self._hass, self._retry_delay, self._async_retry
+        )
+
+    @callback
+    def _async_start_reauth(self) -> None:
+        """Ask for new credentials, which Last.fm rejected."""
+        if (
+            entry := self._hass.config_entries.async_get_entry(self._entry_id)
+        ) is not None:
+            entry.async_start_reauth(self._hass)
+
+    @callback
+    def _async_retry(self, _now: datetime) -> None:
+        """Flush the queue once the backoff expired."""
+        self._unsub_retry = None
+        self.async_schedule_flush()
+
+    def _cancel_retry(self) -> None:
+        """Cancel a scheduled retry."""
+        if self._unsub_retry is not None:
+            self._unsub_retry()
+            self._unsub_retry = None
@@ -0,0 +1,589 @@
+"""The scrobbler entity of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Coroutine
+from dataclasses import asdict, dataclass, field
+from datetime import time
+import logging
+from time import monotonic, perf_counter
+from typing import Any
+
+from homeassistant import core
+from homeassistant.components.sensor import SensorEntity
+from homeassistant.const import CONF_API_KEY, CONF_ENTITY_ID, CONF_NAME, Platform
+from homeassistant.core import (
+    CALLBACK_TYPE,
+    callback,
+)
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.restore_state import (
+    ExtraStoredData,
+    RestoreEntity,
+    async_get as async_get_restore_state,
+)
+from homeassistant.util import dt as dt_util
+
+from .api import LastFMCircuitOpenError, LastFMClient, LastFMError
+from .const import (
+    CONF_API_SECRET,
+    CONF_CHECK_ENTITY,
+    CONF_CHECK_MODE,
+    CONF_CHECK_TEMPLATE,
+    CONF_CHECK_ZONES,
+    CONF_CORRECT_METADATA,
+    CONF_NOW_PLAYING_DELAY,
+    CONF_SCROBBLE_PERCENTAGE,
+    CONF_SESSION_KEY,
+    CONF_SCROBBLE_ALL_PLAYERS,
+    CONF_SCROBBLE_STREAMS,
+    CONF_TIME_WINDOW_END,
+    CONF_TIME_WINDOW_START,
+    CONF_UPDATE_NOW_PLAYING,
+    DATA_CLIENTS,
+    DATA_CORRECTIONS,
+    DATA_HISTORY,
+    DATA_HUB,
+    DATA_METRICS,
+    DATA_QUEUES,
+    DOMAIN,
+    SIGNAL_OPTIONS_UPDATED,
+)
+from .corrections import CorrectionCache
+from .engine import Scrobble, ScrobblerEngine
+from .gating import CHECK_MODE_ALL, ScrobbleGate
+from .history import KIND_NOW_PLAYING, ScrobbleHistory
+from .hub import PlayerHub
+from .metadata import TrackInfo
+from .metrics import ScrobblerMetrics
+from .now_playing import DEFAULT_NOW_PLAYING_DELAY, NowPlayingDispatcher
+from .policies import ScrobblePolicies
+from .scrobble_queue import ScrobbleQueue
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def create_scrobbler(hass: core.HomeAssistant, entry_id: str) -> LastFMScrobblerSensor:
+    """Create the scrobbler entity of a config entry."""
+    config = hass.data[DOMAIN][entry_id]
+    name = config[CONF_NAME]
+    session_key = config[CONF_SESSION_KEY]
+    media_players = config[CONF_ENTITY_ID]
+    gate_options = _gate_options(config)
+    scrobble_percentage = config[CONF_SCROBBLE_PERCENTAGE]
+    update_now_playing = config[CONF_UPDATE_NOW_PLAYING]
+    now_playing_delay = config.get(CONF_NOW_PLAYING_DELAY, DEFAULT_NOW_PLAYING_DELAY)
+    scrobble_all_players = config.get(CONF_SCROBBLE_ALL_PLAYERS, False)
+    scrobble_streams = config.get(CONF_SCROBBLE_STREAMS, False)
+    hub = hass.data[DOMAIN][DATA_HUB]
+    normalizer = hub.normalizer(config)
+    corrections = _corrections(hass, config)
+
+    client = hass.data[DOMAIN][DATA_CLIENTS].get(
+        config[CONF_API_KEY], config[CONF_API_SECRET]
+    )
+    queue = hass.data[DOMAIN][DATA_QUEUES][entry_id]
+
+    return LastFMScrobblerSensor(
+        entry_id,
+        name,
+        hub,
+        client,
+        queue,
+        hass.data[DOMAIN][DATA_HISTORY],
+        session_key,
+        media_players,
+        gate_options,
+        scrobble_percentage,
+        update_now_playing,
+        now_playing_delay,
+        scrobble_all_players,
+        scrobble_streams,
+        normalizer,
+        corrections,
+        hass.data[DOMAIN][DATA_CORRECTIONS],
+        hass.data[DOMAIN][DATA_METRICS][entry_id],
+        ScrobblePolicies.from_config(config),
+    )
+
+
+def _corrections(
+    hass: core.HomeAssistant, config: dict[str, Any]
+) -> CorrectionCache | None:
+    """Return the correction cache if an entry corrects its metadata."""
+    if not config.get(CONF_CORRECT_METADATA, False):
+        return None
+    return hass.data[DOMAIN][DATA_CORRECTIONS]
+
+
+def _gate_options(config: dict[str, Any]) -> dict[str, Any]:
+    """Return the scrobble conditions configured for an entry."""
+    return {
+        "check_entities": config[CONF_CHECK_ENTITY],
+        "mode": config.get(CONF_CHECK_MODE, CHECK_MODE_ALL),
+        "zones": config.get(CONF_CHECK_ZONES, []),
+        "window_start": _parse_time(config.get(CONF_TIME_WINDOW_START)),
+        "window_end": _parse_time(config.get(CONF_TIME_WINDOW_END)),
+        "template": config.get(CONF_CHECK_TEMPLATE),
+    }
+
+
+def _parse_time(value: str | None) -> time | None:
+    """Parse a time of the time selector."""
+    return None if value is None else dt_util.parse_time(value)
+
+
+@dataclass
+class ScrobblerExtraStoredData(ExtraStoredData):
+    """Dedup state of a scrobbler that survives restarts and reloads."""
+
+    now_playing: tuple | None
+    last_scrobbled_track: tuple | None
+    session_track: tuple | None
+    session_started: int | None
+    scrobbled_sessions: dict[str, tuple[tuple, int]] = field(default_factory=dict)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return a dict representation of the stored data."""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, restored: dict[str, Any]) -> ScrobblerExtraStoredData | None:
+        """Initialize the stored data from a dict."""
+
+        def _track(value: list | None) -> tuple | None:
+            # tracks are stored as JSON lists
+            return None if value is None else tuple(value)
+
+        try:
+            return cls(
+                _track(restored["now_playing"]),
+                _track(restored["last_scrobbled_track"]),
+                _track(restored["session_track"]),
+                restored["session_started"],
+                {
+                    entity_id: (tuple(track), started)
+                    for entity_id, (track, started) in restored.get(
+                        "scrobbled_sessions", {}
+                    ).items()
+                },
+            )
+        except KeyError:
+            return None
+
+
+class LastFMScrobblerSensor(SensorEntity, RestoreEntity):
+    """The scrobbler of a config entry, showing the track it is following.
+
+    Its state is the selected track, with the track details and the media
+    player it plays on as attributes.
+    """
+
+    _attr_should_poll = False
+    _attr_icon = "mdi:music-note"
+
+    def __init__(
+        self,
+        entry_id,
+        name,
+        hub,
+        client,
+        queue,
+        history,
+        session_key,
+        media_players,
+        gate_options,
+        scrobble_percentage,
+        update_now_playing,
+        now_playing_delay,
+        scrobble_all_players,
+        scrobble_streams,
+        normalizer,
+        corrections,
+        track_info,
+        metrics,
+        policies,
+    ) -> None:
+        """Initialize the scrobbler entity."""
+        self._attr_name = name
+        self._attr_unique_id = f"{DOMAIN}-{name}"
+        # what the entity shows: the selected track and its player
+        self._shown: tuple[TrackInfo | None, str | None] = (None, None)
+        self._engine = ScrobblerEngine(
+            scrobble_percentage,
+            update_now_playing,
+            normalizer,
+            scrobble_all_players,
+            scrobble_streams,
+            # the songs of a stream are timed with their cached Last.fm duration
+            track_info.duration,
+            policies,
+        )
+        self._hub: PlayerHub = hub
+        self._client: LastFMClient = client
+        self._queue: ScrobbleQueue = queue
+        self._history: ScrobbleHistory = history
+        self._session_key = session_key
+        self._media_players = media_players
+        self._gate_options: dict[str, Any] = gate_options
+        self._gate: ScrobbleGate | None = None
+        self._entry_id = entry_id
+        self._corrections: CorrectionCache | None = corrections
+        self._prefetched: tuple | None = None
+        self._track_info: CorrectionCache = track_info
+        # player -> the stream song whose duration was last looked up
+        self._estimated: dict[str, tuple] = {}
+        self._unsub_scrobble_timers: list[CALLBACK_TYPE] = []
+        self._unsub_players: CALLBACK_TYPE | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._metrics: ScrobblerMetrics = metrics
+        self._now_playing: NowPlayingDispatcher | None = None
+        self._now_playing_delay = now_playing_delay
+
+    def check_entities(self) -> bool:
+        """Return whether the check entities and conditions agree to scrobble."""
+        return self._gate is not None and self._gate.allowed
+
+    async def async_update_now_playing(
+        self, track: TrackInfo, player: str | None = None
+    ):
+        """Update the current playing song."""
+        if self._corrections is not None:
+            track = await self._corrections.async_correct(self._client, track)
+        try:
+            await self._client.async_update_now_playing(
+                self._session_key,
+                artist=track.artist,
+                title=track.title,
+                album=track.album,
+                duration=track.duration,
+            )
+        except LastFMError as ex:
+            # an open circuit was logged when it opened
+            _LOGGER.log(
+                (
+                    logging.DEBUG
+                    if isinstance(ex, LastFMCircuitOpenError)
+                    else logging.ERROR
+                ),
+                "Failed to update now playing to %s by %s: %s",
+                track.title,
+                track.artist,
+                ex,
+            )
+            if ex.auth and (
+                entry := self.hass.config_entries.async_get_entry(self._entry_id)
+            ):
+                entry.async_start_reauth(self.hass)
+            # allow a retry on the next relevant state change
+            self._engine.now_playing = None
+            return False
+
+        self._metrics.now_playing_sent += 1
+        self._history.async_record(
+            self._entry_id,
+            player,
+            KIND_NOW_PLAYING,
+            track.artist,
+            track.title,
+            track.album,
+            track.duration,
+        )
+        return True
+
+    @callback
+    def async_scrobble(
+        self,
+        scrobble: Scrobble,
+        player: str | None = None,
+        crossed: float | None = None,
+    ):
+        """Queue a track for scrobbling to Last.fm."""
+        # the queue persists the scrobble, so it won't be lost if Last.fm is down,
+        # and records it in the history once Last.fm accepted it
+        self._queue.async_add(scrobble, player, crossed)
+        self._metrics.scrobbles += 1
+        _LOGGER.debug(
+            "Queued %s by %s for scrobbling", scrobble["track"], scrobble["artist"]
+        )
+
+    @callback
+    def _async_submit(self, player: str, scrobble: Scrobble, crossed: float) -> None:
+        """Scrobble a track that crossed its threshold, corrected if enabled."""
+        if self._corrections is None:
+            self.async_scrobble(scrobble, player, crossed)
+        else:
+            self._async_track_task(
+                self._async_correct_and_scrobble(player, scrobble, crossed)
+            )
+
+    async def _async_correct_and_scrobble(
+        self, player: str, scrobble: Scrobble, crossed: float
+    ) -> None:
+        """Queue a scrobble once Last.fm corrected its metadata, or gave up."""
+        track = TrackInfo(
+            scrobble["artist"],
+            scrobble["track"],
+            scrobble["album"],
+            scrobble["duration"],
+        )
+        try:
+            corrected = await self._corrections.async_correct(self._client, track)
+        except asyncio.CancelledError:
+            # being removed: better scrobble the track as the player named it
+            self.async_scrobble(scrobble, player, crossed)
+            raise
+        self.async_scrobble(
+            Scrobble(
+                artist=corrected.artist,
+                track=corrected.title,
+                album=corrected.album,
+                duration=corrected.duration,
+                timestamp=scrobble["timestamp"],
+            ),
+            player,
+            crossed,
+        )
+
+    @property
+    def extra_restore_state_data(self) -> ScrobblerExtraStoredData:
+        """Return the dedup state to be restored after a restart or reload."""
+        tracker = self._engine.tracker
+        return ScrobblerExtraStoredData(
+            self._engine.now_playing,
+            self._engine.last_scrobbled_track,
+            tracker.track if tracker is not None else None,
+            tracker.started if tracker is not None else None,
+            self._engine.scrobbled_sessions,
+        )
+
+    async def async_added_to_hass(self) -> None:
+        """Subscribe to the media players and check entities."""
+        extra_data = (
+            await self.async_get_last_extra_data() or self._async_adopt_media_player()
+        )
+        if (
+            extra_data is not None
+            and (restored := ScrobblerExtraStoredData.from_dict(extra_data.as_dict()))
+            is not None
+        ):
+            # avoids scrobbling or announcing the current track a second time
+            self._engine.now_playing = restored.now_playing
+            self._engine.last_scrobbled_track = restored.last_scrobbled_track
+            if restored.session_track is not None:
+                self._engine.restored_session = (
+                    restored.session_track,
+                    restored.session_started,
+                )
+            self._engine.scrobbled_sessions = restored.scrobbled_sessions
+        self._now_playing = NowPlayingDispatcher(
+            self.hass,
+            self.async_update_now_playing,
+            self._now_playing_delay,
+            self._async_now_playing_dropped,
+        )
+        self.async_on_remove(self._now_playing.async_stop)
+        self._async_subscribe()
+        self.async_on_remove(self._async_unsubscribe)
+        self.async_on_remove(self._async_cancel_scrobble_timer)
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                SIGNAL_OPTIONS_UPDATED.format(self._entry_id),
+                self._async_apply_options,
+            )
+        )
+        self._async_evaluate()
+
+    @callback
+    def _async_adopt_media_player(self) -> ExtraStoredData | None:
+        """Replace the media_player of older versions, taking over its dedup state."""
+        registry = er.async_get(self.hass)
+        if (
+            entity_id := registry.async_get_entity_id(
+                Platform.MEDIA_PLAYER, DOMAIN, self.unique_id
+            )
+        ) is None:
+            return None
+        stored = async_get_restore_state(self.hass).last_states.get(entity_id)
+        registry.async_remove(entity_id)
+        _LOGGER.info("%s replaces %s", self.entity_id, entity_id)
+        return None if stored is None else stored.extra_data
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Cancel any pending now playing / scrobble work."""
+        for task in self._tasks:
+            task.cancel()
+
+    @callback
+    def _async_subscribe(self) -> None:
+        """Start listening to the configured media players and check entities."""
+        self._unsub_players = self._hub.async_subscribe(
+            self._media_players, self._async_evaluate
+        )
+        self._gate = ScrobbleGate(
+            self.hass, on_change=self._async_gate_changed, **self._gate_options
+        )
+        self._gate.async_start()
+
+    @callback
+    def _async_unsubscribe(self) -> None:
+        """Stop listening to state changes."""
+        if self._unsub_players is not None:
+            self._unsub_players()
+            self._gate.async_stop()
+            self._unsub_players = self._gate = None
+
+    @callback
+    def _async_apply_options(self, config: dict[str, Any]) -> None:
+        """Apply changed options to the running entity."""
+        if config[CONF_SESSION_KEY] != self._session_key:
+            # a different account hasn't been told what's playing yet
+            self._engine.now_playing = None
+        self._session_key = config[CONF_SESSION_KEY]
+        self._engine.scrobble_percentage = config[CONF_SCROBBLE_PERCENTAGE]
+        self._engine.update_now_playing = config[CONF_UPDATE_NOW_PLAYING]
+        if not self._engine.update_now_playing:
+            self._now_playing.async_stop()
+        self._now_playing.delay = config.get(
+            CONF_NOW_PLAYING_DELAY, DEFAULT_NOW_PLAYING_DELAY
+        )
+        self._engine.concurrent = config.get(CONF_SCROBBLE_ALL_PLAYERS, False)
+        self._engine.streams = config.get(CONF_SCROBBLE_STREAMS, False)
+        self._engine.normalizer = self._hub.normalizer(config)
+        self._engine.policies = ScrobblePolicies.from_config(config)
+        self._corrections = _corrections(self.hass, config)
+        self._prefetched = None
+        media_players = config[CONF_ENTITY_ID]
+        gate_options = _gate_options(config)
+        if (media_players, gate_options) != (self._media_players, self._gate_options):
+            self._media_players = media_players
+            self._gate_options = gate_options
+            self._async_unsubscribe()
+            self._async_subscribe()
+        # the new percentage or players may change the scrobble deadline
+        self._async_evaluate()
+
+    @callback
+    def _async_estimate(self, player_entity_id: str, track: TrackInfo) -> None:
+        """Look up the duration of a stream's song once, then re-evaluate."""
+        if self._estimated.get(player_entity_id) == track.key:
+            return
+        self._estimated[player_entity_id] = track.key
+        if (task := self._track_info.async_lookup(self._client, track)) is not None:
+            task.add_done_callback(self._async_estimated)
+
+    @callback
+    def _async_estimated(self, _task: asyncio.Task) -> None:
+        """Time the song of a stream with the duration that was looked up."""
+        if self._unsub_players is not None:
+            self._async_evaluate()
+
+    @callback
+    def _async_now_playing_dropped(self) -> None:
+        """Announce a track that stopped before being sent when it plays again."""
+        self._engine.now_playing = None
+
+    @callback
+    def _async_gate_changed(self) -> None:
+        """Re-evaluate when scrobbling got allowed or blocked."""
+        _LOGGER.debug("Scrobble conditions changed - %s re-evaluating", self.name)
+        self._async_evaluate()
+
+    @callback
+    def _async_cancel_scrobble_timer(self) -> None:
+        """Cancel the timers scheduled for the playing tracks, if any."""
+        for unsub in self._unsub_scrobble_timers:
+            unsub()
+        self._unsub_scrobble_timers.clear()
+
+    @callback
+    def _async_scrobble_timer_fired(self) -> None:
+        """Re-evaluate once the current track crosses its scrobble threshold."""
+        self._async_evaluate()
+
+    @callback
+    def _async_track_task(self, target: Coroutine[Any, Any, Any]) -> None:
+        """Run a Last.fm call as a task that is cancelled on removal."""
+        task = self.hass.async_create_task(target)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @callback
+    def _async_evaluate(self) -> None:
+        """Find the highest priority active player and schedule its scrobble."""
+        self._async_cancel_scrobble_timer()
+        if not self.check_entities():
+            _LOGGER.debug(
+                "%s is NOT updating: the scrobble conditions are not met", self.name
+            )
+            self._now_playing.async_playing(None, None)
+            self._async_show(None, None)
+            return
+        _LOGGER.debug("Entity checks passed - %s now updating", self.name)
+        started = perf_counter()
+        decision = self._engine.evaluate(
+            (
+                observer
+                for player_entity_id in self._media_players
+                if (observer := self._hub.observer(player_entity_id)) is not None
+            ),
+            dt_util.utcnow(),
+        )
+        self._metrics.evaluation.observe((perf_counter() - started) * 1000)
+        if (track := decision.track) is not None:
+            if self._corrections is not None and track.key != self._prefetched:
+                # usually done long before the track needs to be scrobbled
+                self._prefetched = track.key
+                self._corrections.async_prefetch(self._client, track)
+            if decision.update_now_playing:
+                # sent once no other track replaced it for the settle delay
+                self._now_playing.async_request(track, decision.player)
+            elif self._engine.update_now_playing:
+                self._metrics.now_playing_skipped += 1
+        if self._engine.update_now_playing:
+            self._now_playing.async_playing(track, decision.player)
+        for player_entity_id, track in decision.estimates.items():
+            self._async_estimate(player_entity_id, track)
+        crossed = monotonic()
+        for player_entity_id, scrobble in decision.scrobbles.items():
+            self._async_submit(player_entity_id, scrobble, crossed)
+        for player_entity_id, deadline in decision.deadlines.items():
+            # shared with the other scrobblers waiting for this crossing
+            self._unsub_scrobble_timers.append(
+                self._hub.async_track_deadline(
+                    player_entity_id, deadline, self._async_scrobble_timer_fired
+                )
+            )
+        self._async_show(track, decision.player)
+
+    @callback
+    def _async_show(self, track: TrackInfo | None, player: str | None) -> None:
+        """Show the selected track, writing the state only when it changes."""
+        if (track, player) != self._shown:
+            self._shown = (track, player)
+            self.async_write_ha_state()
+
+    @property
+    def native_value(self) -> str | None:
+        """Return the selected track."""
+        if (track := self._shown[0]) is None:
+            return None
+        # states are limited to 255 characters
+        return f"{track.artist} - {track.title}"[:255]
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        """Return the details of the selected track."""
+        track, player = self._shown
+        if track is None:
+            return {}
+        return {
+            "artist": track.artist,
+            "title": track.title,
+            "album": track.album,
+            "duration": track.duration,
+            "media_player": player,
+        }
@@ -0,0 +1,179 @@
+"""Sensors of the lastfm_scrobbler integration: the scrobbler and its metrics."""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any
+
+from homeassistant import config_entries, core
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.const import (
+    CONF_API_KEY,
+    CONF_NAME,
+    EntityCategory,
+    UnitOfTime,
+)
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .api import LastFMClient
+from .const import (
+    CONF_API_SECRET,
+    DATA_CLIENTS,
+    DATA_METRICS,
+    DATA_QUEUES,
+    DOMAIN,
+)
+from .metrics import ApiMetrics, ScrobblerMetrics
+from .scrobble_queue import ScrobbleQueue
+from .scrobbler import create_scrobbler
+
+# the sensors read counters maintained on the hot path; polling them is cheap
+SCAN_INTERVAL = timedelta(seconds=60)
+
+
+@dataclass(frozen=True, kw_only=True)
+class ScrobblerSensorEntityDescription(SensorEntityDescription):
+    """Describes a diagnostic sensor of a scrobbler."""
+
+    value_fn: Callable[[ScrobblerMetrics, ApiMetrics, ScrobbleQueue], Any]
+    attributes_fn: (
+        Callable[[ScrobblerMetrics, ApiMetrics, ScrobbleQueue], dict[str, Any]] | None
+    ) = None
+
+
+SENSORS: tuple[ScrobblerSensorEntityDescription, ...] = (
+    ScrobblerSensorEntityDescription(
+        key="queue_depth",
+        name="Pending scrobbles",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda metrics, api, queue: queue.depth,
+        attributes_fn=lambda metrics, api, queue: queue.diagnostics(),
+    ),
+    ScrobblerSensorEntityDescription(
+        key="evaluation_time",
+        name="Evaluation time",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        suggested_display_precision=3,
+        value_fn=lambda metrics, api, queue: metrics.evaluation.mean,
+        attributes_fn=lambda metrics, api, queue: metrics.evaluation.as_dict(),
+    ),
+    ScrobblerSensorEntityDescription(
+        key="scrobble_delay",
+        name="Scrobble delay",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.SECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        suggested_display_precision=1,
+        value_fn=lambda metrics, api, queue: metrics.scrobble_delay.mean,
+        attributes_fn=lambda metrics, api, queue: metrics.scrobble_delay.as_dict(),
+    ),
+    ScrobblerSensorEntityDescription(
+        key="now_playing_saved",
+        name="Now playing updates saved",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda metrics, api, queue: (
+            metrics.now_playing_skipped + api.now_playing_coalesced
+        ),
+        attributes_fn=lambda metrics, api, queue: {
+            "sent": metrics.now_playing_sent,
+            "skipped": metrics.now_playing_skipped,
+            "coalesced": api.now_playing_coalesced,
+        },
+    ),
+    ScrobblerSensorEntityDescription(
+        key="api_latency",
+        name="Last.fm latency",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.SECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        suggested_display_precision=3,
+        value_fn=lambda metrics, api, queue: api.latency.mean,
+        attributes_fn=lambda metrics, api, queue: api.latency.as_dict(),
+    ),
+    ScrobblerSensorEntityDescription(
+        key="api_errors",
+        name="Last.fm errors",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda metrics, api, queue: api.errors.total(),
+        attributes_fn=lambda metrics, api, queue: {
+            "requests": api.requests,
+            "rejected": api.rejected,
+            **{f"error_{code}": count for code, count in api.errors.items()},
+        },
+    ),
+)
+
+
+async def async_setup_entry(
+    hass: core.HomeAssistant,
+    config_entry: config_entries.ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+) -> None:
+    """Set up the scrobbler of a config entry and its diagnostic sensors."""
+    config = hass.data[DOMAIN][config_entry.entry_id]
+    client: LastFMClient = hass.data[DOMAIN][DATA_CLIENTS].get(
+        config[CONF_API_KEY], config[CONF_API_SECRET]
+    )
+    metrics = hass.data[DOMAIN][DATA_METRICS][config_entry.entry_id]
+    queue = hass.data[DOMAIN][DATA_QUEUES][config_entry.entry_id]
+    async_add_entities(
+        [
+            create_scrobbler(hass, config_entry.entry_id),
+            *(
+                ScrobblerMetricSensor(
+                    config[CONF_NAME], description, metrics, client, queue
+                )
+                for description in SENSORS
+            ),
+        ]
+    )
+
+
+class ScrobblerMetricSensor(SensorEntity):
+    """A metric of a scrobbler, disabled unless someone wants to look at it."""
+
+    entity_description: ScrobblerSensorEntityDescription
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(
+        self,
+        name: str,
+        description: ScrobblerSensorEntityDescription,
+        metrics: ScrobblerMetrics,
+        client: LastFMClient,
+        queue: ScrobbleQueue,
+    ) -> None:
+        """Initialize the sensor."""
+        self.entity_description = description
+        self._attr_name = f"{name} {description.name}"
+        self._attr_unique_id = f"{DOMAIN}-{name}-{description.key}"
+        self._metrics = metrics
+        # the client is shared: its metrics cover all entries with its API key
+        self._api_metrics = client.metrics
+        self._queue = queue
+
+    @property
+    def native_value(self) -> Any:
+        """Return the current value of the metric."""
+        return self.entity_description.value_fn(
+            self._metrics, self._api_metrics, self._queue
+        )
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any] | None:
+        """Return the details of the metric."""
+        if self.entity_description.attributes_fn is None:
+            return None
+        return self.entity_description.attributes_fn(
+            self._metrics, self._api_metrics, self._queue
+        )
@@ -0,0 +1,189 @@
+"""Services of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+import os
+from typing import TYPE_CHECKING
+
+import voluptuous as vol
+
+from homeassistant.const import CONF_ENTITY_ID
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.exceptions import ServiceValidationError
+import homeassistant.helpers.config_validation as cv
+from homeassistant.util import dt as dt_util
+
+from .const import DATA_HISTORY, DOMAIN
+from .history import ScrobbleHistory
+from .scrobble_queue import MAX_AGE
+
+if TYPE_CHECKING:
+    from .backfill import Backfill
+
+SERVICE_TOP_ARTISTS = "top_artists"
+SERVICE_PLAY_COUNT = "play_count"
+SERVICE_BACKFILL = "backfill"
+
+ATTR_CONFIG_ENTRY_ID = "config_entry_id"
+ATTR_PERIOD = "period"
+ATTR_LIMIT = "limit"
+ATTR_FILE = "file"
+ATTR_START = "start"
+ATTR_END = "end"
+
+PERIOD_TODAY = "today"
+PERIOD_WEEK = "week"
+PERIOD_MONTH = "month"
+PERIOD_YEAR = "year"
+PERIOD_ALL = "all"
+PERIODS = (PERIOD_TODAY, PERIOD_WEEK, PERIOD_MONTH, PERIOD_YEAR, PERIOD_ALL)
+
+HISTORY_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_CONFIG_ENTRY_ID): cv.string,
+        # the media_player the plays came from, e.g. a room
+        vol.Optional(CONF_ENTITY_ID): cv.entity_id,
+    }
+)
+TOP_ARTISTS_SCHEMA = HISTORY_SCHEMA.extend(
+    {
+        vol.Optional(ATTR_PERIOD, default=PERIOD_WEEK): vol.In(PERIODS),
+        vol.Optional(ATTR_LIMIT, default=10): vol.All(
+            int, vol.Range(min=1, max=1000)
+        ),
+    }
+)
+# the defaults match those of services.yaml
+PLAY_COUNT_SCHEMA = HISTORY_SCHEMA.extend(
+    {vol.Optional(ATTR_PERIOD, default=PERIOD_TODAY): vol.In(PERIODS)}
+)
+
+BACKFILL_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Required(ATTR_CONFIG_ENTRY_ID): cv.string,
+            # a JSON lines file of media_player states, checked once allowed...
+            vol.Exclusive(ATTR_FILE, "source"): cv.string,
+            # ...or a time range of the recorder
+            vol.Exclusive(ATTR_START, "source"): cv.datetime,
+            vol.Optional(ATTR_END): cv.datetime,
+        }
+    ),
+    cv.has_at_least_one_key(ATTR_FILE, ATTR_START),
+)
+
+
+def period_start(period: str, now: datetime) -> int:
+    """Return the UNIX timestamp a calendar period started at, in local time."""
+    if period == PERIOD_ALL:
+        return 0
+    start = dt_util.start_of_local_day(now)
+    if period == PERIOD_WEEK:
+        start -= timedelta(days=start.weekday())
+    elif period == PERIOD_MONTH:
+        start = start.replace(day=1)
+    elif period == PERIOD_YEAR:
+        start = start.replace(month=1, day=1)
+    return int(start.timestamp())
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the services of the local history."""
+
+    def _filters(call: ServiceCall) -> dict:
+        entry_id = call.data.get(ATTR_CONFIG_ENTRY_ID)
+        if entry_id is not None and (
+            (entry := hass.config_entries.async_get_entry(entry_id)) is None
+            or entry.domain != DOMAIN
+        ):
+            raise ServiceValidationError(f"{entry_id} is not a Last.fm scrobbler")
+        return {
+            "since": period_start(call.data[ATTR_PERIOD], dt_util.now()),
+            "entry_id": entry_id,
+            "player": call.data.get(CONF_ENTITY_ID),
+        }
+
+    async def async_top_artists(call: ServiceCall) -> ServiceResponse:
+        history: ScrobbleHistory = hass.data[DOMAIN][DATA_HISTORY]
+        artists = await history.async_top_artists(
+            **_filters(call), limit=call.data[ATTR_LIMIT]
+        )
+        return {
+            "artists": [{"artist": artist, "plays": plays} for artist, plays in artists]
+        }
+
+    async def async_play_count(call: ServiceCall) -> ServiceResponse:
+        history: ScrobbleHistory = hass.data[DOMAIN][DATA_HISTORY]
+        return {"plays": await history.async_play_count(**_filters(call))}
+
+    # config entry id -> the backfill running for it
+    backfills: dict[str, Backfill] = {}
+
+    async def async_backfill(call: ServiceCall) -> None:
+        # only loaded once a backfill is requested
+        from .backfill import Backfill, async_file_states, async_recorder_states
+
+        entry_id = call.data[ATTR_CONFIG_ENTRY_ID]
+        if (
+            (entry := hass.config_entries.async_get_entry(entry_id)) is None
+            or entry.domain != DOMAIN
+            or entry_id not in hass.data[DOMAIN]
+        ):
+            raise ServiceValidationError(
+                f"{entry_id} is not a loaded Last.fm scrobbler"
+            )
+        if entry_id in backfills:
+            raise ServiceValidationError(f"{entry_id} is already being backfilled")
+        backfill = Backfill(hass, entry_id)
+        end = None
+        if (path := call.data.get(ATTR_FILE)) is not None:
+            if not hass.config.is_allowed_path(path):
+                raise ServiceValidationError(f"{path} is not an allowed path")
+            if not await hass.async_add_executor_job(os.path.isfile, path):
+                raise ServiceValidationError(f"{path} is not a file")
+            states = async_file_states(hass, path)
+        else:
+            now = dt_util.utcnow()
+            # Last.fm rejects older plays anyway
+            start = max(
+                dt_util.as_utc(call.data[ATTR_START]), now - timedelta(seconds=MAX_AGE)
+            )
+            end = min(dt_util.as_utc(call.data.get(ATTR_END, now)), now)
+            if start >= end:
+                raise ServiceValidationError("Nothing to backfill in this time range")
+            states = async_recorder_states(hass, backfill.players, start, end)
+
+        async def _async_run() -> None:
+            try:
+                await backfill.async_run(states, end)
+            finally:
+                del backfills[entry_id]
+
+        backfills[entry_id] = backfill
+        hass.async_create_background_task(
+            _async_run(), f"lastfm_scrobbler backfill {entry_id}"
+        )
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_TOP_ARTISTS,
+        async_top_artists,
+        schema=TOP_ARTISTS_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_PLAY_COUNT,
+        async_play_count,
+        schema=PLAY_COUNT_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_BACKFILL, async_backfill, schema=BACKFILL_SCHEMA
+    )
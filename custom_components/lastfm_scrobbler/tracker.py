@@ -0,0 +1,91 @@
+"""Playback tracking for the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+import logging
+from typing import Any
+
+_LOGGER = logging.getLogger(__name__)
+
+# last.fm says to scrobble at 50% or after 4 minutes, whichever is sooner
+MAX_THRESHOLD = 240
+
+
+def current_position(attributes: Mapping[str, Any], now: datetime) -> float:
+    """Extrapolate the media position of a playing media_player to ``now``."""
+    position = attributes.get("media_position") or 0
+    updated_at = attributes.get("media_position_updated_at")
+    if isinstance(updated_at, (int, float)):
+        # some integrations report a UNIX timestamp instead of a datetime
+        updated_at = datetime.fromtimestamp(updated_at, timezone.utc)
+    elif isinstance(updated_at, str):
+        # recorded histories store datetimes as ISO 8601 strings
+        try:
+            updated_at = datetime.fromisoformat(updated_at)
+        except ValueError:
+            return position
+    if not isinstance(updated_at, datetime):
+        return position
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return position + max((now - updated_at).total_seconds(), 0)
+
+
+def scrobble_threshold(duration: float, percentage: float) -> float:
+    """Return after how many listened seconds a track should be scrobbled."""
+    return min(duration * percentage / 100, MAX_THRESHOLD)
+
+
+class PlaybackTracker:
+    """Time actually listened to one track, across pauses, resumes and seeks.
+
+    Only wall-clock time spent playing counts, so seeking to 90% of a track
+    doesn't bring it any closer to being scrobbled. The position reported when
+    the track is first seen is credited, as it was most likely listened to
+    before we started tracking (e.g. right after a restart).
+    """
+
+    __slots__ = ("track", "started", "_listened", "_playing_since")
+
+    def __init__(
+        self, track: tuple, position: float, now: datetime, started: int | None = None
+    ) -> None:
+        """Start tracking ``track``, seen at ``position`` seconds at ``now``."""
+        self.track = track
+        # UNIX timestamp of when the track started playing
+        self.started = (
+            started if started is not None else int(now.timestamp() - position)
+        )
+        self._listened = max(position, 0.0)
+        self._playing_since: datetime | None = None
+
+    @property
+    def playing(self) -> bool:
+        """Return whether the track is currently being listened to."""
+        return self._playing_since is not None
+
+    def update(self, playing: bool, now: datetime) -> None:
+        """Record that the track is (still) playing or paused at ``now``."""
+        if self._playing_since is not None:
+            self._listened += max((now - self._playing_since).total_seconds(), 0)
+        self._playing_since = now if playing else None
+
+    def listened(self, now: datetime) -> float:
+        """Return the number of seconds listened to the track at ``now``."""
+        if self._playing_since is None:
+            return self._listened
+        return self._listened + max((now - self._playing_since).total_seconds(), 0)
+
+    def deadline(self, threshold: float, now: datetime) -> datetime | None:
+        """Return when ``threshold`` seconds will have been listened to.
+
+        ``None`` means the track is paused and will not reach it on its own.
+        """
+        remaining = threshold - self.listened(now)
+        if remaining <= 0:
+            return now
+        if self._playing_since is None:
+            return None
+        return now + timedelta(seconds=remaining)
@@ -0,0 +1,631 @@
+"""Replay synthetic media_player timelines against the scrobbling pipeline.
+
+    python scripts/simulate.py --players 20 --entries 4 --plays 50
+
+Every config entry gets a ScrobblerEngine watching the players in its own
+priority order, all of them sharing one PlayerObserver per player as in the
+integration. State changes come from a fake state machine, scrobble
+deadlines are honoured in virtual time and every Last.fm call goes through
+the real LastFMClient to a mock Last.fm server on localhost. The results are
+compared with a reference model of what should have been scrobbled.
+
+The states are then replayed the way the backfill service rebuilds plays
+from the recorder, without media positions, and the rebuilt scrobbles are
+compared with the same reference.
+
+With ``--throttle``, the mock answers error 29 (rate limit exceeded) beyond
+Last.fm's rate limit and the clients use the real rate limiter, time running
+that many times faster for both. ``--clients per-entry`` gives every entry
+its own HTTP session and client, as before the client registry, to compare
+the sockets opened and the requests rejected.
+
+Only the parts of the integration that don't depend on Home Assistant are
+loaded, so this runs with nothing but aiohttp installed. The persistent
+queue and the check_entities gating are not part of the simulation.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import importlib
+import json
+from pathlib import Path
+import random
+import statistics
+import sys
+import time
+import types
+
+from aiohttp import web
+
+COMPONENT = (
+    Path(__file__).resolve().parents[1] / "custom_components" / "lastfm_scrobbler"
+)
+
+# import the modules without running the package __init__, which needs Home Assistant
+_package = types.ModuleType("lastfm_scrobbler")
+_package.__path__ = [str(COMPONENT)]
+sys.modules["lastfm_scrobbler"] = _package
+_import_started = time.perf_counter()
+api = importlib.import_module("lastfm_scrobbler.api")
+engine = importlib.import_module("lastfm_scrobbler.engine")
+tracker = importlib.import_module("lastfm_scrobbler.tracker")
+# milliseconds it took to import the scrobbling logic and the Last.fm client
+IMPORT_MS = (time.perf_counter() - _import_started) * 1000
+
+EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+# how often players report their position while playing
+POSITION_REFRESH = 15
+
+
+@dataclass
+class Play:
+    """One track played on one player."""
+
+    play_id: int
+    player: str
+    artist: str
+    title: str
+    album: str | None
+    duration: int | None
+    attributes: dict
+    start: float = 0.0
+
+    @property
+    def expected_artist(self) -> str:
+        """Return the artist Last.fm should receive."""
+        if (
+            self.attributes.get("mass_player_type")
+            and "/" in self.artist
+            and self.artist.lower() != "ac/dc"
+        ):
+            return self.artist.split("/")[0]
+        return self.artist
+
+
+@dataclass(order=True)
+class StateEvent:
+    """A media_player state written to the fake state machine."""
+
+    time: float
+    seq: int
+    player: str = field(compare=False)
+    state: str = field(compare=False)
+    attributes: dict = field(compare=False)
+    play: Play | None = field(compare=False)
+
+
+def build_timelines(args: argparse.Namespace, rng: random.Random) -> list[StateEvent]:
+    """Generate the state changes of all players."""
+    events: list[StateEvent] = []
+    seq = 0
+    play_id = 0
+
+    def emit(t: float, player: str, state: str, attributes: dict, play: Play | None):
+        nonlocal seq
+        seq += 1
+        events.append(StateEvent(t, seq, player, state, attributes, play))
+
+    for index in range(args.players):
+        player = f"media_player.room_{index}"
+        mass = index % 3 == 0
+        t = rng.uniform(0, 30)
+        previous_title = None
+        for number in range(args.plays):
+            play_id += 1
+            radio = mass and rng.random() < args.radio
+            title = previous_title
+            while title == previous_title:
+                title = f"Track {rng.randrange(args.library)}"
+            previous_title = title
+            artist = rng.choice(
+                ["Artist A", "Artist B", "AC/DC", "Artist C/Artist D", "Artist E"]
+            )
+            duration = None if radio else rng.randint(25, 420)
+            attributes = {
+                "media_artist": artist,
+                "media_title": title,
+                "media_album_name": "Radio Station" if radio else "Album",
+                "media_duration": 100000 if radio else duration,
+            }
+            if mass:
+                attributes["mass_player_type"] = "player"
+                attributes["media_content_id"] = (
+                    "library://radio/1" if radio else "library://track/1"
+                )
+            play = Play(play_id, player, artist, title, "Album", duration, attributes)
+            play.start = t
+            length = duration or rng.randint(120, 400)
+
+            # a play is a list of (action, seconds) steps
+            behaviour = rng.random()
+            if behaviour < args.skips:
+                steps = [("play", length * rng.uniform(0.05, 0.4))]
+            elif behaviour < args.skips + args.pauses:
+                first = length * rng.uniform(0.1, 0.5)
+                steps = [
+                    ("play", first),
+                    ("pause", rng.uniform(5, 120)),
+                    ("play", length - first),
+                ]
+            elif behaviour < args.skips + args.pauses + args.seeks:
+                steps = [("play", 10), ("seek", length * 0.9), ("play", length * 0.1)]
+            else:
+                steps = [("play", length)]
+
+            position = 0.0
+            for action, seconds in steps:
+                if action == "seek":
+                    position = seconds
+                    emit(
+                        t,
+                        player,
+                        "playing",
+                        _with_position(attributes, position, t),
+                        play,
+                    )
+                    continue
+                state = "playing" if action == "play" else "paused"
+                end = t + seconds
+                while t < end:
+                    emit(
+                        t, player, state, _with_position(attributes, position, t), play
+                    )
+                    step = min(POSITION_REFRESH, end - t)
+                    if state == "playing":
+                        position += step
+                    t += step
+            if number + 1 < args.plays and rng.random() < args.gapless:
+                # the next track starts right away, the player stays playing
+                continue
+            emit(t, player, "idle", {}, None)
+            t += rng.uniform(0, 5)
+    events.sort()
+    return events
+
+
+def _with_position(attributes: dict, position: float, t: float) -> dict:
+    """Return the attributes of a player at ``position`` seconds."""
+    return {
+        **attributes,
+        "media_position": position,
+        "media_position_updated_at": EPOCH + timedelta(seconds=t),
+    }
+
+
+class MockLastFM:
+    """Local stand-in for ws.audioscrobbler.com."""
+
+    def __init__(self, rate: float | None = None) -> None:
+        """Initialize the mock, rejecting requests beyond ``rate`` per second."""
+        self.calls: dict[str, int] = {}
+        self.scrobbles: list[dict[str, str]] = []
+        # client sockets the requests came from
+        self.peers: set[tuple] = set()
+        self.rate_limited = 0
+        self._rate = rate
+        # Last.fm averages the rate, so allow a second worth of requests at once
+        self._tokens = rate or 0.0
+        self._updated = time.monotonic()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Answer an API call."""
+        self.peers.add(request.transport.get_extra_info("peername"))
+        data = dict(await request.post())
+        method = data["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self._rate is not None:
+            now = time.monotonic()
+            self._tokens = min(
+                self._rate, self._tokens + (now - self._updated) * self._rate
+            )
+            self._updated = now
+            if self._tokens < 1:
+                self.rate_limited += 1
+                return web.json_response(
+                    {
+                        "error": api.ERROR_RATE_LIMIT_EXCEEDED,
+                        "message": "Rate Limit Exceeded",
+                    }
+                )
+            self._tokens -= 1
+        if method == "track.scrobble":
+            self.scrobbles.append(data)
+        return web.json_response({"scrobbles": {"@attr": {"accepted": 1}}})
+
+
+@dataclass
+class Entry:
+    """A simulated config entry."""
+
+    session_key: str
+    players: list[str]
+    engine: object
+    client: object = None
+    deadline: float | None = None
+    crossed_at: dict[int, float] = field(default_factory=dict)
+    emitted_at: dict[int, float] = field(default_factory=dict)
+    selected: list[tuple[Play, float]] = field(default_factory=list)
+
+
+async def simulate(args: argparse.Namespace) -> dict:
+    """Run the simulation and return the measurements."""
+    rng = random.Random(args.seed)
+    events = build_timelines(args, rng)
+    players = [f"media_player.room_{index}" for index in range(args.players)]
+
+    # Last.fm allows 5 requests per second per originating IP
+    mock = MockLastFM(5 * args.throttle if args.throttle else None)
+    app = web.Application()
+    app.router.add_post("/2.0/", mock.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    entries = []
+    for index in range(args.entries):
+        watched = players[:]
+        rng.shuffle(watched)
+        entries.append(
+            Entry(
+                f"session-{index}",
+                watched[: args.players_per_entry or None],
+                engine.ScrobblerEngine(
+                    args.percentage,
+                    True,
+                    concurrent=args.concurrent,
+                    streams=args.streams,
+                ),
+            )
+        )
+    watchers: dict[str, list[Entry]] = {player: [] for player in players}
+    for entry in entries:
+        for player in entry.players:
+            watchers[player].append(entry)
+
+    states: dict[str, tuple[str, dict, Play | None]] = {}
+    observers = {player: engine.PlayerObserver(player) for player in players}
+    clock = PlayClock()
+    eval_times: list[int] = []
+    observe_times: list[int] = []
+    api_times: list[float] = []
+    plays_seen: set[int] = set()
+    api_errors: dict[int, int] = {}
+
+    import aiohttp
+
+    api_url = f"http://127.0.0.1:{port}/2.0/"
+    if args.throttle:
+        api.RATE_LIMIT_PAUSE /= args.throttle
+
+    def rate_limiter() -> api.RateLimiter:
+        if args.throttle:
+            return api.RateLimiter(rate=api.DEFAULT_RATE * args.throttle)
+        return api.RateLimiter(rate=1e9, burst=1e9)
+
+    sessions = [aiohttp.ClientSession()]
+    if args.clients == "shared":
+        registry = api.ClientRegistry(sessions[0], rate_limiter(), api_url=api_url)
+    for entry in entries:
+        if args.clients == "shared":
+            entry.client = registry.acquire("api-key", "api-secret")
+        else:
+            sessions.append(aiohttp.ClientSession())
+            entry.client = api.LastFMClient(
+                sessions[-1],
+                "api-key",
+                "api-secret",
+                api_url=api_url,
+                rate_limiter=rate_limiter(),
+            )
+
+    async def request(call) -> None:
+        begin = time.perf_counter()
+        try:
+            await call
+        except api.LastFMApiError as ex:
+            api_errors[ex.code] = api_errors.get(ex.code, 0) + 1
+        api_times.append(time.perf_counter() - begin)
+
+    async def evaluate(entry: Entry, t: float) -> None:
+        now = EPOCH + timedelta(seconds=t)
+        _reference(entry, states, clock, t, args)
+        begin = time.perf_counter_ns()
+        decision = entry.engine.evaluate(
+            (observers[player] for player in entry.players), now
+        )
+        eval_times.append(time.perf_counter_ns() - begin)
+        entry.deadline = None
+        if decision.update_now_playing:
+            await request(
+                entry.client.async_update_now_playing(
+                    entry.session_key,
+                    decision.track.artist,
+                    decision.track.title,
+                    decision.track.album,
+                    decision.track.duration,
+                )
+            )
+        if decision.scrobbles:
+            for player in decision.scrobbles:
+                if (play := states[player][2]) is not None:
+                    entry.emitted_at.setdefault(play.play_id, t)
+            await request(
+                entry.client.async_scrobble_batch(
+                    entry.session_key, list(decision.scrobbles.values())
+                )
+            )
+        if decision.deadlines:
+            entry.deadline = (min(decision.deadlines.values()) - EPOCH).total_seconds()
+
+    try:
+        for event in events:
+            # fire the timers that expire before this state change
+            while True:
+                due = [
+                    e
+                    for e in entries
+                    if e.deadline is not None and e.deadline <= event.time
+                ]
+                if not due:
+                    break
+                first = min(due, key=lambda e: e.deadline)
+                await evaluate(first, first.deadline)
+            if event.play is not None:
+                plays_seen.add(event.play.play_id)
+            states[event.player] = (event.state, event.attributes, event.play)
+            clock.update(event.player, event.state, event.play, event.time)
+            begin = time.perf_counter_ns()
+            observers[event.player].update(
+                event.state, event.attributes, EPOCH + timedelta(seconds=event.time)
+            )
+            observe_times.append(time.perf_counter_ns() - begin)
+            for entry in watchers[event.player]:
+                await evaluate(entry, event.time)
+    finally:
+        for session in sessions:
+            await session.close()
+
+    await runner.cleanup()
+    report = _report(
+        args, entries, events, mock, eval_times, observe_times, api_times, plays_seen
+    )
+    report["api_errors"] = api_errors
+    report.update(_backfill(args, entries, events))
+    return report
+
+
+def _backfill(
+    args: argparse.Namespace, entries: list[Entry], events: list[StateEvent]
+) -> dict:
+    """Rebuild the plays from the states as recorded and compare them."""
+    plays = {event.play.play_id: event.play for event in events if event.play}
+    missed = unexpected = 0
+    for entry in entries:
+        expected = {
+            (
+                plays[play_id].player,
+                plays[play_id].title,
+                int((EPOCH + timedelta(seconds=plays[play_id].start)).timestamp()),
+            )
+            for play_id in entry.crossed_at
+        }
+        rebuilder = engine.PlayRebuilder(
+            engine.ScrobblerEngine(
+                args.percentage,
+                False,
+                concurrent=args.concurrent,
+                streams=args.streams,
+            ),
+            entry.players,
+        )
+        rebuilt = set()
+        for event in events:
+            # the recorder doesn't store the media position of media players
+            attributes = {
+                key: value
+                for key, value in event.attributes.items()
+                if key not in engine.POSITION_ATTRIBUTES
+            }
+            for player, scrobble in rebuilder.feed(
+                event.player,
+                event.state,
+                attributes,
+                EPOCH + timedelta(seconds=event.time),
+            ):
+                rebuilt.add((player, scrobble["track"], scrobble["timestamp"]))
+        missed += len(expected - rebuilt)
+        unexpected += len(rebuilt - expected)
+    return {"backfill_missed": missed, "backfill_unexpected": unexpected}
+
+
+class PlayClock:
+    """Time each play has actually been playing, the ground truth."""
+
+    def __init__(self) -> None:
+        """Initialize the clock."""
+        self._played: dict[int, float] = {}
+        self._running: dict[str, tuple[Play, float]] = {}
+
+    def update(self, player: str, state: str, play: Play | None, t: float) -> None:
+        """Record a state change of ``player`` at ``t``."""
+        if (running := self._running.pop(player, None)) is not None:
+            previous, since = running
+            self._played[previous.play_id] = self.played(previous, since) + t - since
+        if state == "playing" and play is not None:
+            self._running[player] = (play, t)
+
+    def played(self, play: Play, t: float) -> float:
+        """Return how long ``play`` has been playing at ``t``."""
+        played = self._played.get(play.play_id, 0.0)
+        if (running := self._running.get(play.player)) is not None:
+            if running[0] is play:
+                played += t - running[1]
+        return played
+
+
+def _reference(
+    entry: Entry,
+    states: dict,
+    clock: PlayClock,
+    t: float,
+    args: argparse.Namespace,
+) -> None:
+    """Record when the selected plays of an entry crossed their threshold.
+
+    A play should be scrobbled once it played for the threshold while being
+    the highest priority playing player of the entry, or while playing at all
+    when every player is scrobbled.
+    """
+    for play, since in entry.selected:
+        _cross(entry, play, clock, since, t, args)
+    entry.selected = []
+    for player in entry.players:
+        state, _, play = states.get(player, ("off", {}, None))
+        if state == "playing" and play is not None:
+            entry.selected.append((play, t))
+            _cross(entry, play, clock, t, t, args)
+            if not args.concurrent:
+                return
+
+
+def _cross(
+    entry: Entry,
+    play: Play,
+    clock: PlayClock,
+    since: float,
+    t: float,
+    args: argparse.Namespace,
+) -> None:
+    """Record the threshold crossing of a play selected from ``since`` to ``t``."""
+    if play.play_id in entry.crossed_at:
+        return
+    if play.duration:
+        threshold = tracker.scrobble_threshold(play.duration, args.percentage)
+    elif args.streams:
+        # radio songs are scrobbled after 4 minutes without a known duration
+        threshold = tracker.MAX_THRESHOLD
+    else:
+        return
+    if (played := clock.played(play, t)) >= threshold:
+        entry.crossed_at[play.play_id] = max(since, t - (played - threshold))
+
+
+def _report(
+    args, entries, events, mock, eval_times, observe_times, api_times, plays_seen
+) -> dict:
+    """Compare what was scrobbled with the reference model."""
+    expected = sum(len(entry.crossed_at) for entry in entries)
+    emitted = sum(len(entry.emitted_at) for entry in entries)
+    missed = sum(
+        len(entry.crossed_at.keys() - entry.emitted_at.keys()) for entry in entries
+    )
+    unexpected = sum(
+        len(entry.emitted_at.keys() - entry.crossed_at.keys()) for entry in entries
+    )
+    latencies = [
+        entry.emitted_at[play_id] - crossed
+        for entry in entries
+        for play_id, crossed in entry.crossed_at.items()
+        if play_id in entry.emitted_at
+    ]
+    submitted = {}
+    for scrobble in mock.scrobbles:
+        index = 0
+        while f"artist[{index}]" in scrobble:
+            key = (
+                scrobble["sk"],
+                scrobble[f"artist[{index}]"],
+                scrobble[f"track[{index}]"],
+                scrobble[f"timestamp[{index}]"],
+            )
+            submitted[key] = submitted.get(key, 0) + 1
+            index += 1
+    eval_us = sorted(ns / 1000 for ns in eval_times)
+    tracks = len(plays_seen) * len(entries) or 1
+    return {
+        "players": args.players,
+        "entries": len(entries),
+        "state_changes": len(events),
+        "import_ms": round(IMPORT_MS, 1),
+        "observe_us_mean": (
+            round(statistics.fmean(observe_times) / 1000, 2) if observe_times else 0
+        ),
+        "evaluations": len(eval_times),
+        "eval_us_mean": round(statistics.fmean(eval_us), 2) if eval_us else 0,
+        "eval_us_p95": round(eval_us[int(len(eval_us) * 0.95)], 2) if eval_us else 0,
+        "eval_us_max": round(eval_us[-1], 2) if eval_us else 0,
+        "api_calls": dict(mock.calls),
+        "api_calls_per_track": round(sum(mock.calls.values()) / tracks, 3),
+        "api_ms_mean": round(statistics.fmean(api_times) * 1000, 3) if api_times else 0,
+        "sockets": len(mock.peers),
+        "rate_limited": mock.rate_limited,
+        "expected_scrobbles": expected,
+        "scrobbles": emitted,
+        "missed": missed,
+        "unexpected": unexpected,
+        "duplicates": sum(count - 1 for count in submitted.values()),
+        "latency_s_mean": round(statistics.fmean(latencies), 3) if latencies else 0,
+        "latency_s_max": round(max(latencies), 3) if latencies else 0,
+    }
+
+
+def main() -> None:
+    """Parse the arguments and print the report."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--entries", type=int, default=3)
+    parser.add_argument(
+        "--players-per-entry", type=int, default=0, help="0 watches all players"
+    )
+    parser.add_argument("--plays", type=int, default=30, help="plays per player")
+    parser.add_argument("--library", type=int, default=500, help="distinct tracks")
+    parser.add_argument("--percentage", type=int, default=50)
+    parser.add_argument("--skips", type=float, default=0.2)
+    parser.add_argument("--pauses", type=float, default=0.15)
+    parser.add_argument("--seeks", type=float, default=0.1)
+    parser.add_argument("--radio", type=float, default=0.2, help="on MASS players")
+    parser.add_argument(
+        "--gapless",
+        type=float,
+        default=0.3,
+        help="share of tracks followed by the next one without stopping",
+    )
+    parser.add_argument(
+        "--concurrent", action="store_true", help="scrobble every playing player"
+    )
+    parser.add_argument(
+        "--streams", action="store_true", help="scrobble the songs of radio streams"
+    )
+    parser.add_argument(
+        "--clients",
+        choices=["shared", "per-entry"],
+        default="shared",
+        help="one client for all entries, or a client and HTTP session per entry",
+    )
+    parser.add_argument(
+        "--throttle",
+        type=float,
+        default=0,
+        help="enforce Last.fm's rate limit, time running this many times faster",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(simulate(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    width = max(len(key) for key in report)
+    for key, value in report.items():
+        print(f"{key:<{width}}  {value}")
+
+
+if __name__ == "__main__":
+    main()
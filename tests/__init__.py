@@ -0,0 +1 @@
+"""Tests for the lastfm_scrobbler integration."""
@@ -0,0 +1,127 @@
+"""Fixtures for the lastfm_scrobbler tests."""
+
+from __future__ import annotations
+
+from typing import Any
+
+import aiohttp
+import pytest
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from pytest_homeassistant_custom_component.test_util.aiohttp import (
+    AiohttpClientMocker,
+    AiohttpClientMockResponse,
+)
+
+from custom_components.lastfm_scrobbler.api import (
+    API_URL,
+    ERROR_INVALID_API_KEY,
+    ERROR_INVALID_SESSION_KEY,
+    ERROR_INVALID_SIGNATURE,
+    ERROR_UNAUTHORIZED_TOKEN,
+    LastFMClient,
+    sign,
+)
+
+API_KEY = "0123456789abcdef0123456789abcdef"
+API_SECRET = "fedcba9876543210fedcba9876543210"
+SESSION_KEY = "session-key"
+TOKEN = "token"
+USERNAME = "listener"
+
+
+class FakeLastFM:
+    """A local Last.fm endpoint knowing one account."""
+
+    def __init__(self) -> None:
+        """Initialize the endpoint."""
+        self.sessions = {SESSION_KEY: USERNAME}
+        self.authorized_tokens: set[str] = set()
+        self.offline = False
+        self.methods: list[str] = []
+        # codes of the errors the next requests fail with
+        self.errors: list[int] = []
+        # titles track.scrobble ignores, as it does for e.g. a timestamp too old
+        self.ignored_titles: set[str] = set()
+        # the scrobbles of each accepted track.scrobble request
+        self.scrobbles: list[list[dict[str, str]]] = []
+
+    async def handle(
+        self, method: str, url: Any, data: dict[str, str]
+    ) -> AiohttpClientMockResponse:
+        """Answer a request the way Last.fm would."""
+        if self.offline:
+            raise aiohttp.ClientConnectionError("Last.fm is offline")
+        self.methods.append(data["method"])
+        return AiohttpClientMockResponse(method, url, json=self._respond(data))
+
+    def _respond(self, data: dict[str, str]) -> dict[str, Any]:
+        """Return the payload of a request."""
+        if data["api_key"] != API_KEY:
+            return {"error": ERROR_INVALID_API_KEY, "message": "Invalid API key"}
+        signed = {key: value for key, value in data.items() if key != "api_sig"}
+        if "api_sig" in data and data["api_sig"] != sign(signed, API_SECRET):
+            return {"error": ERROR_INVALID_SIGNATURE, "message": "Invalid signature"}
+        if "sk" in data and data["sk"] not in self.sessions:
+            return {"error": ERROR_INVALID_SESSION_KEY, "message": "Invalid session"}
+        if self.errors:
+            return {"error": self.errors.pop(0), "message": "Failed"}
+        method = data["method"]
+        if method == "auth.getToken":
+            return {"token": TOKEN}
+        if method == "auth.getSession":
+            if data["token"] not in self.authorized_tokens:
+                return {"error": ERROR_UNAUTHORIZED_TOKEN, "message": "Unauthorized"}
+            return {"session": {"name": USERNAME, "key": SESSION_KEY}}
+        if method == "user.getInfo":
+            return {"user": {"name": self.sessions[data["sk"]]}}
+        if method == "track.scrobble":
+            return self._scrobble(data)
+        raise AssertionError(f"Unexpected method {method}")
+
+    def _scrobble(self, data: dict[str, str]) -> dict[str, Any]:
+        """Accept a batch of scrobbles, except those of ignored titles."""
+        batch = []
+        index = 0
+        while f"artist[{index}]" in data:
+            batch.append(
+                {
+                    key: data[f"{key}[{index}]"]
+                    for key in ("artist", "track", "timestamp")
+                }
+            )
+            index += 1
+        self.scrobbles.append(batch)
+        results = [
+            {
+                "track": {"#text": scrobble["track"]},
+                "ignoredMessage": (
+                    {"code": "1", "#text": "Track ignored"}
+                    if scrobble["track"] in self.ignored_titles
+                    else {"code": "0", "#text": ""}
+                ),
+            }
+            for scrobble in batch
+        ]
+        return {"scrobbles": {"scrobble": results}}
+
+
+@pytest.fixture(autouse=True)
+def auto_enable_custom_integrations(enable_custom_integrations):
+    """Enable the integration in every test."""
+    yield
+
+
+@pytest.fixture
+def lastfm(aioclient_mock: AiohttpClientMocker) -> FakeLastFM:
+    """Route the requests to Last.fm to a fake endpoint."""
+    fake = FakeLastFM()
+    aioclient_mock.post(API_URL, side_effect=fake.handle)
+    return fake
+
+
+@pytest.fixture
+def client(hass: HomeAssistant, lastfm: FakeLastFM) -> LastFMClient:
+    """Return a client talking to the fake endpoint."""
+    return LastFMClient(async_get_clientsession(hass), API_KEY, API_SECRET)
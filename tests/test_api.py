@@ -0,0 +1,179 @@
+"""Test the Last.fm client of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from custom_components.lastfm_scrobbler import api
+from custom_components.lastfm_scrobbler.api import (
+    BREAKER_MAX_BACKOFF,
+    BREAKER_MIN_BACKOFF,
+    BREAKER_THRESHOLD,
+    ERROR_INVALID_PARAMETERS,
+    ERROR_INVALID_SESSION_KEY,
+    ERROR_RATE_LIMIT_EXCEEDED,
+    ERROR_SERVICE_OFFLINE,
+    CircuitBreaker,
+    LastFMApiError,
+    LastFMCircuitOpenError,
+    LastFMClient,
+    LastFMConnectionError,
+)
+
+from .conftest import SESSION_KEY, USERNAME, FakeLastFM
+
+
+class _Clock:
+    """A monotonic clock moved by hand."""
+
+    def __init__(self) -> None:
+        """Start the clock."""
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        """Return the current time."""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> _Clock:
+    """Let the tests move the clock of the circuit breakers."""
+    clock = _Clock()
+    monkeypatch.setattr(api, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def _fail(breaker: CircuitBreaker, times: int = BREAKER_THRESHOLD) -> None:
+    """Record failed requests Last.fm may accept later."""
+    for _ in range(times):
+        breaker.record_failure(LastFMConnectionError("Last.fm is offline"))
+
+
+def test_breaker_opens_after_failures(clock: _Clock) -> None:
+    """Test requests are held back once enough of them failed in a row."""
+    breaker = CircuitBreaker()
+    _fail(breaker, BREAKER_THRESHOLD - 1)
+
+    assert breaker.state == "closed"
+    assert breaker.before_request() is False
+
+    _fail(breaker, 1)
+
+    assert breaker.state == "open"
+    with pytest.raises(LastFMCircuitOpenError) as exc_info:
+        breaker.before_request()
+    assert exc_info.value.retry_in == BREAKER_MIN_BACKOFF
+
+
+def test_breaker_probes_once_open(clock: _Clock) -> None:
+    """Test a single request probes Last.fm once the backoff expired."""
+    breaker = CircuitBreaker()
+    _fail(breaker)
+    clock.now += BREAKER_MIN_BACKOFF
+
+    assert breaker.state == "half_open"
+    assert breaker.before_request() is True
+    # only the probe gets through
+    with pytest.raises(LastFMCircuitOpenError):
+        breaker.before_request()
+
+    # a failed probe doubles the backoff
+    _fail(breaker, 1)
+    breaker.probing = False
+
+    assert breaker.state == "open"
+    assert breaker.backoff == 2 * BREAKER_MIN_BACKOFF
+
+    clock.now += 2 * BREAKER_MIN_BACKOFF
+    assert breaker.before_request() is True
+    breaker.record_success()
+    breaker.probing = False
+
+    assert breaker.state == "closed"
+    assert breaker.before_request() is False
+
+
+def test_breaker_holds_rejected_credentials_back(clock: _Clock) -> None:
+    """Test rejected credentials open the circuit at once, for the longest."""
+    breaker = CircuitBreaker()
+    breaker.record_failure(LastFMApiError(ERROR_INVALID_SESSION_KEY, "Invalid"))
+
+    assert breaker.backoff == BREAKER_MAX_BACKOFF
+    with pytest.raises(LastFMApiError) as exc_info:
+        breaker.before_request()
+    assert exc_info.value.auth
+
+
+@pytest.mark.parametrize("code", [ERROR_INVALID_PARAMETERS, ERROR_RATE_LIMIT_EXCEEDED])
+def test_breaker_ignores_errors_about_one_request(clock: _Clock, code: int) -> None:
+    """Test errors that don't tell Last.fm is failing keep the circuit closed."""
+    breaker = CircuitBreaker()
+    for _ in range(BREAKER_THRESHOLD):
+        breaker.record_failure(LastFMApiError(code, "Failed"))
+
+    assert breaker.state == "closed"
+
+
+def test_error_classification() -> None:
+    """Test which Last.fm errors are worth retrying."""
+    assert LastFMConnectionError("Timeout").retryable
+    assert LastFMApiError(ERROR_SERVICE_OFFLINE, "Offline").retryable
+    assert not LastFMApiError(ERROR_INVALID_PARAMETERS, "Invalid").retryable
+    assert LastFMApiError(ERROR_INVALID_SESSION_KEY, "Invalid").auth
+
+
+async def test_rejected_request_keeps_the_probe(clock: _Clock) -> None:
+    """Test a request held back during a probe doesn't let another probe through."""
+    released = asyncio.Event()
+
+    class _SlowClient(LastFMClient):
+        async def _async_post(
+            self, method: str, data: dict[str, str]
+        ) -> dict[str, Any]:
+            await released.wait()
+            return {}
+
+    client = _SlowClient(None, "key", "secret")
+    breaker = client.breaker(SESSION_KEY)
+    _fail(breaker)
+    clock.now += BREAKER_MIN_BACKOFF
+    probe = asyncio.ensure_future(
+        client.async_request("user.getInfo", session_key=SESSION_KEY)
+    )
+    await asyncio.sleep(0)
+
+    with pytest.raises(LastFMCircuitOpenError):
+        await client.async_request("user.getInfo", session_key=SESSION_KEY)
+
+    assert breaker.probing
+    assert client.metrics.rejected == 1
+
+    released.set()
+    await probe
+
+    assert not breaker.probing
+    assert breaker.state == "closed"
+
+
+async def test_client_stops_calling_a_failing_last_fm(
+    lastfm: FakeLastFM, client: LastFMClient
+) -> None:
+    """Test the client holds requests back while Last.fm fails."""
+    lastfm.errors.extend([ERROR_SERVICE_OFFLINE] * BREAKER_THRESHOLD)
+    for _ in range(BREAKER_THRESHOLD):
+        with pytest.raises(LastFMApiError):
+            await client.async_get_username(SESSION_KEY)
+
+    with pytest.raises(LastFMCircuitOpenError):
+        await client.async_get_username(SESSION_KEY)
+
+    assert len(lastfm.methods) == BREAKER_THRESHOLD
+    assert client.metrics.rejected == 1
+
+    client.forget(SESSION_KEY)
+
+    assert await client.async_get_username(SESSION_KEY) == USERNAME
@@ -0,0 +1,193 @@
+"""Test the config flow of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+
+from homeassistant import config_entries
+from homeassistant.const import CONF_API_KEY, CONF_ENTITY_ID, CONF_NAME
+from homeassistant.core import HomeAssistant
+from homeassistant.data_entry_flow import FlowResultType
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.lastfm_scrobbler.config_flow import (
+    InvalidAuth,
+    validate_credentials,
+)
+from custom_components.lastfm_scrobbler.const import (
+    CONF_API_SECRET,
+    CONF_POLICIES,
+    CONF_SESSION_KEY,
+    DOMAIN,
+)
+
+from .conftest import API_KEY, API_SECRET, SESSION_KEY, TOKEN, USERNAME, FakeLastFM
+
+USER_INPUT = {
+    CONF_NAME: "Living room",
+    CONF_API_KEY: API_KEY,
+    CONF_API_SECRET: API_SECRET,
+    CONF_SESSION_KEY: SESSION_KEY,
+    CONF_ENTITY_ID: ["media_player.living_room"],
+}
+
+
+@pytest.fixture(autouse=True)
+def mock_setup():
+    """Keep created entries from being set up."""
+    with (
+        patch("custom_components.lastfm_scrobbler.async_setup", return_value=True),
+        patch(
+            "custom_components.lastfm_scrobbler.async_setup_entry", return_value=True
+        ),
+    ):
+        yield
+
+
+async def _async_submit(hass: HomeAssistant, user_input: dict[str, Any]):
+    """Start a config flow and submit the credentials form."""
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN, context={"source": config_entries.SOURCE_USER}
+    )
+    assert result["type"] is FlowResultType.FORM
+    assert result["step_id"] == "user"
+    return await hass.config_entries.flow.async_configure(result["flow_id"], user_input)
+
+
+async def test_user_flow(hass: HomeAssistant, lastfm: FakeLastFM) -> None:
+    """Test creating an entry with valid credentials."""
+    result = await _async_submit(hass, USER_INPUT)
+
+    assert result["type"] is FlowResultType.CREATE_ENTRY
+    assert result["title"] == "Living room"
+    assert result["data"][CONF_SESSION_KEY] == SESSION_KEY
+    assert lastfm.methods == ["user.getInfo"]
+
+
+@pytest.mark.parametrize(
+    "user_input",
+    [
+        {**USER_INPUT, CONF_API_KEY: "wrong"},
+        {**USER_INPUT, CONF_API_SECRET: "wrong"},
+        {**USER_INPUT, CONF_SESSION_KEY: "wrong"},
+    ],
+)
+async def test_user_flow_invalid_auth(
+    hass: HomeAssistant, lastfm: FakeLastFM, user_input: dict[str, Any]
+) -> None:
+    """Test rejected credentials are reported on the form."""
+    result = await _async_submit(hass, user_input)
+
+    assert result["type"] is FlowResultType.FORM
+    assert result["errors"] == {"base": "invalid_auth"}
+
+
+async def test_user_flow_cannot_connect(
+    hass: HomeAssistant, lastfm: FakeLastFM
+) -> None:
+    """Test an unreachable Last.fm is reported on the form."""
+    lastfm.offline = True
+
+    result = await _async_submit(hass, USER_INPUT)
+
+    assert result["type"] is FlowResultType.FORM
+    assert result["errors"] == {"base": "cannot_connect"}
+
+
+async def test_user_flow_invalid_policies(
+    hass: HomeAssistant, lastfm: FakeLastFM
+) -> None:
+    """Test the reason a policy is invalid is shown on the form."""
+    result = await _async_submit(
+        hass, {**USER_INPUT, CONF_POLICIES: {"podcast": {"min_duration": -1}}}
+    )
+
+    assert result["type"] is FlowResultType.FORM
+    assert result["errors"] == {CONF_POLICIES: "invalid_policies"}
+    assert "invalid min_duration -1" in result["description_placeholders"]["error"]
+    assert lastfm.methods == []
+
+
+async def test_user_flow_authorize(hass: HomeAssistant, lastfm: FakeLastFM) -> None:
+    """Test obtaining a session key through the desktop auth flow."""
+    result = await _async_submit(
+        hass,
+        {key: value for key, value in USER_INPUT.items() if key != CONF_SESSION_KEY},
+    )
+
+    assert result["type"] is FlowResultType.FORM
+    assert result["step_id"] == "authorize"
+    assert f"token={TOKEN}" in result["description_placeholders"]["url"]
+
+    # access has not been granted yet
+    result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+
+    assert result["type"] is FlowResultType.FORM
+    assert result["errors"] == {"base": "token_not_authorized"}
+
+    lastfm.authorized_tokens.add(TOKEN)
+    result = await hass.config_entries.flow.async_configure(result["flow_id"], {})
+
+    assert result["type"] is FlowResultType.CREATE_ENTRY
+    assert result["data"][CONF_SESSION_KEY] == SESSION_KEY
+    assert lastfm.methods == ["auth.getToken", "auth.getSession", "auth.getSession"]
+
+
+async def test_reauth_flow(hass: HomeAssistant, lastfm: FakeLastFM) -> None:
+    """Test new credentials replace the rejected ones of an entry."""
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        title="Living room",
+        data={**USER_INPUT, CONF_SESSION_KEY: "revoked"},
+    )
+    entry.add_to_hass(hass)
+
+    result = await entry.start_reauth_flow(hass)
+
+    assert result["type"] is FlowResultType.FORM
+    assert result["step_id"] == "reauth_confirm"
+
+    result = await hass.config_entries.flow.async_configure(
+        result["flow_id"],
+        {
+            CONF_API_KEY: API_KEY,
+            CONF_API_SECRET: API_SECRET,
+            CONF_SESSION_KEY: SESSION_KEY,
+        },
+    )
+
+    assert result["type"] is FlowResultType.ABORT
+    assert result["reason"] == "reauth_successful"
+    assert entry.data[CONF_SESSION_KEY] == SESSION_KEY
+
+
+async def test_valid_credentials_are_cached(
+    hass: HomeAssistant, lastfm: FakeLastFM
+) -> None:
+    """Test valid credentials are checked against Last.fm only once."""
+    for _ in range(2):
+        assert (
+            await validate_credentials(hass, API_KEY, API_SECRET, SESSION_KEY)
+            == USERNAME
+        )
+
+    assert lastfm.methods == ["user.getInfo"]
+
+
+async def test_rejected_credentials_are_not_cached(
+    hass: HomeAssistant, lastfm: FakeLastFM
+) -> None:
+    """Test credentials are checked again once they were rejected."""
+    lastfm.sessions.clear()
+    with pytest.raises(InvalidAuth):
+        await validate_credentials(hass, API_KEY, API_SECRET, SESSION_KEY)
+
+    lastfm.sessions[SESSION_KEY] = USERNAME
+
+    assert (
+        await validate_credentials(hass, API_KEY, API_SECRET, SESSION_KEY) == USERNAME
+    )
+    assert lastfm.methods == ["user.getInfo", "user.getInfo"]
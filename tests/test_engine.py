@@ -0,0 +1,182 @@
+"""Test the scrobbling decisions of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from custom_components.lastfm_scrobbler.engine import PlayerObserver, ScrobblerEngine
+
+NOW = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def _attributes(
+    title: str = "Song", artist: str = "Artist", duration: int | None = 200, **extra
+) -> dict[str, Any]:
+    """Return the attributes of a media player playing a track from its start."""
+    return {
+        "media_artist": artist,
+        "media_title": title,
+        "media_album_name": "Album",
+        "media_duration": duration,
+        "media_content_id": f"library://track/{title}",
+        "media_position": 0,
+        "media_position_updated_at": NOW,
+        **extra,
+    }
+
+
+def _observer(
+    entity_id: str, state: str = "playing", **attributes: Any
+) -> PlayerObserver:
+    """Return the observer of a media player seen at ``NOW``."""
+    observer = PlayerObserver(entity_id)
+    observer.update(state, _attributes(**attributes), NOW)
+    return observer
+
+
+def test_deadline_at_threshold() -> None:
+    """Test the engine wakes up when the track crosses its threshold."""
+    engine = ScrobblerEngine(50, False)
+    player = _observer("media_player.kitchen")
+
+    decision = engine.evaluate([player], NOW)
+
+    assert decision.player == "media_player.kitchen"
+    assert decision.track.title == "Song"
+    assert decision.deadlines == {"media_player.kitchen": NOW + timedelta(seconds=100)}
+    assert decision.scrobbles == {}
+
+
+def test_scrobble_once_threshold_crossed() -> None:
+    """Test a play is scrobbled once its threshold is crossed, and only once."""
+    engine = ScrobblerEngine(50, False)
+    player = _observer("media_player.kitchen")
+
+    decision = engine.evaluate([player], NOW + timedelta(seconds=100))
+
+    assert decision.deadlines == {}
+    assert decision.scrobbles == {
+        "media_player.kitchen": {
+            "artist": "Artist",
+            "track": "Song",
+            "album": "Album",
+            "duration": 200,
+            "timestamp": int(NOW.timestamp()),
+        }
+    }
+    assert engine.evaluate([player], NOW + timedelta(seconds=150)).scrobbles == {}
+
+
+def test_highest_priority_player() -> None:
+    """Test only the first playing player of the list is scrobbled."""
+    engine = ScrobblerEngine(50, False)
+    players = [
+        _observer("media_player.kitchen", state="paused"),
+        _observer("media_player.living_room", title="First"),
+        _observer("media_player.bedroom", title="Second"),
+    ]
+
+    decision = engine.evaluate(players, NOW)
+
+    assert decision.player == "media_player.living_room"
+    assert list(decision.deadlines) == ["media_player.living_room"]
+
+
+def test_player_without_metadata_is_passed_over() -> None:
+    """Test a player playing without artist or title doesn't block the others."""
+    engine = ScrobblerEngine(50, False)
+    players = [
+        _observer("media_player.kitchen", title=None),
+        _observer("media_player.living_room"),
+    ]
+
+    assert engine.evaluate(players, NOW).player == "media_player.living_room"
+
+
+def test_concurrent_players() -> None:
+    """Test every playing player is scrobbled with ``concurrent`` set."""
+    engine = ScrobblerEngine(50, False, concurrent=True)
+    players = [
+        _observer("media_player.living_room", title="First"),
+        _observer("media_player.bedroom", title="Second"),
+    ]
+
+    decision = engine.evaluate(players, NOW + timedelta(seconds=100))
+
+    assert decision.player == "media_player.living_room"
+    assert {player: play["track"] for player, play in decision.scrobbles.items()} == {
+        "media_player.living_room": "First",
+        "media_player.bedroom": "Second",
+    }
+
+
+def test_concurrent_grouped_players_scrobble_once() -> None:
+    """Test grouped players playing the same track in sync scrobble it once."""
+    engine = ScrobblerEngine(50, False, concurrent=True)
+    players = [_observer("media_player.living_room"), _observer("media_player.bedroom")]
+
+    decision = engine.evaluate(players, NOW + timedelta(seconds=100))
+
+    assert list(decision.scrobbles) == ["media_player.living_room"]
+
+
+def test_play_scrobbled_once_when_priority_returns() -> None:
+    """Test a play isn't scrobbled again after another player took over."""
+    engine = ScrobblerEngine(50, False)
+    kitchen = _observer("media_player.kitchen")
+    bedroom = _observer("media_player.bedroom", title="Other")
+    later = NOW + timedelta(seconds=100)
+    assert engine.evaluate([kitchen, bedroom], later).scrobbles
+
+    kitchen.update("paused", kitchen.attributes, later)
+    assert engine.evaluate([kitchen, bedroom], later).player == "media_player.bedroom"
+    kitchen.update("playing", kitchen.attributes, later)
+
+    assert engine.evaluate([kitchen, bedroom], later).scrobbles == {}
+
+
+def test_now_playing_sent_once_per_track() -> None:
+    """Test a track is sent as now playing when it is first selected."""
+    engine = ScrobblerEngine(50, True)
+    player = _observer("media_player.kitchen")
+
+    assert engine.evaluate([player], NOW).update_now_playing
+    assert not engine.evaluate([player], NOW + timedelta(seconds=10)).update_now_playing
+
+    player.update("playing", _attributes(title="Next"), NOW + timedelta(seconds=20))
+    assert engine.evaluate([player], NOW + timedelta(seconds=20)).update_now_playing
+
+
+def test_unknown_duration_is_not_scrobbled() -> None:
+    """Test a track without duration is shown but not scrobbled."""
+    engine = ScrobblerEngine(50, False)
+    player = _observer("media_player.kitchen", duration=None)
+
+    decision = engine.evaluate([player], NOW + timedelta(hours=1))
+
+    assert decision.track.title == "Song"
+    assert decision.deadlines == {}
+    assert decision.scrobbles == {}
+
+
+def test_stream_song_timed_by_looked_up_duration() -> None:
+    """Test the songs of a stream are timed from their own start."""
+    engine = ScrobblerEngine(50, False, streams=True, durations=lambda track: 60)
+    player = _observer("media_player.kitchen", duration=None)
+
+    decision = engine.evaluate([player], NOW)
+
+    assert decision.deadlines == {"media_player.kitchen": NOW + timedelta(seconds=30)}
+
+
+def test_restored_session_keeps_its_start() -> None:
+    """Test a play running before a restart keeps the time it started at."""
+    engine = ScrobblerEngine(50, False)
+    player = _observer("media_player.kitchen")
+    started = int(NOW.timestamp()) - 60
+    engine.restored_session = (player.session.track, started)
+
+    decision = engine.evaluate([player], NOW + timedelta(seconds=100))
+
+    assert decision.scrobbles["media_player.kitchen"]["timestamp"] == started
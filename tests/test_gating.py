@@ -0,0 +1,167 @@
+"""Test the scrobble conditions of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from datetime import datetime, time
+from unittest.mock import MagicMock
+
+from freezegun.api import FrozenDateTimeFactory
+import pytest
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.lastfm_scrobbler.gating import (
+    CHECK_MODE_ANY,
+    ScrobbleGate,
+    in_time_window,
+)
+
+
+@pytest.mark.parametrize(
+    ("now", "start", "end", "inside"),
+    [
+        (time(12), None, None, True),
+        (time(12), time(8), time(20), True),
+        (time(20), time(8), time(20), False),
+        (time(23), time(22), time(6), True),
+        (time(5), time(22), time(6), True),
+        (time(12), time(22), time(6), False),
+    ],
+)
+def test_in_time_window(now: time, start: time, end: time, inside: bool) -> None:
+    """Test daily windows, including those spanning midnight."""
+    assert in_time_window(now, start, end) is inside
+
+
+async def test_all_check_entities_must_agree(hass: HomeAssistant) -> None:
+    """Test the gate follows the check entities that change."""
+    hass.states.async_set("input_boolean.scrobble", "on")
+    hass.states.async_set("person.alex", "home")
+    on_change = MagicMock()
+    gate = ScrobbleGate(
+        hass, ["input_boolean.scrobble", "person.alex"], on_change=on_change
+    )
+    gate.async_start()
+
+    assert gate.allowed
+    on_change.assert_not_called()
+
+    hass.states.async_set("person.alex", "not_home")
+    await hass.async_block_till_done()
+
+    assert not gate.allowed
+    on_change.assert_called_once()
+
+    # an unrelated change of a check entity notifies nothing
+    hass.states.async_set("person.alex", "not_home", {"source": "gps"})
+    await hass.async_block_till_done()
+
+    on_change.assert_called_once()
+    gate.async_stop()
+
+
+async def test_any_check_entity_may_agree(hass: HomeAssistant) -> None:
+    """Test a single agreeing entity is enough in the any mode."""
+    hass.states.async_set("person.alex", "not_home")
+    hass.states.async_set("person.sam", "home")
+    gate = ScrobbleGate(
+        hass,
+        ["person.alex", "person.sam"],
+        mode=CHECK_MODE_ANY,
+        on_change=MagicMock(),
+    )
+    gate.async_start()
+
+    assert gate.allowed
+
+    hass.states.async_set("person.sam", "not_home")
+    await hass.async_block_till_done()
+
+    assert not gate.allowed
+    gate.async_stop()
+
+
+async def test_missing_check_entity_blocks(hass: HomeAssistant) -> None:
+    """Test an entity that doesn't exist prevents scrobbling."""
+    gate = ScrobbleGate(hass, ["switch.missing"], on_change=MagicMock())
+    gate.async_start()
+
+    assert not gate.allowed
+    gate.async_stop()
+
+
+async def test_zones(hass: HomeAssistant) -> None:
+    """Test located entities must be in one of the zones."""
+    hass.states.async_set(
+        "zone.office", "0", {"latitude": 52.52, "longitude": 13.40, "radius": 100}
+    )
+    hass.states.async_set(
+        "person.alex", "Office", {"latitude": 52.52, "longitude": 13.40}
+    )
+    gate = ScrobbleGate(
+        hass, ["person.alex"], zones=["zone.office"], on_change=MagicMock()
+    )
+    gate.async_start()
+
+    assert gate.allowed
+
+    hass.states.async_set(
+        "person.alex", "not_home", {"latitude": 48.85, "longitude": 2.35}
+    )
+    await hass.async_block_till_done()
+
+    assert not gate.allowed
+    gate.async_stop()
+
+
+async def test_template(hass: HomeAssistant) -> None:
+    """Test the template condition re-renders when what it references changes."""
+    hass.states.async_set("input_boolean.party", "off")
+    on_change = MagicMock()
+    gate = ScrobbleGate(
+        hass,
+        [],
+        template="{{ is_state('input_boolean.party', 'off') }}",
+        on_change=on_change,
+    )
+    gate.async_start()
+
+    assert gate.allowed
+
+    hass.states.async_set("input_boolean.party", "on")
+    await hass.async_block_till_done()
+
+    assert not gate.allowed
+    on_change.assert_called_once()
+    gate.async_stop()
+
+
+async def test_time_window(hass: HomeAssistant, freezer: FrozenDateTimeFactory) -> None:
+    """Test the gate opens and closes at the boundaries of its time window."""
+    today = dt_util.now().date()
+    freezer.move_to(
+        datetime.combine(today, time(21, 30), tzinfo=dt_util.get_default_time_zone())
+    )
+    on_change = MagicMock()
+    gate = ScrobbleGate(
+        hass,
+        [],
+        window_start=time(22),
+        window_end=time(6),
+        on_change=on_change,
+    )
+    gate.async_start()
+
+    assert not gate.allowed
+
+    freezer.move_to(
+        datetime.combine(today, time(22), tzinfo=dt_util.get_default_time_zone())
+    )
+    async_fire_time_changed(hass)
+    await hass.async_block_till_done()
+
+    assert gate.allowed
+    on_change.assert_called_once()
+    gate.async_stop()
@@ -0,0 +1,130 @@
+"""Test the scrobble history of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from collections.abc import Generator
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.lastfm_scrobbler.history import (
+    KIND_NOW_PLAYING,
+    KIND_SCROBBLE,
+    WRITE_BATCH,
+    WRITE_DELAY,
+    HistoryDatabase,
+    Play,
+    ScrobbleHistory,
+)
+
+KITCHEN = "media_player.kitchen"
+BEDROOM = "media_player.bedroom"
+
+
+def _play(
+    artist: str,
+    timestamp: int,
+    *,
+    entry_id: str = "first",
+    player: str = KITCHEN,
+    kind: str = KIND_SCROBBLE,
+) -> Play:
+    """Return a play of ``artist``."""
+    return Play(entry_id, player, kind, artist, "Song", "Album", 200, timestamp)
+
+
+@pytest.fixture
+def database(tmp_path: Path) -> Generator[HistoryDatabase]:
+    """Return an empty history database."""
+    database = HistoryDatabase(str(tmp_path / "history.db"))
+    yield database
+    database.close()
+
+
+def test_queries(database: HistoryDatabase) -> None:
+    """Test the statistics only count the scrobbles they are filtered to."""
+    database.insert(
+        [
+            _play("Artist A", 100),
+            _play("Artist A", 200),
+            _play("Artist B", 300, player=BEDROOM),
+            _play("Artist B", 400, entry_id="second"),
+            _play("Artist C", 500, kind=KIND_NOW_PLAYING),
+            _play("Artist C", 50),
+        ]
+    )
+
+    assert database.play_count(100) == 4
+    assert database.play_count(100, entry_id="first") == 3
+    assert database.play_count(0, player=BEDROOM) == 1
+    assert database.top_artists(100) == [("Artist A", 2), ("Artist B", 2)]
+    assert database.top_artists(0, entry_id="first", limit=1) == [("Artist A", 2)]
+    assert database.scrobbled("first", 100, 300) == {
+        ("Artist A", "Song", 100),
+        ("Artist A", "Song", 200),
+        ("Artist B", "Song", 300),
+    }
+
+
+def test_delete_entry(database: HistoryDatabase) -> None:
+    """Test the history of a removed config entry is deleted."""
+    database.insert([_play("Artist", 100), _play("Artist", 100, entry_id="second")])
+
+    database.delete_entry("first")
+
+    assert database.play_count(0) == 1
+    assert database.play_count(0, entry_id="first") == 0
+
+
+def test_reopen(database: HistoryDatabase, tmp_path: Path) -> None:
+    """Test the plays are kept when the database is opened again."""
+    database.insert([_play("Artist", 100)])
+    database.close()
+
+    assert HistoryDatabase(str(tmp_path / "history.db")).play_count(0) == 1
+
+
+async def test_plays_are_written_in_batches(
+    hass: HomeAssistant, database: HistoryDatabase
+) -> None:
+    """Test plays are buffered until the write delay or a full batch."""
+    history = ScrobbleHistory(hass)
+    history.database = database
+    history.async_record("first", KITCHEN, KIND_SCROBBLE, "Artist", "Song", None, 200)
+    await hass.async_block_till_done()
+
+    assert database.play_count(0) == 0
+
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=WRITE_DELAY))
+    await hass.async_block_till_done(wait_background_tasks=True)
+
+    assert database.play_count(0) == 1
+
+    for timestamp in range(WRITE_BATCH):
+        history.async_record(
+            "first", KITCHEN, KIND_SCROBBLE, "Artist", "Song", None, 200, timestamp
+        )
+    await hass.async_block_till_done(wait_background_tasks=True)
+
+    assert database.play_count(0) == 1 + WRITE_BATCH
+
+
+async def test_queries_include_buffered_plays(
+    hass: HomeAssistant, database: HistoryDatabase
+) -> None:
+    """Test a query sees the plays recorded right before it."""
+    history = ScrobbleHistory(hass)
+    history.database = database
+    history.async_record("first", KITCHEN, KIND_SCROBBLE, "Artist", "Song", None, 200)
+
+    assert await history.async_play_count(0) == 1
+    assert await history.async_top_artists(0, player=KITCHEN) == [("Artist", 1)]
+
+    await history.async_delete_entry("first")
+
+    assert await history.async_play_count(0) == 0
@@ -0,0 +1,90 @@
+"""Test the setup of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from unittest.mock import patch
+
+from homeassistant.const import CONF_API_KEY, CONF_ENTITY_ID, CONF_NAME, STATE_UNKNOWN
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.lastfm_scrobbler.const import (
+    CONF_API_SECRET,
+    CONF_CHECK_ENTITY,
+    CONF_SCROBBLE_PERCENTAGE,
+    CONF_SESSION_KEY,
+    CONF_UPDATE_NOW_PLAYING,
+    DOMAIN,
+)
+
+from .conftest import API_KEY, API_SECRET, SESSION_KEY, FakeLastFM
+
+CONFIG = {
+    CONF_NAME: "Living room",
+    CONF_API_KEY: API_KEY,
+    CONF_API_SECRET: API_SECRET,
+    CONF_SESSION_KEY: SESSION_KEY,
+    CONF_ENTITY_ID: ["media_player.living_room"],
+    CONF_CHECK_ENTITY: [],
+    CONF_SCROBBLE_PERCENTAGE: 50,
+    CONF_UPDATE_NOW_PLAYING: False,
+}
+SCROBBLER = "sensor.living_room"
+
+
+async def _async_setup(hass: HomeAssistant) -> MockConfigEntry:
+    """Set up a scrobbler entry."""
+    entry = MockConfigEntry(domain=DOMAIN, title="Living room", data=CONFIG)
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    return entry
+
+
+async def test_options_are_applied_without_reload(
+    hass: HomeAssistant, lastfm: FakeLastFM
+) -> None:
+    """Test changed options are applied to the running scrobbler."""
+    entry = await _async_setup(hass)
+    hass.states.async_set(
+        "media_player.bedroom",
+        "playing",
+        {
+            "media_artist": "Artist",
+            "media_title": "Song",
+            "media_duration": 200,
+            "media_position": 0,
+            "media_position_updated_at": dt_util.utcnow(),
+        },
+    )
+    await hass.async_block_till_done()
+
+    assert hass.states.get(SCROBBLER).state == STATE_UNKNOWN
+
+    with patch.object(hass.config_entries, "async_reload") as mock_reload:
+        hass.config_entries.async_update_entry(
+            entry, data={**CONFIG, CONF_ENTITY_ID: ["media_player.bedroom"]}
+        )
+        await hass.async_block_till_done()
+
+    mock_reload.assert_not_called()
+    assert hass.states.get(SCROBBLER).state == "Artist - Song"
+    assert hass.states.get(SCROBBLER).attributes["media_player"] == (
+        "media_player.bedroom"
+    )
+
+
+async def test_new_credentials_reload_the_entry(
+    hass: HomeAssistant, lastfm: FakeLastFM
+) -> None:
+    """Test new API credentials take a new client, so a reload."""
+    entry = await _async_setup(hass)
+
+    with patch.object(hass.config_entries, "async_reload") as mock_reload:
+        hass.config_entries.async_update_entry(
+            entry, data={**CONFIG, CONF_API_SECRET: "new-secret"}
+        )
+        await hass.async_block_till_done()
+
+    mock_reload.assert_called_once_with(entry.entry_id)
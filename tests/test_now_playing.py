@@ -0,0 +1,112 @@
+"""Test the now playing updates of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.lastfm_scrobbler.metadata import TrackInfo
+from custom_components.lastfm_scrobbler.now_playing import (
+    NOW_PLAYING_REFRESH,
+    NowPlayingDispatcher,
+)
+
+PLAYER = "media_player.kitchen"
+FIRST = TrackInfo("Artist", "First", "Album", 200)
+SECOND = TrackInfo("Artist", "Second", "Album", 200)
+THIRD = TrackInfo("Artist", "Third", "Album", 200)
+
+
+async def _async_wait(hass: HomeAssistant, seconds: float) -> None:
+    """Let ``seconds`` pass and the updates they trigger run."""
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=seconds))
+    await hass.async_block_till_done()
+
+
+async def test_rapid_changes_send_the_last_track(hass: HomeAssistant) -> None:
+    """Test skipping through tracks sends the one that settled, once."""
+    send = AsyncMock(return_value=True)
+    dispatcher = NowPlayingDispatcher(hass, send, delay=3)
+    for track in (FIRST, SECOND, THIRD):
+        dispatcher.async_request(track, PLAYER)
+        await _async_wait(hass, 1)
+
+    send.assert_not_called()
+
+    await _async_wait(hass, 3)
+
+    send.assert_awaited_once_with(THIRD, PLAYER)
+    dispatcher.async_stop()
+
+
+async def test_stopped_track_is_dropped(hass: HomeAssistant) -> None:
+    """Test a track that stopped during the delay is never sent."""
+    send = AsyncMock(return_value=True)
+    on_dropped = MagicMock()
+    dispatcher = NowPlayingDispatcher(hass, send, delay=3, on_dropped=on_dropped)
+    dispatcher.async_request(FIRST, PLAYER)
+    dispatcher.async_playing(None, PLAYER)
+
+    await _async_wait(hass, 3)
+
+    send.assert_not_called()
+    on_dropped.assert_called_once()
+
+
+async def test_playing_track_is_refreshed(hass: HomeAssistant) -> None:
+    """Test the sent track is re-sent while it keeps playing, and only then."""
+    send = AsyncMock(return_value=True)
+    dispatcher = NowPlayingDispatcher(hass, send, delay=0)
+    dispatcher.async_request(FIRST, PLAYER)
+    await hass.async_block_till_done()
+    dispatcher.async_playing(FIRST, PLAYER)
+
+    assert send.await_count == 1
+
+    await _async_wait(hass, NOW_PLAYING_REFRESH)
+
+    assert send.await_count == 2
+
+    dispatcher.async_playing(None, PLAYER)
+    await _async_wait(hass, 2 * NOW_PLAYING_REFRESH)
+
+    assert send.await_count == 2
+
+
+async def test_rejected_track_is_not_refreshed(hass: HomeAssistant) -> None:
+    """Test a track Last.fm didn't accept isn't re-sent."""
+    send = AsyncMock(return_value=False)
+    dispatcher = NowPlayingDispatcher(hass, send, delay=0)
+    dispatcher.async_request(FIRST, PLAYER)
+    await hass.async_block_till_done()
+
+    await _async_wait(hass, NOW_PLAYING_REFRESH)
+
+    send.assert_awaited_once()
+    dispatcher.async_stop()
+
+
+async def test_newer_track_cancels_the_running_update(hass: HomeAssistant) -> None:
+    """Test an update still running when a newer track settles is cancelled."""
+    released = asyncio.Event()
+    sent: list[str] = []
+
+    async def _async_send(track: TrackInfo, player: str | None) -> bool:
+        await released.wait()
+        sent.append(track.title)
+        return True
+
+    dispatcher = NowPlayingDispatcher(hass, _async_send, delay=0)
+    dispatcher.async_request(FIRST, PLAYER)
+    await asyncio.sleep(0)
+    dispatcher.async_request(SECOND, PLAYER)
+    released.set()
+    await hass.async_block_till_done()
+
+    assert sent == ["Second"]
+    dispatcher.async_stop()
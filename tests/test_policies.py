@@ -0,0 +1,107 @@
+"""Test the scrobble policies of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from typing import Any
+
+import pytest
+
+from custom_components.lastfm_scrobbler.const import (
+    CONF_MIN_DURATION,
+    CONF_POLICIES,
+    CONF_SKIP_ARTISTS,
+    CONF_SKIP_CONTENT_TYPES,
+    CONF_SKIP_TITLES,
+)
+from custom_components.lastfm_scrobbler.metadata import TrackInfo
+from custom_components.lastfm_scrobbler.policies import (
+    DEFAULT_MIN_DURATION,
+    PolicyError,
+    ScrobblePolicies,
+)
+
+SONG = TrackInfo("Artist", "Song", "Album", 200)
+
+
+def test_defaults() -> None:
+    """Test tracks shorter than Last.fm accepts are skipped by default."""
+    policies = ScrobblePolicies.from_config({})
+    policy = policies.resolve("media_player.kitchen", None)
+
+    assert policy.min_duration == DEFAULT_MIN_DURATION
+    assert policy.allows(SONG)
+    assert not policy.allows(SONG._replace(duration=20))
+    # tracks without a duration can't be told apart
+    assert policy.allows(SONG._replace(duration=None))
+
+
+def test_skip_patterns() -> None:
+    """Test globs match whole values and slashed patterns are regexes."""
+    policy = ScrobblePolicies(
+        skip_artists=["*podcast*"], skip_titles=[r"/\bchime\b/"]
+    ).resolve("media_player.kitchen", None)
+
+    assert not policy.allows(SONG._replace(artist="The Daily Podcast"))
+    assert not policy.allows(SONG._replace(title="Door chime 2"))
+    assert policy.allows(SONG._replace(title="Chimes"))
+    assert policy.allows(SONG)
+
+
+def test_policies_override_by_player_and_content_type() -> None:
+    """Test a player policy overrides a content type policy and skip lists add up."""
+    policies = ScrobblePolicies(
+        min_duration=30,
+        skip_titles=["Intro"],
+        policies={
+            "media_player.kitchen": {
+                CONF_MIN_DURATION: 90,
+                "scrobble_percentage": 75,
+                CONF_SKIP_TITLES: ["Outro"],
+                CONF_SKIP_CONTENT_TYPES: ["podcast"],
+            },
+            "Episode": {CONF_MIN_DURATION: 600},
+            "tts": {"skip": True},
+        },
+    )
+
+    kitchen = policies.resolve("media_player.kitchen", "music")
+    assert kitchen.min_duration == 90
+    assert kitchen.scrobble_percentage == 75
+    assert not kitchen.allows(SONG._replace(title="Intro"))
+    assert not kitchen.allows(SONG._replace(title="Outro"))
+    assert policies.resolve("media_player.bedroom", "music").allows(
+        SONG._replace(title="Outro")
+    )
+
+    assert policies.resolve("media_player.bedroom", "episode").min_duration == 600
+    # the player policy wins over the content type one
+    assert policies.resolve("media_player.kitchen", "episode").min_duration == 90
+    assert policies.resolve("media_player.kitchen", "podcast").skip
+    assert not policies.resolve("media_player.bedroom", "podcast").skip
+    assert policies.resolve("media_player.bedroom", "TTS").skip
+
+
+@pytest.mark.parametrize(
+    ("config", "option"),
+    [
+        ({CONF_SKIP_ARTISTS: ["/(unclosed/"]}, CONF_SKIP_ARTISTS),
+        ({CONF_POLICIES: {"podcast": {CONF_SKIP_TITLES: ["/(?i)x/"]}}}, CONF_POLICIES),
+        ({CONF_POLICIES: ["podcast"]}, CONF_POLICIES),
+        ({CONF_POLICIES: {"podcast": "skip"}}, CONF_POLICIES),
+        ({CONF_POLICIES: {"podcast": {"unknown": 1}}}, CONF_POLICIES),
+        ({CONF_POLICIES: {"podcast": {CONF_MIN_DURATION: -1}}}, CONF_POLICIES),
+        ({CONF_POLICIES: {"podcast": {"scrobble_percentage": 101}}}, CONF_POLICIES),
+        ({CONF_POLICIES: {"podcast": {"skip": "yes"}}}, CONF_POLICIES),
+        ({CONF_POLICIES: {1: {"skip": True}}}, CONF_POLICIES),
+        (
+            {CONF_POLICIES: {"podcast": {CONF_SKIP_CONTENT_TYPES: ["tts"]}}},
+            CONF_POLICIES,
+        ),
+    ],
+)
+def test_invalid_policies(config: dict[str, Any], option: str) -> None:
+    """Test invalid options raise an error naming the option at fault."""
+    with pytest.raises(PolicyError) as exc_info:
+        ScrobblePolicies.from_config(config)
+
+    assert exc_info.value.option == option
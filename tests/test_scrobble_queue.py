@@ -0,0 +1,179 @@
+"""Test the scrobble queue of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from datetime import timedelta
+import time
+from typing import Any
+from unittest.mock import MagicMock
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import async_fire_time_changed
+
+from custom_components.lastfm_scrobbler.api import (
+    ERROR_INVALID_PARAMETERS,
+    LastFMClient,
+)
+from custom_components.lastfm_scrobbler.engine import Scrobble
+from custom_components.lastfm_scrobbler.scrobble_queue import (
+    BATCH_DELAY,
+    MAX_AGE,
+    MIN_RETRY_DELAY,
+    ScrobbleQueue,
+)
+
+from .conftest import SESSION_KEY, FakeLastFM
+
+ENTRY_ID = "entry"
+
+
+def _scrobble(title: str = "Song", age: int = 600) -> Scrobble:
+    """Return a play that started ``age`` seconds ago."""
+    return Scrobble(
+        artist="Artist",
+        track=title,
+        album="Album",
+        duration=200,
+        timestamp=int(time.time()) - age,
+    )
+
+
+async def _async_wait(hass: HomeAssistant, seconds: float) -> None:
+    """Let ``seconds`` pass and the flush they trigger run."""
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=seconds))
+    await hass.async_block_till_done(wait_background_tasks=True)
+
+
+async def test_flush_in_batches(
+    hass: HomeAssistant, lastfm: FakeLastFM, client: LastFMClient
+) -> None:
+    """Test pending scrobbles are submitted 50 at a time."""
+    queue = ScrobbleQueue(hass, ENTRY_ID, client, SESSION_KEY)
+    for index in range(120):
+        queue.async_add(_scrobble(f"Song {index}"))
+
+    await queue.async_flush()
+
+    assert [len(batch) for batch in lastfm.scrobbles] == [50, 50, 20]
+    assert queue.depth == 0
+    await queue.async_shutdown()
+
+
+async def test_plays_queued_together_are_submitted_together(
+    hass: HomeAssistant, lastfm: FakeLastFM, client: LastFMClient
+) -> None:
+    """Test plays queued within the batch delay take a single request."""
+    queue = ScrobbleQueue(hass, ENTRY_ID, client, SESSION_KEY)
+    queue.async_add(_scrobble("First"))
+    queue.async_add(_scrobble("Second"))
+    await hass.async_block_till_done(wait_background_tasks=True)
+
+    assert lastfm.scrobbles == []
+
+    await _async_wait(hass, BATCH_DELAY)
+
+    assert [[play["track"] for play in batch] for batch in lastfm.scrobbles] == [
+        ["First", "Second"]
+    ]
+    await queue.async_shutdown()
+
+
+async def test_retry_with_backoff(
+    hass: HomeAssistant, lastfm: FakeLastFM, client: LastFMClient
+) -> None:
+    """Test a failed submission is retried later and later."""
+    queue = ScrobbleQueue(hass, ENTRY_ID, client, SESSION_KEY)
+    queue.async_add(_scrobble())
+    lastfm.offline = True
+
+    await queue.async_flush()
+
+    assert queue.depth == 1
+    assert queue.diagnostics()["retry_delay"] == MIN_RETRY_DELAY
+
+    await _async_wait(hass, MIN_RETRY_DELAY)
+
+    assert queue.depth == 1
+    assert queue.diagnostics()["retry_delay"] == 2 * MIN_RETRY_DELAY
+
+    lastfm.offline = False
+    await _async_wait(hass, 2 * MIN_RETRY_DELAY)
+
+    assert queue.depth == 0
+    assert len(lastfm.scrobbles) == 1
+    assert queue.diagnostics()["retry_delay"] == 0
+    await queue.async_shutdown()
+
+
+async def test_expired_plays_are_dropped(
+    hass: HomeAssistant, lastfm: FakeLastFM, client: LastFMClient
+) -> None:
+    """Test plays Last.fm would reject for their age are never submitted."""
+    queue = ScrobbleQueue(hass, ENTRY_ID, client, SESSION_KEY)
+    queue.async_add(_scrobble("Expired", age=MAX_AGE + 60))
+    queue.async_add(_scrobble("Recent"))
+
+    await queue.async_flush()
+
+    assert [[play["track"] for play in batch] for batch in lastfm.scrobbles] == [
+        ["Recent"]
+    ]
+    assert queue.depth == 0
+    await queue.async_shutdown()
+
+
+async def test_rejected_batch_is_dropped(
+    hass: HomeAssistant, lastfm: FakeLastFM, client: LastFMClient
+) -> None:
+    """Test a batch Last.fm will never accept isn't retried."""
+    queue = ScrobbleQueue(hass, ENTRY_ID, client, SESSION_KEY)
+    queue.async_add(_scrobble())
+    lastfm.errors.append(ERROR_INVALID_PARAMETERS)
+
+    await queue.async_flush()
+
+    assert queue.depth == 0
+    assert queue.diagnostics()["retry_scheduled"] is False
+    await queue.async_shutdown()
+
+
+async def test_only_accepted_plays_are_recorded(
+    hass: HomeAssistant, lastfm: FakeLastFM, client: LastFMClient
+) -> None:
+    """Test plays Last.fm ignored don't reach the history."""
+    history = MagicMock()
+    queue = ScrobbleQueue(hass, ENTRY_ID, client, SESSION_KEY, history=history)
+    lastfm.ignored_titles.add("Ignored")
+    queue.async_add(_scrobble("Ignored"), "media_player.kitchen")
+    queue.async_add(_scrobble("Accepted"), "media_player.bedroom")
+
+    await queue.async_flush()
+
+    assert [
+        (call.args[1], call.args[4]) for call in history.async_record.call_args_list
+    ] == [("media_player.bedroom", "Accepted")]
+    await queue.async_shutdown()
+
+
+async def test_pending_plays_survive_a_restart(
+    hass: HomeAssistant,
+    hass_storage: dict[str, Any],
+    lastfm: FakeLastFM,
+    client: LastFMClient,
+) -> None:
+    """Test the plays pending at shutdown are loaded again."""
+    lastfm.offline = True
+    queue = ScrobbleQueue(hass, ENTRY_ID, client, SESSION_KEY)
+    queue.async_add(_scrobble(), "media_player.kitchen")
+    await queue.async_shutdown()
+
+    assert hass_storage[f"lastfm_scrobbler.queue.{ENTRY_ID}"]["data"]["players"] == [
+        "media_player.kitchen"
+    ]
+
+    queue = ScrobbleQueue(hass, ENTRY_ID, client, SESSION_KEY)
+    await queue.async_load()
+
+    assert [play["track"] for play in queue.pending] == ["Song"]
+    await queue.async_shutdown()
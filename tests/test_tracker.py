@@ -0,0 +1,118 @@
+"""Test the playback tracking of the lastfm_scrobbler integration."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from custom_components.lastfm_scrobbler.engine import PlayerObserver, ScrobblerEngine
+from custom_components.lastfm_scrobbler.tracker import (
+    PlaybackTracker,
+    current_position,
+    scrobble_threshold,
+)
+
+NOW = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+TRACK = ("Artist", "Song", "Album", "library://track/1")
+
+
+def _at(seconds: float) -> datetime:
+    """Return the point in time ``seconds`` after ``NOW``."""
+    return NOW + timedelta(seconds=seconds)
+
+
+@pytest.mark.parametrize(
+    ("duration", "percentage", "threshold"),
+    [(200, 50, 100), (300, 90, 240), (1000, 50, 240)],
+)
+def test_scrobble_threshold(duration: int, percentage: int, threshold: int) -> None:
+    """Test the threshold is a share of the duration, at most 4 minutes."""
+    assert scrobble_threshold(duration, percentage) == threshold
+
+
+def test_position_at_start_is_credited() -> None:
+    """Test a track first seen mid-play counts what was played before."""
+    tracker = PlaybackTracker(TRACK, 60, NOW)
+    tracker.update(True, NOW)
+
+    assert tracker.started == int(NOW.timestamp()) - 60
+    assert tracker.listened(_at(30)) == 90
+
+
+def test_pauses_do_not_count() -> None:
+    """Test only the time spent playing counts."""
+    tracker = PlaybackTracker(TRACK, 0, NOW)
+    tracker.update(True, NOW)
+    tracker.update(False, _at(30))
+
+    assert tracker.listened(_at(300)) == 30
+    assert tracker.deadline(100, _at(300)) is None
+
+    tracker.update(True, _at(300))
+
+    assert tracker.listened(_at(310)) == 40
+    assert tracker.deadline(100, _at(310)) == _at(370)
+
+
+def test_seek_does_not_bring_the_scrobble_closer() -> None:
+    """Test seeking to 90% of a track doesn't scrobble it."""
+    engine = ScrobblerEngine(50, False)
+    player = PlayerObserver("media_player.kitchen")
+    attributes = {
+        "media_artist": "Artist",
+        "media_title": "Song",
+        "media_duration": 200,
+        "media_position": 0,
+        "media_position_updated_at": NOW,
+    }
+    player.update("playing", attributes, NOW)
+    engine.evaluate([player], NOW)
+
+    player.update(
+        "playing",
+        {**attributes, "media_position": 180, "media_position_updated_at": _at(10)},
+        _at(10),
+    )
+    decision = engine.evaluate([player], _at(10))
+
+    assert decision.scrobbles == {}
+    assert decision.deadlines == {"media_player.kitchen": _at(100)}
+
+
+def test_current_position() -> None:
+    """Test the position is extrapolated from when it was reported."""
+    assert current_position({}, NOW) == 0
+    assert (
+        current_position(
+            {"media_position": 20, "media_position_updated_at": _at(-10)}, NOW
+        )
+        == 30
+    )
+    # as a UNIX timestamp, or a string of a recorded history
+    assert (
+        current_position(
+            {
+                "media_position": 20,
+                "media_position_updated_at": _at(-10).timestamp(),
+            },
+            NOW,
+        )
+        == 30
+    )
+    assert (
+        current_position(
+            {
+                "media_position": 20,
+                "media_position_updated_at": _at(-10).isoformat(),
+            },
+            NOW,
+        )
+        == 30
+    )
+    assert (
+        current_position(
+            {"media_position": 20, "media_position_updated_at": "yesterday"}, NOW
+        )
+        == 20
+    )